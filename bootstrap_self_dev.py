@@ -118,6 +118,7 @@ async def run_self_development():
         # راه‌اندازی
         with console.status("[bold green]Initializing system..."):
             orchestrator.initialize()
+            await orchestrator.llm_wrapper.startup()
         
         console.print("[green]✓[/green] System initialized\n")
         
@@ -225,6 +226,9 @@ async def run_self_development():
         traceback.print_exc()
         return False
     
+    finally:
+        await orchestrator.shutdown()
+    
     return True
 
 
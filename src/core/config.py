@@ -32,6 +32,24 @@ class LLMConfig:
     mcp: Dict[str, Any] = field(default_factory=dict)
     online: Dict[str, str] = field(default_factory=dict)
     fallback_online: bool = True
+    custom_api: Dict[str, Any] = field(default_factory=dict)
+    fallback_to_mcp: bool = False
+    connection_pool: Dict[str, Any] = field(default_factory=dict)
+    streaming: bool = False
+    response_cache: Dict[str, Any] = field(default_factory=dict)
+    coalesce_requests: bool = True
+    rate_limits: Dict[str, Any] = field(default_factory=dict)
+    timeouts: Dict[str, Any] = field(default_factory=dict)
+    retry_policy: Dict[str, Any] = field(default_factory=dict)
+    model_routing: Dict[str, Any] = field(default_factory=dict)
+    adaptive_concurrency: Dict[str, Any] = field(default_factory=dict)
+    hedging: Dict[str, Any] = field(default_factory=dict)
+    circuit_breaker: Dict[str, Any] = field(default_factory=dict)
+    context_retrieval: Dict[str, Any] = field(default_factory=dict)
+    continuation: Dict[str, Any] = field(default_factory=dict)
+    best_of_n: Dict[str, Any] = field(default_factory=dict)
+    edit_mode: Dict[str, Any] = field(default_factory=dict)
+    multi_file: Dict[str, Any] = field(default_factory=dict)
 
 
 @dataclass
@@ -41,6 +59,8 @@ class SchedulerConfig:
     max_concurrent_tasks: int = 2
     check_interval: int = 60
     cpu_threshold: int = 80
+    cache_ttl: float = 300.0  # عمر prompt cache provider (ثانیه)؛ 0 = فقط اولویت
+    cache_priority_slack: int = 0  # حداکثر فاصله اولویت برای جلو انداختن task هم‌پیشوند
 
 
 @dataclass
@@ -123,6 +143,7 @@ class ProjectConfig:
     rollback: RollbackConfig
     deploy: DeployConfig
     features: List[Feature]
+    cost_control: Dict[str, Any] = field(default_factory=dict)
 
 
 class ConfigLoader:
@@ -154,7 +175,25 @@ class ConfigLoader:
             offline_model=llm_data.get('offline_model', {}),
             mcp=llm_data.get('mcp', {}),
             online=llm_data.get('online', {}),
-            fallback_online=llm_data.get('fallback_online', True)
+            fallback_online=llm_data.get('fallback_online', True),
+            custom_api=llm_data.get('custom_api', {}),
+            fallback_to_mcp=llm_data.get('fallback_to_mcp', False),
+            connection_pool=llm_data.get('connection_pool', {}),
+            streaming=llm_data.get('streaming', False),
+            response_cache=llm_data.get('response_cache', {}),
+            coalesce_requests=llm_data.get('coalesce_requests', True),
+            rate_limits=llm_data.get('rate_limits', {}),
+            timeouts=llm_data.get('timeouts', {}),
+            retry_policy=llm_data.get('retry_policy', {}),
+            model_routing=llm_data.get('model_routing', {}),
+            adaptive_concurrency=llm_data.get('adaptive_concurrency', {}),
+            hedging=llm_data.get('hedging', {}),
+            circuit_breaker=llm_data.get('circuit_breaker', {}),
+            context_retrieval=llm_data.get('context_retrieval', {}),
+            continuation=llm_data.get('continuation', {}),
+            best_of_n=llm_data.get('best_of_n', {}),
+            edit_mode=llm_data.get('edit_mode', {}),
+            multi_file=llm_data.get('multi_file', {})
         )
         
         # Scheduler Config
@@ -163,7 +202,9 @@ class ConfigLoader:
             active_hours=scheduler_data.get('active_hours', {}),
             max_concurrent_tasks=scheduler_data.get('max_concurrent_tasks', 2),
             check_interval=scheduler_data.get('check_interval', 60),
-            cpu_threshold=scheduler_data.get('cpu_threshold', 80)
+            cpu_threshold=scheduler_data.get('cpu_threshold', 80),
+            cache_ttl=scheduler_data.get('cache_ttl', 300.0),
+            cache_priority_slack=scheduler_data.get('cache_priority_slack', 0)
         )
         
         # Git Config
@@ -247,7 +288,8 @@ class ConfigLoader:
             logging=logging_config,
             rollback=rollback_config,
             deploy=deploy_config,
-            features=features
+            features=features,
+            cost_control=data.get('cost_control', {})
         )
     
     def _validate_config(self) -> None:
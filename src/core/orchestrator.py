@@ -14,8 +14,13 @@ sys.path.append(str(Path(__file__).parent.parent))
 
 from core.config import ConfigLoader, Feature, Task, ProjectConfig
 from core.task_manager import TaskManager, TaskExecution, TaskResult, TaskStatus
-from llm.llama_wrapper import LLMWrapper, LLMRequest
+from llm.llama_wrapper import LLMWrapper, LLMRequest, LLMResponse
+from llm.prompt_cache import prefix_key
+from llm.context_index import ContextIndex
+from llm.symbol_index import SymbolIndex
+from llm.continuation import is_truncated
 from utils.logger import AutoDevLogger
+from utils.file_utils import AtomicFileWriter
 from reviewers.code_reviewer import AICodeReviewer
 
 
@@ -30,6 +35,9 @@ class Orchestrator:
 
         self.task_manager: Optional[TaskManager] = None
         self.llm_wrapper: Optional[LLMWrapper] = None
+        self.context_index: Optional[ContextIndex] = None
+        self.symbol_index: Optional[SymbolIndex] = None
+        self.repository_context: Optional[str] = None  # پیشوند ثابت مشترک همه prompt ها
         self.code_reviewer = AICodeReviewer(llm_wrapper=self.llm_wrapper)
 
         self.logger: Optional[AutoDevLogger] = None
@@ -61,7 +69,10 @@ class Orchestrator:
         
         # 3. راه‌اندازی Task Manager
         print("📊 راه‌اندازی Task Manager...")
-        self.task_manager = TaskManager()
+        self.task_manager = TaskManager(
+            cache_ttl=self.config.scheduler.cache_ttl,
+            cache_priority_slack=self.config.scheduler.cache_priority_slack
+        )
         self.task_manager.max_concurrent_tasks = self.config.scheduler.max_concurrent_tasks
         
         # 4. راه‌اندازی LLM
@@ -71,13 +82,70 @@ class Orchestrator:
             'mcp': self.config.llm.mcp,
             'offline_model': self.config.llm.offline_model,
             'online': self.config.llm.online,
-            'fallback_online': self.config.llm.fallback_online
+            'fallback_online': self.config.llm.fallback_online,
+            'custom_api': self.config.llm.custom_api,
+            'fallback_to_mcp': self.config.llm.fallback_to_mcp,
+            'connection_pool': self.config.llm.connection_pool,
+            'streaming': self.config.llm.streaming,
+            'response_cache': self.config.llm.response_cache,
+            'coalesce_requests': self.config.llm.coalesce_requests,
+            'rate_limits': self.config.llm.rate_limits,
+            'timeouts': self.config.llm.timeouts,
+            'retry_policy': self.config.llm.retry_policy,
+            'model_routing': self.config.llm.model_routing,
+            'adaptive_concurrency': self.config.llm.adaptive_concurrency,
+            'hedging': self.config.llm.hedging,
+            'circuit_breaker': self.config.llm.circuit_breaker,
+            'continuation': self.config.llm.continuation,
+            'best_of_n': self.config.llm.best_of_n,
+            'edit_mode': self.config.llm.edit_mode,
+            'multi_file': self.config.llm.multi_file,
+            'cost_control': self.config.cost_control
         }
         self.llm_wrapper = LLMWrapper(llm_config)
         print(f"✅ حالت LLM: {self.config.llm.mode.value}")
         
+        # 5. ایندکس بازیابی context از مخزن
+        retrieval_config = self.config.llm.context_retrieval
+        if retrieval_config.get('enabled', True):
+            print("🔎 ساخت ایندکس context مخزن...")
+            self.context_index = ContextIndex.from_config(retrieval_config)
+            indexed = self.context_index.refresh()
+            print(f"✅ ایندکس context: {len(self.context_index.files)} فایل ({indexed} به‌روزرسانی)")
+            
+            if retrieval_config.get('stub_token_budget', 600) > 0:
+                self.symbol_index = SymbolIndex.from_config(retrieval_config)
+                parsed = self.symbol_index.refresh()
+                print(f"✅ ایندکس symbol: {self.symbol_index.get_stats()['symbols']} symbol ({parsed} فایل parse شد)")
+        
+        self.repository_context = self._repository_context()
+        
         print("\n✅ راه‌اندازی کامل شد!\n")
     
+    def _repository_context(self) -> Optional[str]:
+        """context ثابت مخزن: نام پروژه و فهرست فایل‌ها در سقف repository_token_budget
+
+        یک بار در هر اجرا ساخته می‌شود و بین همه task ها و feature ها یکسان
+        می‌ماند تا پیشوند prompt در کش provider گرم بماند.
+        """
+        budget = self.config.llm.context_retrieval.get('repository_token_budget', 200)
+        if budget <= 0:
+            return None
+        
+        counter = self.llm_wrapper.token_counter
+        lines = [f"Project: {self.config.project_name} - {self.config.description}"]
+        used = counter.count(lines[0])
+        
+        paths = sorted(self.context_index.files) if self.context_index else []
+        for path in paths:
+            line = f"- {path}"
+            tokens = counter.count(line)
+            if used + tokens > budget:
+                break
+            lines.append(line)
+            used += tokens
+        return '\n'.join(lines)
+    
     def display_features(self):
         """نمایش features به کاربر"""
         print("=" * 70)
@@ -186,28 +254,93 @@ class Orchestrator:
                 task_name=task.name
             )
             
+            # ایندکس‌های context یک بار در هر task (نه در هر بازیابی) به‌روز می‌شوند
+            await self._refresh_indexes()
+            
             generated_files = []
-            for file_path in task.files:
+            generated_code = {}  # مسیر -> محتوا (برای مرحله تست، بدون خواندن دوباره از دیسک)
+            generation_requests = {}  # مسیر -> درخواست تولید (ادامه همان گفتگو در مرحله تست)
+            candidates = self._candidate_count(task_id, feature.name)
+            # best-of-N فقط در حالت غیر stream (نسخه‌ها قبل از نوشتن مقایسه می‌شوند)
+            streamed = self.llm_wrapper.streaming and candidates == 1
+            
+            # چند فایل کوچک جدید: همه در یک فراخوانی (فایل‌های جاافتاده جداگانه تولید می‌شوند)
+            prefetched = {}
+            if candidates == 1 and self._use_multi_file(task):
                 self.logger.log_llm_request(
                     prompt=task.description,
                     model=self.config.llm.mode.value,
                     tokens=0
                 )
-                
-                response = await self.llm_wrapper.generate_code(
+                prefetched = await self.llm_wrapper.generate_files(
                     task_description=task.description,
-                    file_path=file_path,
-                    context=f"Feature: {feature.description}"
+                    file_paths=task.files,
+                    context=f"Feature: {feature.description}",
+                    feature=feature.name,
+                    shared_context=self.repository_context,
+                    task=task.name,
+                    relevant_code=await self._retrieve_context(task, feature, task.files[0])
                 )
+            
+            for file_path in task.files:
+                response = prefetched.get(file_path)
+                written = False
+                
+                if response is None:
+                    self.logger.log_llm_request(
+                        prompt=task.description,
+                        model=self.config.llm.mode.value,
+                        tokens=0
+                    )
+                    
+                    relevant_code = await self._retrieve_context(task, feature, file_path)
+                    # فایل موجود: فقط بلوک‌های تغییر تولید می‌شوند (best-of-N کل فایل را مقایسه می‌کند)
+                    existing_code = self._existing_code(file_path) if candidates == 1 else None
+                    
+                    if existing_code is not None:
+                        response = await self.llm_wrapper.generate_edit(
+                            task_description=task.description,
+                            file_path=file_path,
+                            existing_code=existing_code,
+                            context=f"Feature: {feature.description}",
+                            feature=feature.name,
+                            shared_context=self.repository_context,
+                            task=task.name,
+                            relevant_code=relevant_code
+                        )
+                    elif streamed:
+                        # نوشتن تدریجی در فایل موقت و rename در پایان
+                        response = await self._stream_code_to_file(task, feature, file_path, relevant_code)
+                        written = True
+                    else:
+                        response = await self.llm_wrapper.generate_code(
+                            task_description=task.description,
+                            file_path=file_path,
+                            context=f"Feature: {feature.description}",
+                            feature=feature.name,
+                            shared_context=self.repository_context,
+                            task=task.name,
+                            relevant_code=relevant_code,
+                            candidates=candidates
+                        )
                 
                 if not response.success:
                     raise Exception(f"تولید کد ناموفق بود: {response.error}")
                 
+                # کد ناقص (حتی پس از درخواست‌های ادامه) ذخیره نمی‌شود
+                if is_truncated(response):
+                    raise Exception(
+                        f"کد تولید شده پس از {response.continuations} ادامه همچنان ناقص است: {file_path}"
+                    )
+                
                 # ذخیره کد تولید شده
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(response.content)
+                if not written:
+                    with open(file_path, 'w', encoding='utf-8') as f:
+                        f.write(response.content)
                 
                 generated_files.append(file_path)
+                generated_code[file_path] = response.content
+                generation_requests[file_path] = response.request
                 
                 feature_logger.info(
                     f"✅ فایل تولید شد: {file_path}",
@@ -223,12 +356,14 @@ class Orchestrator:
             # 3. تولید تست‌ها
             for i, test_path in enumerate(task.tests):
                 if i < len(generated_files):
-                    with open(generated_files[i], 'r', encoding='utf-8') as f:
-                        code = f.read()
-                    
+                    source_path = generated_files[i]
+                    # ادامه گفتگوی تولید همین فایل: system prompt و context ثابت از کش خوانده می‌شوند
                     test_response = await self.llm_wrapper.generate_tests(
-                        code=code,
-                        file_path=test_path
+                        code=generated_code[source_path],
+                        file_path=test_path,
+                        feature=feature.name,
+                        task=task.name,
+                        source_request=generation_requests[source_path]
                     )
                     
                     if test_response.success:
@@ -272,20 +407,154 @@ class Orchestrator:
                 duration=duration
             )
     
+    def _existing_code(self, file_path: str) -> Optional[str]:
+        """محتوای فایل موجود برای حالت ویرایش (None برای فایل جدید، کوچک یا حالت غیرفعال)"""
+        edit_mode = self.config.llm.edit_mode
+        path = Path(file_path)
+        if not edit_mode.get('enabled', False) or not path.is_file():
+            return None
+        
+        try:
+            content = path.read_text(encoding='utf-8')
+        except (OSError, UnicodeDecodeError):
+            return None
+        # بازنویسی فایل‌های کوچک ارزان‌تر از توضیح تغییرات است
+        if len(content.splitlines()) < edit_mode.get('min_lines', 40):
+            return None
+        return content
+    
+    def _use_multi_file(self, task: Task) -> bool:
+        """تولید همه فایل‌های task در یک فراخوانی: فقط برای چند فایل جدید یا کوچک"""
+        multi_file = self.config.llm.multi_file
+        if not multi_file.get('enabled', False):
+            return False
+        if not 2 <= len(task.files) <= multi_file.get('max_files', 6):
+            return False
+        # فایل‌هایی که در حالت ویرایش تولید می‌شوند جداگانه می‌مانند
+        return all(self._existing_code(file_path) is None for file_path in task.files)
+    
+    def _candidate_count(self, task_id: str, feature_name: str) -> int:
+        """تعداد نسخه‌های هم‌زمان: بیش از یک فقط برای task های پرشکست"""
+        best_of_n = self.config.llm.best_of_n
+        if not best_of_n.get('enabled', False):
+            return 1
+        
+        task_exec = self.task_manager.queue.tasks.get(task_id)
+        retries = task_exec.retry_count if task_exec else 0
+        if (retries >= best_of_n.get('min_retries', 1)
+                or self.task_manager.get_failure_rate(feature_name) >= best_of_n.get('min_failure_rate', 0.5)):
+            return max(best_of_n.get('candidates', 3), 1)
+        return 1
+    
+    async def _refresh_indexes(self):
+        """به‌روزرسانی افزایشی ایندکس‌های context (خارج از event loop)"""
+        if self.context_index:
+            await asyncio.to_thread(self.context_index.refresh)
+        if self.symbol_index:
+            await asyncio.to_thread(self.symbol_index.refresh)
+    
+    async def _retrieve_context(self, task: Task, feature: Feature, file_path: str) -> Optional[str]:
+        """context مرتبط مخزن برای این task در سقف token تعیین‌شده
+
+        ابتدا stub وابستگی‌ها (امضا و docstring، نه بدنه) و سپس تکه‌های مرتبط BM25.
+        فایل‌های خود task کنار گذاشته می‌شوند (در حالت ویرایش فایل هدف جداگانه ارسال می‌شود).
+        """
+        if not self.context_index:
+            return None
+        
+        retrieval_config = self.config.llm.context_retrieval
+        query = f"{task.name} {task.description} {feature.description} {file_path}"
+        sections = []
+        
+        # ایندکس و جستجو روی دیسک؛ خارج از event loop
+        if self.symbol_index:
+            stubs = await asyncio.to_thread(
+                self.symbol_index.stub_view,
+                file_path,
+                f"{task.description} {feature.description}",
+                retrieval_config.get('stub_token_budget', 600),
+                self.llm_wrapper.token_counter
+            )
+            if stubs:
+                sections.append(f"# Interfaces\n{stubs}")
+        
+        snippets = await asyncio.to_thread(
+            self.context_index.pack,
+            query,
+            retrieval_config.get('token_budget', 800),
+            self.llm_wrapper.token_counter,
+            retrieval_config.get('max_snippets', 8),
+            task.files
+        )
+        if snippets:
+            sections.append(snippets)
+        
+        return '\n\n'.join(sections) or None
+    
+    async def _stream_code_to_file(
+        self,
+        task: Task,
+        feature: Feature,
+        file_path: str,
+        relevant_code: Optional[str] = None
+    ) -> LLMResponse:
+        """تولید کد به صورت stream و نوشتن تدریجی آن در فایل"""
+        response = None
+        
+        with AtomicFileWriter(file_path) as writer:
+            async for chunk in self.llm_wrapper.generate_code_stream(
+                task_description=task.description,
+                file_path=file_path,
+                context=f"Feature: {feature.description}",
+                feature=feature.name,
+                shared_context=self.repository_context,
+                task=task.name,
+                relevant_code=relevant_code
+            ):
+                if chunk.done:
+                    response = chunk.response
+                else:
+                    writer.write(chunk.text)
+            
+            # فایل قبلی در صورت شکست یا خروجی ناقص دست نمی‌خورد
+            if not response.success or is_truncated(response):
+                writer.abort()
+        
+        if response.time_to_first_token is not None:
+            self.logger.info(
+                f"⚡ اولین token پس از {response.time_to_first_token:.2f}s ({file_path})",
+                task_name=task.name
+            )
+        
+        return response
+    
+    def _prefix_key(self, feature: Feature) -> str:
+        """کلید پیشوند مشترک prompt task های یک feature (system prompt و context ثابت)"""
+        request = self.llm_wrapper.build_code_request(
+            "", "", f"Feature: {feature.description}", feature.name, self.repository_context
+        )
+        return prefix_key(request)
+    
     async def process_feature(self, feature: Feature):
         """پردازش یک feature کامل"""
-        self.current_feature = feature.name
-        
-        print(f"\n{'='*70}")
-        print(f"📦 شروع Feature: {feature.name}")
-        print(f"{'='*70}\n")
+        await self.process_features([feature])
+    
+    async def process_features(self, features: List[Feature]):
+        """پردازش چند feature در یک صف مشترک
+
+        task ها با کلید پیشوند ثابت prompt خود در صف قرار می‌گیرند تا ترتیب
+        cache-local صف (scheduler.cache_ttl) بین features هم اعمال شود.
+        """
+        features_by_name = {feature.name: feature for feature in features}
         
         # اضافه کردن tasks به صف
-        self.task_manager.add_feature_tasks(
-            feature.name,
-            feature.tasks,
-            feature.priority
-        )
+        for feature in features:
+            self.task_manager.add_feature_tasks(
+                feature.name,
+                feature.tasks,
+                feature.priority,
+                cache_key=self._prefix_key(feature)
+            )
         
         # پردازش tasks
         while True:
@@ -298,25 +567,33 @@ class Orchestrator:
                     await asyncio.sleep(2)
                     continue
                 else:
-                    # همه tasks این feature تمام شد
+                    # همه tasks تمام شد
                     break
             
             # یافتن Task object
+            feature = features_by_name.get(task_exec.feature_name)
             task = next(
                 (t for t in feature.tasks if t.name == task_exec.task_name),
                 None
-            )
+            ) if feature else None
             
             if not task:
                 continue
             
+            if feature.name != self.current_feature:
+                self.current_feature = feature.name
+                print(f"\n{'='*70}")
+                print(f"📦 شروع Feature: {feature.name}")
+                print(f"{'='*70}\n")
+            
             # شروع task
             task_id = self.task_manager.start_task(task_exec)
             
             # اجرای task
             result = await self.execute_task(task, feature)
             
-            # ثبت نتیجه
+            # ثبت نتیجه (نرخ موفقیت مدل‌ها در مسیریابی هم از همین نتیجه است)
+            self.llm_wrapper.record_task_result(feature.name, task.name, result.success)
             if result.success:
                 self.task_manager.complete_task(task_id, result)
 
@@ -342,11 +619,12 @@ class Orchestrator:
                 self.task_manager.fail_task(task_id, result, retry=True)
         
         # نمایش پیشرفت
-        progress = self.task_manager.get_feature_progress(feature.name)
-        print(f"\n📊 پیشرفت {feature.name}:")
-        print(f"   ✅ تکمیل شده: {progress['completed']}/{progress['total']}")
-        print(f"   ❌ ناموفق: {progress['failed']}")
-        print(f"   📈 درصد: {progress['progress_percent']:.1f}%")
+        for feature in features:
+            progress = self.task_manager.get_feature_progress(feature.name)
+            print(f"\n📊 پیشرفت {feature.name}:")
+            print(f"   ✅ تکمیل شده: {progress['completed']}/{progress['total']}")
+            print(f"   ❌ ناموفق: {progress['failed']}")
+            print(f"   📈 درصد: {progress['progress_percent']:.1f}%")
     
     async def run(self):
         """اجرای اصلی سیستم"""
@@ -355,6 +633,7 @@ class Orchestrator:
         try:
             # راه‌اندازی
             self.initialize()
+            await self.llm_wrapper.startup()
             
             # درخواست تایید
             approved_features = await self.request_approval()
@@ -365,9 +644,8 @@ class Orchestrator:
             
             print(f"\n🎯 {len(approved_features)} feature تایید شد. شروع توسعه...\n")
             
-            # پردازش features
-            for feature in approved_features:
-                await self.process_feature(feature)
+            # پردازش features در یک صف مشترک (ترتیب اولویت و محلی بودن prompt cache)
+            await self.process_features(approved_features)
             
             # نمایش آمار نهایی
             stats = self.task_manager.get_statistics()
@@ -392,6 +670,71 @@ class Orchestrator:
         
         finally:
             self.is_running = False
+            await self.shutdown()
+    
+    async def shutdown(self):
+        """بستن اتصال‌های باز LLM"""
+        if not self.llm_wrapper:
+            return
+        
+        if self.logger:
+            ledger = self.llm_wrapper.get_cost_summary()['ledger']
+            self.logger.info(
+                f"💰 دفتر هزینه: کل ${ledger['total_cost']}، امروز ${ledger['today_cost']}، "
+                f"باقی‌مانده ${ledger['remaining']}"
+            )
+            
+            for name, client_stats in self.llm_wrapper.get_connection_stats().items():
+                self.logger.debug(
+                    f"🔌 اتصال‌های {name}: "
+                    f"reused={client_stats['connections_reused']}, "
+                    f"created={client_stats['connections_created']}"
+                )
+            
+            for name, timeout_stats in self.llm_wrapper.get_timeout_stats().items():
+                timings = timeout_stats['timings']
+                self.logger.debug(
+                    f"⏱️  زمان‌بندی {name}: "
+                    + ", ".join(f"{phase} p50={t['p50']}s p95={t['p95']}s" for phase, t in timings.items())
+                    + f" | timeouts={timeout_stats['timeouts']}"
+                )
+            
+            retries = self.llm_wrapper.get_retry_stats()
+            self.logger.debug(
+                f"🔁 Retry: {retries['retries']} (انتظار {retries['wait_time']}s)، "
+                f"قطعی={retries['fatal']}، مهلت تمام‌شده={retries['deadline_exceeded']}، "
+                f"خطاها={retries['errors']}"
+            )
+            
+            routing = self.llm_wrapper.get_routing_stats()
+            if routing:
+                self.logger.debug(
+                    f"🧭 مسیریابی مدل: {routing['routed']} "
+                    f"(ارتقا={routing['escalations']}، نرخ موفقیت={routing['success_rates']})"
+                )
+            
+            concurrency = self.llm_wrapper.get_concurrency_stats()
+            if concurrency['enabled']:
+                self.logger.debug(
+                    f"🎚️  سقف هم‌زمانی LLM: {concurrency['limit']} "
+                    f"(max_in_flight={concurrency['max_in_flight']}, "
+                    f"decreases={concurrency['decreases']})"
+                )
+            
+            for name, breaker in self.llm_wrapper.get_circuit_stats().items():
+                self.logger.debug(
+                    f"🔌 Circuit {name}: {breaker['state']} "
+                    f"(opened={breaker['opened']}, rejected={breaker['rejected']})"
+                )
+            
+            for feature, cache_stats in self.llm_wrapper.get_cost_summary()['prompt_cache'].items():
+                self.logger.debug(
+                    f"🧊 Prompt cache {feature}: "
+                    f"token_hit_rate={cache_stats['token_hit_rate']:.0%}, "
+                    f"request_hit_rate={cache_stats['request_hit_rate']:.0%}"
+                )
+
+        await self.llm_wrapper.close()
 
 
 # نقطه ورود
@@ -3,13 +3,15 @@ Task Manager - مدیریت صف وظایف و وضعیت‌ها
 """
 
 import asyncio
+import heapq
+import threading
+import time
 from typing import List, Optional, Dict, Any
 from dataclasses import dataclass, field
 from enum import Enum
 from datetime import datetime
 import json
 from pathlib import Path
-from queue import PriorityQueue
 
 
 class TaskStatus(Enum):
@@ -44,17 +46,31 @@ class TaskExecution:
     result: Optional[TaskResult] = None
     retry_count: int = 0
     max_retries: int = 3
+    cache_key: Optional[str] = None  # پیشوند مشترک prompt (feature، context)
 
 
 class TaskQueue:
-    """صف اولویت‌دار وظایف"""
+    """صف اولویت‌دار وظایف
+
+    با cache_ttl > 0 ترتیب صف به محلی بودن prompt cache توجه می‌کند: بین task
+    هایی که اولویتشان حداکثر priority_slack از بهترین اولویت صف فاصله دارد،
+    taskی انتخاب می‌شود که پیشوند مشترکش (cache_key) در cache_ttl ثانیه اخیر
+    ارسال شده و هنوز در کش provider گرم است.
+    صف یک heap از (priority, task_id) است که با قفل خود TaskQueue محافظت می‌شود.
+    """
     
-    def __init__(self):
-        self.queue = PriorityQueue()
+    def __init__(self, cache_ttl: float = 0.0, priority_slack: int = 0):
+        self._heap: List[tuple] = []
+        self._lock = threading.Lock()
         self.tasks: Dict[str, TaskExecution] = {}
         self.running_tasks: List[str] = []
+        
+        self.cache_ttl = cache_ttl
+        self.priority_slack = priority_slack
+        self.warm_prefixes: Dict[str, float] = {}  # cache_key -> زمان آخرین ارسال
+        self.cache_local_picks = 0
     
-    def add_task(self, feature_name: str, task_name: str, priority: int):
+    def add_task(self, feature_name: str, task_name: str, priority: int, cache_key: Optional[str] = None):
         """اضافه کردن task به صف"""
         task_id = f"{feature_name}.{task_name}"
         
@@ -62,18 +78,66 @@ class TaskQueue:
             execution = TaskExecution(
                 task_name=task_name,
                 feature_name=feature_name,
-                status=TaskStatus.PENDING
+                status=TaskStatus.PENDING,
+                cache_key=cache_key or feature_name
             )
             self.tasks[task_id] = execution
-            self.queue.put((priority, task_id))
+            with self._lock:
+                heapq.heappush(self._heap, (priority, task_id))
+    
+    def requeue(self, task_id: str, priority: int):
+        """بازگرداندن task به صف (برای retry)"""
+        with self._lock:
+            heapq.heappush(self._heap, (priority, task_id))
+    
+    def _warm_age(self, cache_key: Optional[str], now: float) -> Optional[float]:
+        """چند ثانیه از آخرین ارسال این پیشوند گذشته (None اگر کش سرد است)"""
+        sent_at = self.warm_prefixes.get(cache_key)
+        if sent_at is None or now - sent_at >= self.cache_ttl:
+            return None
+        return now - sent_at
+    
+    def _pick_cache_local(self, now: float) -> Optional[tuple]:
+        """انتخاب task هم‌پیشوند با یک ارسال اخیر در محدوده اولویت مجاز (زیر قفل)"""
+        best_priority = self._heap[0][0]
+        
+        candidates = []
+        for entry in self._heap:
+            priority, task_id = entry
+            if priority > best_priority + self.priority_slack:
+                continue
+            execution = self.tasks.get(task_id)
+            age = self._warm_age(execution.cache_key if execution else None, now)
+            if age is not None:
+                # تازه‌ترین پیشوند اول تا task های یک گروه پشت سر هم بمانند
+                candidates.append((age, priority, task_id))
+        
+        if not candidates:
+            return None
+        
+        _, priority, task_id = min(candidates)
+        return priority, task_id
     
     def get_next_task(self) -> Optional[TaskExecution]:
         """دریافت task بعدی از صف"""
-        if self.queue.empty():
-            return None
+        now = time.monotonic()
+        with self._lock:
+            if not self._heap:
+                return None
+            
+            entry = self._pick_cache_local(now) if self.cache_ttl > 0 else None
+            if entry is not None and entry != self._heap[0]:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                self.cache_local_picks += 1
+            else:
+                entry = heapq.heappop(self._heap)
         
-        _, task_id = self.queue.get()
-        return self.tasks.get(task_id)
+        _, task_id = entry
+        execution = self.tasks.get(task_id)
+        if execution:
+            self.warm_prefixes[execution.cache_key or execution.feature_name] = now
+        return execution
     
     def mark_running(self, task_id: str):
         """علامت‌گذاری task به عنوان در حال اجرا"""
@@ -106,24 +170,39 @@ class TaskQueue:
     
     def is_empty(self) -> bool:
         """بررسی خالی بودن صف"""
-        return self.queue.empty()
+        with self._lock:
+            return not self._heap
 
 
 class TaskManager:
     """مدیر اصلی وظایف"""
     
-    def __init__(self, state_file: str = "./task_state.json"):
-        self.queue = TaskQueue()
+    def __init__(
+        self,
+        state_file: str = "./task_state.json",
+        cache_ttl: float = 0.0,
+        cache_priority_slack: int = 0
+    ):
+        self.queue = TaskQueue(cache_ttl=cache_ttl, priority_slack=cache_priority_slack)
         self.state_file = Path(state_file)
         self.max_concurrent_tasks = 2
         
         # بازیابی وضعیت قبلی در صورت وجود
         self._load_state()
     
-    def add_feature_tasks(self, feature_name: str, tasks: List[Any], priority: int):
-        """اضافه کردن تمام task های یک feature"""
+    def add_feature_tasks(
+        self,
+        feature_name: str,
+        tasks: List[Any],
+        priority: int,
+        cache_key: Optional[str] = None
+    ):
+        """اضافه کردن تمام task های یک feature
+
+        cache_key پیشوند مشترک prompt این task هاست (پیش‌فرض: نام feature).
+        """
         for task in tasks:
-            self.queue.add_task(feature_name, task.name, priority)
+            self.queue.add_task(feature_name, task.name, priority, cache_key)
     
     def can_start_new_task(self) -> bool:
         """بررسی امکان شروع task جدید"""
@@ -157,7 +236,7 @@ class TaskManager:
             task_exec.retry_count += 1
             task_exec.status = TaskStatus.PENDING
             priority = 0  # اولویت بالا برای retry
-            self.queue.queue.put((priority, task_id))
+            self.queue.requeue(task_id, priority)
             if task_id in self.queue.running_tasks:
                 self.queue.running_tasks.remove(task_id)
         else:
@@ -202,6 +281,14 @@ class TaskManager:
             'progress_percent': (completed / total * 100) if total > 0 else 0
         }
     
+    def get_failure_rate(self, feature_name: str) -> float:
+        """نرخ شکست تلاش‌های تمام‌شده task های یک feature (هر retry یک شکست است)"""
+        finished = (TaskStatus.COMPLETED, TaskStatus.FAILED)
+        feature_tasks = [t for t in self.queue.tasks.values() if t.feature_name == feature_name]
+        attempts = sum(t.retry_count + (t.status in finished) for t in feature_tasks)
+        failures = sum(t.retry_count + (t.status == TaskStatus.FAILED) for t in feature_tasks)
+        return failures / attempts if attempts else 0.0
+    
     def _save_state(self):
         """ذخیره وضعیت task ها"""
         state = {}
@@ -213,6 +300,7 @@ class TaskManager:
                 'start_time': task_exec.start_time.isoformat() if task_exec.start_time else None,
                 'end_time': task_exec.end_time.isoformat() if task_exec.end_time else None,
                 'retry_count': task_exec.retry_count,
+                'cache_key': task_exec.cache_key,
                 'result': {
                     'success': task_exec.result.success,
                     'output': task_exec.result.output,
@@ -254,7 +342,8 @@ class TaskManager:
                     start_time=datetime.fromisoformat(task_data['start_time']) if task_data['start_time'] else None,
                     end_time=datetime.fromisoformat(task_data['end_time']) if task_data['end_time'] else None,
                     result=result,
-                    retry_count=task_data['retry_count']
+                    retry_count=task_data['retry_count'],
+                    cache_key=task_data.get('cache_key')
                 )
                 
                 self.queue.tasks[task_id] = task_exec
@@ -288,6 +377,7 @@ class TaskManager:
             'failed': len([t for t in all_tasks if t.status == TaskStatus.FAILED]),
             'running': len([t for t in all_tasks if t.status == TaskStatus.RUNNING]),
             'pending': len([t for t in all_tasks if t.status == TaskStatus.PENDING]),
+            'cache_local_picks': self.queue.cache_local_picks,
             'average_duration': sum(
                 t.result.duration for t in all_tasks 
                 if t.result and t.status == TaskStatus.COMPLETED
@@ -0,0 +1,190 @@
+"""
+Adaptive Concurrency - کنترل تطبیقی تعداد درخواست‌های هم‌زمان (AIMD)
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, AsyncIterator
+
+# دسته‌های classify_error که نشانه بار زیاد سرور هستند (429، 5xx، timeout)
+OVERLOAD_KINDS = {'rate_limit', 'server', 'timeout'}
+
+
+def is_overload_error(response) -> bool:
+    """آیا پاسخ ناموفق (LLMResponse) نشانه بار زیاد upstream است (نه خطای درخواست)"""
+    return response.error_kind in OVERLOAD_KINDS
+
+
+class ConcurrencySlot:
+    """یک جایگاه در حال اجرا؛ نتیجه درخواست با record ثبت می‌شود"""
+    
+    def __init__(self, limiter: 'AdaptiveConcurrencyLimiter'):
+        self.limiter = limiter
+        self.started_at = time.monotonic()
+        self.recorded = False
+    
+    def record(self, response):
+        """ثبت نتیجه (LLMResponse) برای تنظیم سقف"""
+        if self.recorded:
+            return
+        self.recorded = True
+        self.limiter.on_result(self, response)
+
+
+class AdaptiveConcurrencyLimiter:
+    """سقف هم‌زمانی AIMD
+
+    با هر پاسخ سالم سقف به اندازه increase/limit بالا می‌رود (حدود +increase
+    در هر دور کامل)، و با 429/5xx/timeout یا تأخیر بیش از حد، در
+    decrease_factor ضرب می‌شود. خطاهای یک دور فقط یک بار سقف را کم می‌کنند.
+    """
+    
+    def __init__(
+        self,
+        enabled: bool = True,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        history_size: int = 100
+    ):
+        self.enabled = enabled
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        self.baseline_latency: Optional[float] = None  # ثانیه به ازای هر token
+        self.last_decrease_at = 0.0
+        
+        self.history: deque = deque(maxlen=history_size)
+        self._condition: Optional[asyncio.Condition] = None
+        self._condition_loop = None
+        
+        self.stats = {
+            'requests': 0,
+            'waits': 0,
+            'increases': 0,
+            'decreases': 0,
+            'overloads': 0,
+            'max_in_flight': 0
+        }
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'AdaptiveConcurrencyLimiter':
+        """ساخت از بخش adaptive_concurrency تنظیمات"""
+        config = config or {}
+        return cls(
+            enabled=config.get('enabled', False),
+            initial_limit=config.get('initial_limit', 4),
+            min_limit=config.get('min_limit', 1),
+            max_limit=config.get('max_limit', 32),
+            increase=config.get('increase', 1.0),
+            decrease_factor=config.get('decrease_factor', 0.5),
+            latency_tolerance=config.get('latency_tolerance', 2.0)
+        )
+    
+    @property
+    def current_limit(self) -> int:
+        """سقف صحیح فعلی"""
+        return max(int(self.limit), self.min_limit)
+    
+    def _get_condition(self) -> asyncio.Condition:
+        """Condition مخصوص event loop جاری"""
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._condition_loop is not loop:
+            self._condition = asyncio.Condition()
+            self._condition_loop = loop
+        return self._condition
+    
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[ConcurrencySlot]:
+        """گرفتن یک جایگاه (در صورت پر بودن، صبر) تا پایان درخواست"""
+        if not self.enabled:
+            yield ConcurrencySlot(self)
+            return
+        
+        condition = self._get_condition()
+        async with condition:
+            if self.in_flight >= self.current_limit:
+                self.stats['waits'] += 1
+                await condition.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+            self.stats['requests'] += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.in_flight)
+        
+        slot = ConcurrencySlot(self)
+        try:
+            yield slot
+        finally:
+            async with condition:
+                self.in_flight -= 1
+                condition.notify_all()
+    
+    def _set_limit(self, limit: float, reason: str):
+        """تغییر سقف و ثبت در تاریخچه (فقط وقتی سقف صحیح عوض شود)"""
+        previous = self.current_limit
+        self.limit = min(max(limit, self.min_limit), self.max_limit)
+        if self.current_limit != previous:
+            self.history.append({
+                'time': time.time(),
+                'limit': self.current_limit,
+                'reason': reason
+            })
+    
+    def on_result(self, slot: ConcurrencySlot, response):
+        """تنظیم سقف بر اساس نتیجه یک درخواست"""
+        if not self.enabled:
+            return
+        
+        if not response.success:
+            if not is_overload_error(response):
+                return  # خطای درخواست، نه بار سرور
+            self.stats['overloads'] += 1
+            self._decrease(slot, 'overload')
+            return
+        
+        latency = response.duration / max(response.tokens_used, 1)
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        
+        if latency > self.baseline_latency * self.latency_tolerance:
+            self._decrease(slot, 'latency')
+            return
+        
+        # baseline آهسته به سمت تأخیر سالم حرکت می‌کند
+        self.baseline_latency += 0.1 * (latency - self.baseline_latency)
+        
+        # افزایش فقط وقتی سقف واقعاً پر شده بود
+        if self.in_flight >= self.current_limit and self.limit < self.max_limit:
+            self.stats['increases'] += 1
+            self._set_limit(self.limit + self.increase / self.limit, 'healthy')
+    
+    def _decrease(self, slot: ConcurrencySlot, reason: str):
+        """کاهش ضربی (یک بار برای درخواست‌هایی که قبل از کاهش قبلی شروع شده‌اند)"""
+        if slot.started_at < self.last_decrease_at:
+            return
+        self.last_decrease_at = time.monotonic()
+        self.stats['decreases'] += 1
+        self._set_limit(self.limit * self.decrease_factor, reason)
+    
+    def get_history(self) -> List[Dict[str, Any]]:
+        """تاریخچه تغییرات سقف"""
+        return list(self.history)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار و سقف فعلی"""
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'limit': self.current_limit,
+            'in_flight': self.in_flight,
+            'baseline_latency': round(self.baseline_latency, 4) if self.baseline_latency else None
+        }
@@ -0,0 +1,62 @@
+"""
+Best-of-N - تولید هم‌زمان چند نسخه از یک کد و انتخاب بهترین با code reviewer
+"""
+
+import asyncio
+from dataclasses import replace
+from typing import List, Optional, Tuple
+
+from llm.continuation import is_truncated
+
+
+def candidate_temperatures(base: float, count: int, spread: float, max_temperature: float = 1.0) -> List[float]:
+    """دمای هر نسخه: اولی همان دمای اصلی، بقیه به تدریج تا base + spread"""
+    if count <= 1:
+        return [base]
+    step = spread / (count - 1)
+    return [round(min(base + i * step, max_temperature), 3) for i in range(count)]
+
+
+def score_key(review) -> Tuple[float, int, int]:
+    """کلید مقایسه: نمره کیفیت، سپس تعداد کمتر مشکلات critical و high"""
+    critical = sum(1 for issue in review.issues if issue.severity.value == 'critical')
+    high = sum(1 for issue in review.issues if issue.severity.value == 'high')
+    return (review.quality_score, -critical, -high)
+
+
+async def select_best(responses, reviewer, file_path: str):
+    """بررسی موازی نسخه‌های موفق و کامل و انتخاب بهترین
+
+    review_code همگام و CPU-bound است و در thread اجرا می‌شود.
+
+    Returns:
+        (بهترین پاسخ یا None، نتیجه review آن یا None، نمره همه نسخه‌های بررسی‌شده)
+    """
+    usable = [r for r in responses if r.success and r.content and not is_truncated(r)]
+    if not usable:
+        return None, None, []
+    
+    reviews = await asyncio.gather(*[
+        asyncio.to_thread(reviewer.review_code, r.content, file_path) for r in usable
+    ])
+    
+    best_index = max(range(len(usable)), key=lambda i: score_key(reviews[i]))
+    return usable[best_index], reviews[best_index], [review.quality_score for review in reviews]
+
+
+def combine_candidates(best, responses, duration: float):
+    """پاسخ انتخاب‌شده با مصرف (token و هزینه) همه نسخه‌ها و زمان واقعی کل"""
+    return replace(
+        best,
+        tokens_used=sum(r.tokens_used for r in responses),
+        cost=sum(r.cost for r in responses),
+        duration=duration,
+        input_tokens=sum(r.input_tokens for r in responses),
+        cache_creation_tokens=sum(r.cache_creation_tokens for r in responses),
+        cache_read_tokens=sum(r.cache_read_tokens for r in responses)
+    )
+
+
+def first_failure(responses) -> Optional[object]:
+    """اولین پاسخ ناموفق (برای گزارش خطا وقتی هیچ نسخه‌ای قابل استفاده نیست)"""
+    return next((r for r in responses if not r.success), responses[0] if responses else None)
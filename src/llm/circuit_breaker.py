@@ -0,0 +1,168 @@
+"""
+Circuit Breaker - رد سریع درخواست‌ها به provider ناسالم
+"""
+
+import time
+from collections import deque
+from enum import Enum
+from typing import Optional, Dict, Any
+
+from llm.adaptive_concurrency import OVERLOAD_KINDS
+
+# دسته‌های classify_error که نشانه ناسالم بودن provider هستند؛ خطاهای خود
+# درخواست (client، context_length، deadline) در نرخ خطا شمرده نمی‌شوند
+UNHEALTHY_KINDS = OVERLOAD_KINDS | {'connection', 'unknown'}
+
+
+class CircuitState(Enum):
+    """وضعیت breaker"""
+    CLOSED = "closed"          # عادی
+    OPEN = "open"              # provider رد می‌شود
+    HALF_OPEN = "half_open"    # ارسال درخواست آزمایشی
+
+
+class CircuitBreaker:
+    """Circuit breaker با پنجره نرخ خطا
+
+    وقتی در پنجره آخرین window_size درخواست (حداقل min_requests) نرخ خطا
+    به failure_threshold برسد، breaker به مدت open_seconds باز می‌شود. سپس
+    تا half_open_probes درخواست آزمایشی مجاز است: موفقیت آن‌ها breaker را
+    می‌بندد و یک خطا دوباره بازش می‌کند. خطاهای خود درخواست (4xx،
+    context_length، اتمام مهلت) خنثی‌اند و سلامت provider را نمی‌سنجند.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = True,
+        window_size: int = 20,
+        min_requests: int = 5,
+        failure_threshold: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 1
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.min_requests = min_requests
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        
+        self.state = CircuitState.CLOSED
+        self.outcomes: deque = deque(maxlen=window_size)  # True = موفق
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        
+        self.stats = {
+            'opened': 0,
+            'rejected': 0
+        }
+    
+    @classmethod
+    def from_config(cls, name: str, config: Optional[Dict[str, Any]] = None) -> 'CircuitBreaker':
+        """ساخت از بخش circuit_breaker تنظیمات"""
+        config = config or {}
+        return cls(
+            name=name,
+            enabled=config.get('enabled', True),
+            window_size=config.get('window_size', 20),
+            min_requests=config.get('min_requests', 5),
+            failure_threshold=config.get('failure_threshold', 0.5),
+            open_seconds=config.get('open_seconds', 30.0),
+            half_open_probes=config.get('half_open_probes', 1)
+        )
+    
+    @property
+    def failure_rate(self) -> float:
+        """نرخ خطا در پنجره فعلی"""
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+    
+    def _transition(self, state: CircuitState):
+        """تغییر وضعیت و گزارش آن"""
+        if state == self.state:
+            return
+        self.state = state
+        
+        if state == CircuitState.OPEN:
+            self.opened_at = time.monotonic()
+            self.stats['opened'] += 1
+            print(f"⛔ Circuit {self.name} باز شد (نرخ خطا {self.failure_rate:.0%})؛ "
+                  f"تا {self.open_seconds:.0f}s رد می‌شود")
+        elif state == CircuitState.HALF_OPEN:
+            self.probes_in_flight = 0
+            self.probe_successes = 0
+            print(f"🔎 Circuit {self.name} نیمه‌باز شد؛ ارسال درخواست آزمایشی")
+        else:
+            self.outcomes.clear()
+            print(f"✅ Circuit {self.name} بسته شد")
+    
+    def allow_request(self) -> bool:
+        """آیا درخواست به این provider ارسال شود (در حالت نیمه‌باز یک probe رزرو می‌شود)"""
+        if not self.enabled:
+            return True
+        
+        if self.state == CircuitState.OPEN:
+            if time.monotonic() - self.opened_at >= self.open_seconds:
+                self._transition(CircuitState.HALF_OPEN)
+            else:
+                self.stats['rejected'] += 1
+                return False
+        
+        if self.state == CircuitState.HALF_OPEN:
+            if self.probes_in_flight + self.probe_successes >= self.half_open_probes:
+                self.stats['rejected'] += 1
+                return False
+            self.probes_in_flight += 1
+        
+        return True
+    
+    def record(self, success: bool):
+        """ثبت نتیجه یک درخواست"""
+        if not self.enabled:
+            return
+        
+        if self.state == CircuitState.HALF_OPEN:
+            self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+            if not success:
+                self._transition(CircuitState.OPEN)
+                return
+            self.probe_successes += 1
+            if self.probe_successes >= self.half_open_probes:
+                self._transition(CircuitState.CLOSED)
+            return
+        
+        if self.state == CircuitState.OPEN:
+            return  # نتیجه درخواستی که قبل از باز شدن ارسال شده بود
+        
+        self.outcomes.append(success)
+        if len(self.outcomes) >= self.min_requests and self.failure_rate >= self.failure_threshold:
+            self._transition(CircuitState.OPEN)
+    
+    def record_response(self, response):
+        """ثبت نتیجه یک پاسخ (LLMResponse) بر اساس دسته خطای آن"""
+        if response.success:
+            self.record(True)
+        elif response.error_kind is None or response.error_kind in UNHEALTHY_KINDS:
+            self.record(False)
+        else:
+            self.release()
+    
+    def release(self):
+        """آزاد کردن probe درخواستی که بدون نتیجه لغو شد"""
+        if self.state == CircuitState.HALF_OPEN:
+            self.probes_in_flight = max(self.probes_in_flight - 1, 0)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """وضعیت و آمار breaker"""
+        stats = {
+            **self.stats,
+            'state': self.state.value,
+            'failure_rate': round(self.failure_rate, 3),
+            'window': len(self.outcomes)
+        }
+        if self.state == CircuitState.OPEN:
+            stats['retry_in'] = round(max(self.open_seconds - (time.monotonic() - self.opened_at), 0.0), 1)
+        return stats
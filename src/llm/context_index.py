@@ -0,0 +1,317 @@
+"""
+Context Index - بازیابی محلی تکه‌های مرتبط کد مخزن برای prompt (BM25)
+"""
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+from llm.token_counter import TokenCounter, default_counter
+from utils.file_utils import AtomicFileWriter
+
+# شناسه‌ها و کلمات (فارسی هم شامل می‌شود)
+_WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\w+", re.UNICODE)
+_CAMEL_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_SYMBOL_PATTERN = re.compile(r"^\s*(?:async\s+def|def|class)\s+([A-Za-z_][A-Za-z0-9_]*)")
+
+DEFAULT_INCLUDE = ['*.py', '*.md', '*.yaml', '*.yml', '*.toml', '*.txt']
+DEFAULT_EXCLUDE_DIRS = [
+    '.git', '__pycache__', '.llm_cache', '.llm_ledger', 'venv', '.venv',
+    'node_modules', 'logs', 'build', 'dist', '.pytest_cache', '.mypy_cache'
+]
+
+# وزن اضافه نام symbol ها و مسیر فایل نسبت به متن عادی
+SYMBOL_BOOST = 3
+PATH_BOOST = 2
+
+
+def tokenize(text: str) -> List[str]:
+    """شکستن متن به term ها: شناسه کامل و اجزای snake_case/camelCase"""
+    terms = []
+    for word in _WORD_PATTERN.findall(text):
+        lower = word.lower()
+        terms.append(lower)
+        parts = [p for part in word.split('_') for p in _CAMEL_PATTERN.findall(part)]
+        if len(parts) > 1:
+            terms.extend(p.lower() for p in parts if len(p) > 1)
+    return terms
+
+
+def chunk_file(text: str, path: str, max_lines: int = 60) -> List[Dict[str, Any]]:
+    """تقسیم فایل به تکه‌ها؛ در Python مرز تکه‌ها تعریف‌های سطح بالا هستند"""
+    lines = text.splitlines()
+    if not lines:
+        return []
+    
+    boundaries = [0]
+    if path.endswith('.py'):
+        for number, line in enumerate(lines):
+            if number and (line.startswith(('def ', 'async def ', 'class ', '@'))
+                           and not lines[number - 1].startswith('@')):
+                boundaries.append(number)
+    boundaries.append(len(lines))
+    
+    chunks = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        # تعریف‌های خیلی بلند به پنجره‌های max_lines شکسته می‌شوند
+        for window_start in range(start, end, max_lines):
+            window_end = min(window_start + max_lines, end)
+            body = '\n'.join(lines[window_start:window_end]).rstrip()
+            if not body.strip():
+                continue
+            symbols = [
+                match.group(1)
+                for match in map(_SYMBOL_PATTERN.match, lines[window_start:window_end])
+                if match
+            ]
+            chunks.append({
+                'start': window_start + 1,
+                'end': window_end,
+                'text': body,
+                'symbols': symbols
+            })
+    return chunks
+
+
+class ContextIndex:
+    """ایندکس lexical افزایشی روی فایل‌های مخزن
+
+    تکه‌ها با BM25 روی متن، نام symbol های تعریف‌شده و مسیر فایل امتیاز
+    می‌گیرند. فقط فایل‌هایی که mtime یا حجمشان تغییر کرده دوباره خوانده
+    می‌شوند و ایندکس روی دیسک نگه داشته می‌شود.
+    """
+    
+    def __init__(
+        self,
+        root: str = ".",
+        index_path: str = "./.llm_cache/context_index.json",
+        include: Optional[List[str]] = None,
+        exclude_dirs: Optional[List[str]] = None,
+        max_file_kb: float = 200,
+        chunk_lines: int = 60,
+        k1: float = 1.5,
+        b: float = 0.75
+    ):
+        self.root = Path(root)
+        self.index_path = Path(index_path)
+        self.include = include or DEFAULT_INCLUDE
+        self.exclude_dirs = set(exclude_dirs or DEFAULT_EXCLUDE_DIRS)
+        self.max_file_bytes = int(max_file_kb * 1024)
+        self.chunk_lines = chunk_lines
+        self.k1 = k1
+        self.b = b
+        
+        # مسیر نسبی -> {mtime, size, chunks: [{start, end, text, symbols, tf, length}]}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.df: Counter = Counter()
+        self.total_length = 0
+        self.chunk_count = 0
+        
+        self.stats = {
+            'queries': 0,
+            'files_indexed': 0,
+            'snippets_packed': 0,
+            'tokens_packed': 0
+        }
+        
+        self._load()
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'ContextIndex':
+        """ساخت از بخش context_retrieval تنظیمات"""
+        config = config or {}
+        return cls(
+            root=config.get('root', '.'),
+            index_path=config.get('index_path', './.llm_cache/context_index.json'),
+            include=config.get('include'),
+            exclude_dirs=config.get('exclude_dirs'),
+            max_file_kb=config.get('max_file_kb', 200),
+            chunk_lines=config.get('chunk_lines', 60)
+        )
+    
+    def _load(self):
+        """بارگذاری ایندکس ذخیره‌شده (در صورت خرابی از صفر ساخته می‌شود)"""
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('chunk_lines') != self.chunk_lines:
+                return
+            for path, entry in data['files'].items():
+                self._add_file(path, entry)
+        except Exception as e:
+            print(f"⚠️  ایندکس context نامعتبر است و دوباره ساخته می‌شود: {e}")
+            self.files.clear()
+            self.df.clear()
+            self.total_length = 0
+            self.chunk_count = 0
+    
+    def _save(self):
+        """ذخیره atomic ایندکس"""
+        data = {'chunk_lines': self.chunk_lines, 'files': self.files}
+        with AtomicFileWriter(str(self.index_path)) as writer:
+            writer.write(json.dumps(data, ensure_ascii=False))
+    
+    def _chunk_terms(self, path: str, chunk: Dict[str, Any]) -> Counter:
+        """فراوانی term های یک تکه با وزن بیشتر برای symbol ها و مسیر"""
+        tf = Counter(tokenize(chunk['text']))
+        for symbol in chunk['symbols']:
+            for term in tokenize(symbol):
+                tf[term] += SYMBOL_BOOST
+        for term in tokenize(path):
+            tf[term] += PATH_BOOST
+        return tf
+    
+    def _add_file(self, path: str, entry: Dict[str, Any]):
+        """افزودن تکه‌های یک فایل به آمار BM25"""
+        self.files[path] = entry
+        for chunk in entry['chunks']:
+            self.df.update(chunk['tf'].keys())
+            self.total_length += chunk['length']
+            self.chunk_count += 1
+    
+    def _remove_file(self, path: str):
+        """حذف تکه‌های یک فایل از آمار BM25"""
+        entry = self.files.pop(path, None)
+        if not entry:
+            return
+        for chunk in entry['chunks']:
+            self.df.subtract(chunk['tf'].keys())
+            self.total_length -= chunk['length']
+            self.chunk_count -= 1
+        self.df += Counter()  # حذف term های با شمارش صفر
+    
+    def _iter_files(self):
+        """فایل‌های قابل ایندکس (مسیر نسبی، stat)"""
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in self.exclude_dirs]
+            for filename in filenames:
+                if not any(fnmatch(filename, pattern) for pattern in self.include):
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                if stat.st_size > self.max_file_bytes:
+                    continue
+                yield os.path.relpath(full_path, self.root), stat
+    
+    def refresh(self) -> int:
+        """به‌روزرسانی افزایشی: فقط فایل‌های جدید، تغییرکرده یا حذف‌شده
+
+        Returns:
+            تعداد فایل‌های دوباره ایندکس‌شده
+        """
+        seen = set()
+        changed = 0
+        
+        for path, stat in self._iter_files():
+            seen.add(path)
+            entry = self.files.get(path)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                continue
+            
+            try:
+                text = (self.root / path).read_text(encoding='utf-8')
+            except (OSError, UnicodeDecodeError):
+                continue
+            
+            chunks = chunk_file(text, path, self.chunk_lines)
+            for chunk in chunks:
+                tf = self._chunk_terms(path, chunk)
+                chunk['tf'] = dict(tf)
+                chunk['length'] = sum(tf.values())
+            
+            self._remove_file(path)
+            self._add_file(path, {'mtime': stat.st_mtime, 'size': stat.st_size, 'chunks': chunks})
+            changed += 1
+        
+        removed = [path for path in self.files if path not in seen]
+        for path in removed:
+            self._remove_file(path)
+        
+        if changed or removed:
+            self.stats['files_indexed'] += changed
+            self._save()
+        return changed
+    
+    def search(self, query: str, k: int = 10, exclude_paths: Optional[List[str]] = None) -> List[Tuple[float, str, Dict[str, Any]]]:
+        """k تکه با بیشترین امتیاز BM25
+
+        Returns:
+            [(امتیاز, مسیر, تکه)]
+        """
+        self.stats['queries'] += 1
+        terms = set(tokenize(query))
+        if not terms or not self.chunk_count:
+            return []
+        
+        excluded = {os.path.normpath(os.path.relpath(path, self.root)) for path in (exclude_paths or [])}
+        average_length = self.total_length / self.chunk_count
+        idf = {
+            term: math.log(1 + (self.chunk_count - self.df[term] + 0.5) / (self.df[term] + 0.5))
+            for term in terms if self.df.get(term)
+        }
+        
+        results = []
+        for path, entry in self.files.items():
+            if os.path.normpath(path) in excluded:
+                continue
+            for chunk in entry['chunks']:
+                tf = chunk['tf']
+                norm = self.k1 * (1 - self.b + self.b * chunk['length'] / average_length)
+                score = sum(
+                    weight * tf[term] * (self.k1 + 1) / (tf[term] + norm)
+                    for term, weight in idf.items() if term in tf
+                )
+                if score > 0:
+                    results.append((score, path, chunk))
+        
+        results.sort(key=lambda result: result[0], reverse=True)
+        return results[:k]
+    
+    def pack(
+        self,
+        query: str,
+        token_budget: int,
+        counter: Optional[TokenCounter] = None,
+        max_snippets: int = 8,
+        exclude_paths: Optional[List[str]] = None
+    ) -> str:
+        """مرتبط‌ترین تکه‌ها تا سقف token_budget، به صورت متن آماده برای prompt
+
+        ایندکس refresh نمی‌شود؛ فراخواننده یک بار در هر task آن را به‌روز می‌کند.
+        """
+        counter = counter or default_counter
+        
+        snippets = []
+        used = 0
+        for _, path, chunk in self.search(query, k=max_snippets * 3, exclude_paths=exclude_paths):
+            snippet = f"# {path}:{chunk['start']}-{chunk['end']}\n{chunk['text']}"
+            tokens = counter.count(snippet)
+            if used + tokens > token_budget:
+                continue  # تکه کوچک‌تر بعدی ممکن است جا شود
+            snippets.append(snippet)
+            used += tokens
+            if len(snippets) >= max_snippets:
+                break
+        
+        self.stats['snippets_packed'] += len(snippets)
+        self.stats['tokens_packed'] += used
+        return '\n\n'.join(snippets)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار ایندکس و بازیابی"""
+        return {
+            **self.stats,
+            'files': len(self.files),
+            'chunks': self.chunk_count,
+            'terms': len(self.df)
+        }
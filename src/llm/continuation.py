@@ -0,0 +1,153 @@
+"""
+Continuation - ادامه خودکار پاسخ‌هایی که به سقف max_tokens رسیده‌اند
+"""
+
+from dataclasses import replace
+from typing import Awaitable, Callable, AsyncIterator
+
+from llm.streaming import StreamChunk
+
+# finish_reason (OpenAI) و stop_reason (Anthropic) برای قطع به خاطر سقف طول
+TRUNCATION_REASONS = {'length', 'max_tokens'}
+
+# finish_reason پاسخ stream ناموفقی که پس از چند token متوقف شد (timeout توقف)
+STALLED_REASON = 'stalled'
+
+CONTINUE_PROMPT = (
+    "پاسخ قبلی به سقف طول رسید. دقیقاً از همان نقطه‌ای که قطع شد ادامه دهید؛ "
+    "چیزی را تکرار نکنید و توضیح یا markdown اضافه نکنید."
+)
+
+# حداکثر طول بخش تکراری بین انتهای پاسخ قبلی و ابتدای ادامه
+OVERLAP_WINDOW = 200
+
+
+def is_truncated(response) -> bool:
+    """آیا پاسخ به خاطر سقف max_tokens قطع شده است"""
+    return response is not None and response.finish_reason in TRUNCATION_REASONS
+
+
+def is_stalled(response) -> bool:
+    """آیا stream پس از ارسال بخشی از پاسخ متوقف شده است"""
+    return (
+        response is not None and not response.success
+        and response.finish_reason == STALLED_REASON and bool(response.content)
+    )
+
+
+def continuation_request(request, partial: str):
+    """درخواست ادامه: prompt اصلی و پاسخ ناقص به تاریخچه منتقل می‌شوند
+
+    stable_context و system prompt دست نمی‌خورند تا پیشوند کش‌شده حفظ شود.
+    """
+    history = list(request.context or []) + [
+        {"role": "user", "content": request.prompt},
+        {"role": "assistant", "content": partial}
+    ]
+    return replace(request, context=history, prompt=CONTINUE_PROMPT, bypass_cache=True)
+
+
+def remove_overlap(existing: str, addition: str, window: int = OVERLAP_WINDOW) -> str:
+    """حذف ابتدای addition اگر تکرار انتهای existing باشد"""
+    tail = existing[-window:]
+    for size in range(min(len(tail), len(addition)), 0, -1):
+        if tail.endswith(addition[:size]):
+            # همپوشانی خیلی کوتاه (مثلاً یک کاراکتر) احتمالاً تصادفی است
+            return addition[size:] if size >= 8 else addition
+    return addition
+
+
+def merge_responses(base, extra, content: str):
+    """ترکیب یک پاسخ و ادامه آن با جمع usage و هزینه"""
+    return replace(
+        base,
+        content=content,
+        tokens_used=base.tokens_used + extra.tokens_used,
+        duration=base.duration + extra.duration,
+        success=extra.success,
+        cost=base.cost + extra.cost,
+        error=extra.error,
+        error_kind=extra.error_kind,
+        input_tokens=base.input_tokens + extra.input_tokens,
+        cache_creation_tokens=base.cache_creation_tokens + extra.cache_creation_tokens,
+        cache_read_tokens=base.cache_read_tokens + extra.cache_read_tokens,
+        finish_reason=extra.finish_reason,
+        continuations=base.continuations + 1
+    )
+
+
+async def generate_with_continuation(
+    generate_once: Callable[..., Awaitable],
+    request,
+    max_continuations: int
+):
+    """تولید و در صورت قطع به خاطر طول، ادامه تا تکمیل (حداکثر max_continuations بار)"""
+    response = await generate_once(request)
+    
+    while response.success and is_truncated(response) and response.continuations < max_continuations:
+        print(f"✂️  پاسخ به سقف {request.max_tokens} token رسید؛ درخواست ادامه ({response.continuations + 1}/{max_continuations})...")
+        extra = await generate_once(continuation_request(request, response.content))
+        if not extra.success:
+            # پاسخ ناقص با finish_reason=length برگردانده می‌شود تا فراخواننده تصمیم بگیرد
+            print(f"⚠️  ادامه پاسخ ناموفق بود: {extra.error}")
+            break
+        content = response.content + remove_overlap(response.content, extra.content)
+        response = merge_responses(response, extra, content)
+    
+    return response
+
+
+async def stream_with_continuation(
+    stream_once: Callable[..., AsyncIterator[StreamChunk]],
+    request,
+    max_continuations: int
+) -> AsyncIterator[StreamChunk]:
+    """stream با ادامه خودکار؛ ابتدای هر ادامه تا حذف همپوشانی نگه داشته می‌شود
+
+    stream متوقف‌شده (stall) هم به جای شکست یا تکرار از ابتدا، از همان
+    نقطه ادامه داده می‌شود.
+    """
+    response = None
+    content = ''
+    current = request
+    
+    while True:
+        final = None
+        pending = ''
+        holding = response is not None  # در ادامه‌ها ابتدای متن ممکن است تکراری باشد
+        
+        async for chunk in stream_once(current):
+            if chunk.done:
+                final = chunk.response
+                break
+            if holding:
+                pending += chunk.text
+                if len(pending) < OVERLAP_WINDOW:
+                    continue
+                text = remove_overlap(content, pending)
+                holding = False
+            else:
+                text = chunk.text
+            if text:
+                content += text
+                yield StreamChunk(text=text)
+        
+        if holding and pending and final.success:
+            text = remove_overlap(content, pending)
+            if text:
+                content += text
+                yield StreamChunk(text=text)
+        
+        response = final if response is None else merge_responses(response, final, content)
+        
+        resumable = (response.success and is_truncated(response)) or is_stalled(response)
+        if not resumable or response.continuations >= max_continuations:
+            break
+        
+        if is_stalled(response):
+            print(f"⏸️  stream متوقف شد ({response.error})؛ ادامه از همان نقطه ({response.continuations + 1}/{max_continuations})...")
+        else:
+            print(f"✂️  پاسخ به سقف {request.max_tokens} token رسید؛ درخواست ادامه ({response.continuations + 1}/{max_continuations})...")
+        current = continuation_request(request, content)
+    
+    yield StreamChunk(text='', done=True, response=response)
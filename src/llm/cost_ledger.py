@@ -0,0 +1,309 @@
+"""
+Cost Ledger - دفتر دائمی هزینه‌ها با رزرو اتمیک بودجه (SQLite)
+"""
+
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    feature TEXT,
+    task TEXT,
+    provider TEXT,
+    model TEXT,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+    cache_read_tokens INTEGER NOT NULL DEFAULT 0,
+    cost REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS calls_day ON calls(day);
+CREATE INDEX IF NOT EXISTS calls_feature ON calls(feature);
+CREATE TABLE IF NOT EXISTS reservations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    feature TEXT,
+    task TEXT,
+    pid INTEGER NOT NULL,
+    amount REAL NOT NULL
+);
+"""
+
+
+class CostLedger:
+    """دفتر هزینه مشترک بین اجراها و پردازه‌ها
+
+    هر فراخوانی (token ها و هزینه به تفکیک feature/task/provider) ثبت می‌شود.
+    قبل از ارسال، هزینه برآوردی در یک تراکنش BEGIN IMMEDIATE رزرو می‌شود؛
+    بررسی سقف‌ها (کل، روزانه، هر feature) و ثبت رزرو اتمیک است و دو درخواست
+    هم‌زمان نمی‌توانند با هم از بودجه عبور کنند. رزروهای رهاشده (مثلاً پس از
+    crash) بعد از reservation_ttl ثانیه نادیده گرفته می‌شوند.
+
+    اتصال SQLite فقط در یک thread اختصاصی استفاده می‌شود تا انتظار قفل
+    (تا 30 ثانیه با چند پردازه) event loop را متوقف نکند؛ متدهای a* (مثل
+    areserve) نسخه async همان عملیات‌اند. max_total_cost سقف کل دفتر در همه
+    اجراهاست، نه فقط اجرای فعلی.
+    """
+    
+    def __init__(
+        self,
+        ledger_path: str = "./.llm_ledger/costs.sqlite",
+        max_total_cost: float = 10.0,
+        max_daily_cost: Optional[float] = None,
+        max_cost_per_feature: Optional[float] = None,
+        feature_budgets: Optional[Dict[str, float]] = None,
+        reservation_ttl: float = 3600.0
+    ):
+        self.ledger_path = Path(ledger_path)
+        self.max_total_cost = max_total_cost
+        self.max_daily_cost = max_daily_cost
+        self.max_cost_per_feature = max_cost_per_feature
+        self.feature_budgets = feature_budgets or {}
+        self.reservation_ttl = reservation_ttl
+        
+        self.stats = {
+            'reservations': 0,
+            'rejected': 0
+        }
+        
+        self.ledger_path.parent.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cost-ledger')
+        self._conn: Optional[sqlite3.Connection] = None
+        self._call(self._connect)
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'CostLedger':
+        """ساخت از بخش cost_control تنظیمات"""
+        config = config or {}
+        return cls(
+            ledger_path=config.get('ledger_path', './.llm_ledger/costs.sqlite'),
+            max_total_cost=config.get('max_total_cost', 10.0),
+            max_daily_cost=config.get('max_daily_cost'),
+            max_cost_per_feature=config.get('max_cost_per_feature'),
+            feature_budgets=config.get('feature_budgets', {}),
+            reservation_ttl=config.get('reservation_ttl', 3600.0)
+        )
+    
+    def _connect(self):
+        """باز کردن اتصال (در thread دفتر)"""
+        # autocommit؛ تراکنش‌ها صریحاً با BEGIN IMMEDIATE شروع می‌شوند
+        self._conn = sqlite3.connect(str(self.ledger_path), timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+    
+    def _call(self, operation: Callable, *args):
+        """اجرای یک عملیات در thread دفتر و انتظار برای نتیجه"""
+        return self._executor.submit(operation, *args).result()
+    
+    async def _acall(self, operation: Callable, *args):
+        """اجرای یک عملیات در thread دفتر بدون بلوکه کردن event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, operation, *args)
+    
+    def _feature_budget(self, feature: Optional[str]) -> Optional[float]:
+        """سقف هزینه یک feature (بودجه اختصاصی یا سقف پیش‌فرض)"""
+        if feature and feature in self.feature_budgets:
+            return self.feature_budgets[feature]
+        return self.max_cost_per_feature if feature else None
+    
+    def _spent(self, where: str = "", params: tuple = ()) -> float:
+        """هزینه ثبت‌شده با شرط داده‌شده"""
+        return self._conn.execute(
+            f"SELECT COALESCE(SUM(cost), 0) FROM calls {where}", params
+        ).fetchone()[0]
+    
+    def _reserved(self, where: str = "", params: tuple = ()) -> float:
+        """مجموع رزروهای فعال (منقضی‌نشده) با شرط داده‌شده"""
+        where = f"{where} AND created_at >= ?" if where else "WHERE created_at >= ?"
+        return self._conn.execute(
+            f"SELECT COALESCE(SUM(amount), 0) FROM reservations {where}",
+            params + (time.time() - self.reservation_ttl,)
+        ).fetchone()[0]
+    
+    def _committed(self, where: str = "", params: tuple = ()) -> float:
+        """هزینه ثبت‌شده + رزروهای فعال"""
+        return self._spent(where, params) + self._reserved(where, params)
+    
+    def _remaining(self, feature: Optional[str]) -> float:
+        """کمترین بودجه باقی‌مانده بین سقف کل، روزانه و feature"""
+        remaining = self.max_total_cost - self._committed()
+        
+        if self.max_daily_cost is not None:
+            today = date.today().isoformat()
+            remaining = min(remaining, self.max_daily_cost - self._committed("WHERE day = ?", (today,)))
+        
+        feature_budget = self._feature_budget(feature)
+        if feature_budget is not None:
+            remaining = min(remaining, feature_budget - self._committed("WHERE feature = ?", (feature,)))
+        
+        return remaining
+    
+    def _available(self, feature: Optional[str]) -> float:
+        """بودجه باقی‌مانده (منفی نمی‌شود)"""
+        return max(self._remaining(feature), 0.0)
+    
+    def remaining(self, feature: Optional[str] = None) -> float:
+        """بودجه قابل خرج برای یک درخواست جدید از این feature"""
+        return self._call(self._available, feature)
+    
+    async def aremaining(self, feature: Optional[str] = None) -> float:
+        """نسخه async remaining"""
+        return await self._acall(self._available, feature)
+    
+    def reserve(self, amount: float, feature: Optional[str] = None, task: Optional[str] = None) -> Optional[int]:
+        """رزرو اتمیک هزینه برآوردی
+
+        Returns:
+            شناسه رزرو، یا None اگر با این مبلغ یکی از سقف‌ها رد می‌شود
+        """
+        return self._call(self._reserve, amount, feature, task)
+    
+    async def areserve(self, amount: float, feature: Optional[str] = None, task: Optional[str] = None) -> Optional[int]:
+        """نسخه async reserve"""
+        return await self._acall(self._reserve, amount, feature, task)
+    
+    def _reserve(self, amount: float, feature: Optional[str], task: Optional[str]) -> Optional[int]:
+        """بررسی سقف‌ها و ثبت رزرو در یک تراکنش"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # تلورانس خطای ممیز شناور (جمع SQL با ترتیب متفاوت)
+            if amount > self._remaining(feature) + 1e-9:
+                self._conn.execute("ROLLBACK")
+                self.stats['rejected'] += 1
+                return None
+            
+            cursor = self._conn.execute(
+                "INSERT INTO reservations (created_at, day, feature, task, pid, amount) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), date.today().isoformat(), feature, task, os.getpid(), amount)
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        
+        self.stats['reservations'] += 1
+        return cursor.lastrowid
+    
+    def release(self, reservation_id: Optional[int]):
+        """آزاد کردن رزرو پس از ثبت هزینه واقعی (یا لغو درخواست)"""
+        if reservation_id is not None:
+            self._call(self._release, reservation_id)
+    
+    async def arelease(self, reservation_id: Optional[int]):
+        """نسخه async release"""
+        if reservation_id is not None:
+            await self._acall(self._release, reservation_id)
+    
+    def _release(self, reservation_id: int):
+        """حذف یک رزرو"""
+        self._conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+    
+    def record(
+        self,
+        response,
+        feature: Optional[str] = None,
+        task: Optional[str] = None,
+        reservation_id: Optional[int] = None
+    ):
+        """ثبت token ها و هزینه یک پاسخ upstream (و در صورت وجود، تسویه رزرو در همان تراکنش)"""
+        self._call(self._record, response, feature, task, reservation_id)
+    
+    async def arecord(
+        self,
+        response,
+        feature: Optional[str] = None,
+        task: Optional[str] = None,
+        reservation_id: Optional[int] = None
+    ):
+        """نسخه async record"""
+        await self._acall(self._record, response, feature, task, reservation_id)
+    
+    def _record(self, response, feature: Optional[str], task: Optional[str], reservation_id: Optional[int]):
+        """درج فراخوانی و حذف رزرو در یک تراکنش"""
+        output_tokens = max(
+            response.tokens_used - response.input_tokens
+            - response.cache_creation_tokens - response.cache_read_tokens,
+            0
+        )
+        
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "INSERT INTO calls (created_at, day, feature, task, provider, model, input_tokens, "
+                "output_tokens, cache_creation_tokens, cache_read_tokens, cost) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(), date.today().isoformat(), feature, task,
+                    response.provider.value, response.model, response.input_tokens,
+                    output_tokens, response.cache_creation_tokens, response.cache_read_tokens,
+                    response.cost
+                )
+            )
+            if reservation_id is not None:
+                self._conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+    
+    def total_cost(self) -> float:
+        """هزینه کل ثبت‌شده در همه اجراها"""
+        return self._call(self._spent)
+    
+    async def atotal_cost(self) -> float:
+        """نسخه async total_cost"""
+        return await self._acall(self._spent)
+    
+    def _group(self, column: str, where: str = "", params: tuple = ()) -> Dict[str, Dict[str, Any]]:
+        """جمع فراخوانی‌ها و هزینه به تفکیک یک ستون"""
+        rows = self._conn.execute(
+            f"SELECT {column}, COUNT(*), SUM(input_tokens + cache_creation_tokens + cache_read_tokens), "
+            f"SUM(output_tokens), SUM(cost) FROM calls {where} GROUP BY {column}",
+            params
+        ).fetchall()
+        return {
+            key or 'default': {
+                'calls': calls,
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'cost': round(cost, 4)
+            }
+            for key, calls, input_tokens, output_tokens, cost in rows
+        }
+    
+    def get_summary(self) -> Dict[str, Any]:
+        """خلاصه دفتر: کل، امروز، به تفکیک feature و provider"""
+        return self._call(self._summary)
+    
+    def _summary(self) -> Dict[str, Any]:
+        """محاسبه خلاصه (در thread دفتر)"""
+        today = date.today().isoformat()
+        
+        return {
+            **self.stats,
+            'total_cost': round(self._spent(), 4),
+            'today_cost': round(self._spent("WHERE day = ?", (today,)), 4),
+            'remaining': round(self._available(None), 4),
+            'reserved': round(self._reserved(), 4),
+            'by_feature': self._group('feature'),
+            'by_provider': self._group('provider'),
+            'by_task': self._group('task', "WHERE task IS NOT NULL")
+        }
+    
+    def close(self):
+        """بستن اتصال پایگاه داده و thread دفتر"""
+        if self._conn is None:
+            return
+        self._call(self._conn.close)
+        self._conn = None
+        self._executor.shutdown(wait=True)
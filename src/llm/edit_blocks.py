@@ -0,0 +1,266 @@
+"""
+Edit Blocks - ویرایش فایل موجود با بلوک‌های SEARCH/REPLACE (یا unified diff) به جای بازنویسی کامل
+"""
+
+import ast
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import List, Tuple, Optional, Dict, Any
+
+from llm.context_index import SYMBOL_BOOST, chunk_file, tokenize
+from llm.token_counter import TokenCounter, default_counter
+
+EDIT_FORMAT = """تغییرات را فقط به صورت یک یا چند بلوک SEARCH/REPLACE بنویسید:
+
+<<<<<<< SEARCH
+خطوطی از فایل فعلی، دقیقاً همان‌طور که هستند (با تورفتگی)
+=======
+خطوط جایگزین
+>>>>>>> REPLACE
+
+قوانین:
+1. بخش SEARCH باید دقیقاً و فقط یک بار در فایل فعلی وجود داشته باشد؛ چند خط اطراف را برای یکتا شدن بیاورید
+2. برای کد جدید در انتهای فایل، بخش SEARCH را خالی بگذارید
+3. بلوک‌ها را به ترتیب ظاهر شدن در فایل بنویسید
+4. بیرون از بلوک‌ها چیزی ننویسید (بدون markdown یا توضیحات)"""
+
+_BLOCK_PATTERN = re.compile(
+    r"^<{5,9} SEARCH[^\n]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} REPLACE[^\n]*$",
+    re.MULTILINE | re.DOTALL
+)
+_HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@")
+
+
+class EditError(Exception):
+    """بلوک ویرایش قابل اعمال نیست"""
+
+
+def parse_unified_diff(text: str) -> List[Tuple[str, str]]:
+    """تبدیل hunk های یک unified diff به جفت‌های (search, replace)"""
+    blocks = []
+    search: List[str] = []
+    replace: List[str] = []
+    in_hunk = False
+    
+    def flush():
+        if in_hunk and (search or replace):
+            blocks.append((''.join(search), ''.join(replace)))
+    
+    for line in text.splitlines(keepends=True):
+        if _HUNK_HEADER.match(line):
+            flush()
+            search, replace, in_hunk = [], [], True
+        elif line.startswith(('--- ', '+++ ')) and not in_hunk:
+            continue
+        elif in_hunk and line.startswith('-'):
+            search.append(line[1:])
+        elif in_hunk and line.startswith('+'):
+            replace.append(line[1:])
+        elif in_hunk and line.startswith(' '):
+            search.append(line[1:])
+            replace.append(line[1:])
+        elif in_hunk and line.strip() == '':
+            # خط خالی context که فاصله ابتدایش حذف شده
+            search.append('\n')
+            replace.append('\n')
+        elif in_hunk and line.startswith('\\'):
+            continue  # "\ No newline at end of file"
+        else:
+            flush()
+            search, replace, in_hunk = [], [], False
+    flush()
+    return blocks
+
+
+def parse_edit_blocks(text: str) -> List[Tuple[str, str]]:
+    """استخراج بلوک‌های SEARCH/REPLACE (یا در نبود آن‌ها hunk های unified diff)"""
+    blocks = [(m.group(1), m.group(2)) for m in _BLOCK_PATTERN.finditer(text)]
+    if blocks:
+        return blocks
+    return parse_unified_diff(text)
+
+
+def _leading(line: str) -> str:
+    """فاصله ابتدای خط"""
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _reindent(lines: List[str], remove: str, add: str) -> List[str]:
+    """جابه‌جایی تورفتگی خطوط replace به اندازه اختلاف search و فایل"""
+    result = []
+    for line in lines:
+        if line.strip() and line.startswith(remove):
+            line = add + line[len(remove):]
+        elif line.strip():
+            line = add + line
+        result.append(line)
+    return result
+
+
+def _find_unique(haystack: List[str], needle: List[str], key) -> Optional[int]:
+    """محل یکتای needle در haystack با مقایسه key هر خط (None اگر نبود یا چندتا بود)"""
+    size = len(needle)
+    target = [key(line) for line in needle]
+    matches = [
+        i for i in range(len(haystack) - size + 1)
+        if [key(line) for line in haystack[i:i + size]] == target
+    ]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _fuzzy_find(haystack: List[str], needle: List[str], threshold: float) -> Optional[int]:
+    """شبیه‌ترین پنجره هم‌اندازه با needle (اگر شباهتش حداقل threshold و یکتا باشد)"""
+    size = len(needle)
+    matcher = SequenceMatcher(autojunk=False)
+    matcher.set_seq2(''.join(line.strip() + '\n' for line in needle))
+    scores = []
+    for i in range(len(haystack) - size + 1):
+        matcher.set_seq1(''.join(line.strip() + '\n' for line in haystack[i:i + size]))
+        # کران‌های بالای ارزان قبل از محاسبه کامل شباهت
+        if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+            continue
+        ratio = matcher.ratio()
+        if ratio >= threshold:
+            scores.append((ratio, i))
+    if not scores:
+        return None
+    
+    scores.sort(reverse=True)
+    best_score, best_index = scores[0]
+    if len(scores) > 1 and scores[1][0] == best_score:
+        return None  # دو محل با شباهت یکسان: ابهام
+    return best_index
+
+
+def apply_block(content: str, search: str, replace: str, fuzzy_threshold: float = 0.9) -> Tuple[str, str]:
+    """اعمال یک بلوک روی content
+
+    ترتیب تلاش: تطابق دقیق، نادیده گرفتن فاصله انتهای خط، نادیده گرفتن
+    تورفتگی (و تنظیم تورفتگی replace)، و در آخر شباهت difflib.
+
+    Returns:
+        (متن جدید، روش تطابق: exact، whitespace، indent یا fuzzy)
+    """
+    if not search.strip():
+        separator = '' if not content or content.endswith('\n') else '\n'
+        return content + separator + replace, 'exact'
+    
+    count = content.count(search)
+    if count == 1:
+        return content.replace(search, replace, 1), 'exact'
+    if count > 1:
+        raise EditError(f"بخش SEARCH بیش از یک بار ({count}) در فایل آمده است:\n{search[:200]}")
+    
+    lines = content.splitlines(keepends=True)
+    search_lines = search.splitlines(keepends=True)
+    replace_lines = replace.splitlines(keepends=True)
+    # خطوط خالی ابتدا و انتهای SEARCH در تطابق‌های تقریبی نادیده گرفته می‌شوند
+    while search_lines and not search_lines[0].strip():
+        search_lines.pop(0)
+    while search_lines and not search_lines[-1].strip():
+        search_lines.pop()
+    if replace_lines and not replace_lines[-1].endswith('\n'):
+        replace_lines[-1] += '\n'
+    
+    index = _find_unique(lines, search_lines, lambda line: line.rstrip())
+    method = 'whitespace'
+    if index is None:
+        index = _find_unique(lines, search_lines, lambda line: line.strip())
+        method = 'indent'
+    if index is None:
+        index = _fuzzy_find(lines, search_lines, fuzzy_threshold)
+        method = 'fuzzy'
+    if index is None:
+        raise EditError(f"بخش SEARCH در فایل پیدا نشد:\n{search[:200]}")
+    
+    if method in ('indent', 'fuzzy'):
+        first = next(i for i, line in enumerate(search_lines) if line.strip())
+        replace_lines = _reindent(
+            replace_lines, _leading(search_lines[first]), _leading(lines[index + first])
+        )
+    
+    new_lines = lines[:index] + replace_lines + lines[index + len(search_lines):]
+    return ''.join(new_lines), method
+
+
+def apply_edits(content: str, blocks: List[Tuple[str, str]], fuzzy_threshold: float = 0.9) -> Tuple[str, List[str]]:
+    """اعمال همه بلوک‌ها به ترتیب؛ با اولین بلوک ناموفق EditError
+
+    Returns:
+        (متن جدید، روش تطابق هر بلوک)
+    """
+    methods = []
+    for search, replace in blocks:
+        content, method = apply_block(content, search, replace, fuzzy_threshold)
+        methods.append(method)
+    return content, methods
+
+
+def validate_edit(file_path: str, original: str, edited: str) -> Optional[str]:
+    """بررسی نتیجه ویرایش؛ پیام خطا یا None
+
+    فایل‌های Python باید بعد از ویرایش parse شوند (اگر قبلاً parse می‌شدند).
+    """
+    if edited == original:
+        return "ویرایش هیچ تغییری ایجاد نکرد"
+    if not file_path.endswith('.py'):
+        return None
+    
+    try:
+        ast.parse(original)
+    except SyntaxError:
+        return None  # فایل از قبل خراب بوده؛ معیاری برای مقایسه نیست
+    
+    try:
+        ast.parse(edited)
+    except SyntaxError as e:
+        return f"خطای Syntax پس از ویرایش (خط {e.lineno}): {e.msg}"
+    return None
+
+
+def _outline(chunk: Dict[str, Any]) -> str:
+    """جایگزین یک تکه حذف‌شده در نمای جزئی فایل"""
+    names = f": {', '.join(chunk['symbols'])}" if chunk['symbols'] else ""
+    return f"# ... خطوط {chunk['start']}-{chunk['end']} در این نما حذف شده{names}"
+
+
+def edit_view(
+    content: str,
+    file_path: str,
+    query: str,
+    token_budget: int,
+    counter: Optional[TokenCounter] = None,
+    chunk_lines: int = 20
+) -> Optional[str]:
+    """نمای جزئی یک فایل بزرگ برای درخواست ویرایش در سقف token_budget
+
+    تکه‌های فایل (تعریف‌های سطح بالا، حداکثر chunk_lines خط) به ترتیب ارتباط با query
+    (term های مشترک، با وزن بیشتر برای نام symbol ها) دقیقاً همان‌طور که
+    هستند می‌آیند و به جای بقیه فقط محدوده خطوط و نام تعریف‌هایشان. None اگر
+    حتی طرح کلی فایل جا نشود.
+    """
+    counter = counter or default_counter
+    terms = set(tokenize(query))
+    chunks = chunk_file(content, file_path, chunk_lines)
+    lines = content.splitlines()
+    # متن دقیق هر تکه (با خطوط خالی انتهایی) تا بخش SEARCH با فایل یکی باشد
+    texts = ['\n'.join(lines[chunk['start'] - 1:chunk['end']]) for chunk in chunks]
+    
+    def score(chunk: Dict[str, Any]) -> int:
+        text_terms = Counter(tokenize(chunk['text']))
+        symbol_terms = set(tokenize(' '.join(chunk['symbols'])))
+        return sum(min(text_terms[term], 3) for term in terms) + SYMBOL_BOOST * len(terms & symbol_terms)
+    
+    view = [_outline(chunk) for chunk in chunks]
+    used = sum(counter.count(line) for line in view)
+    if used > token_budget:
+        return None
+    
+    for index in sorted(range(len(chunks)), key=lambda i: score(chunks[i]), reverse=True):
+        extra = counter.count(texts[index]) - counter.count(view[index])
+        if used + extra > token_budget:
+            continue  # تکه کوچک‌تر بعدی ممکن است جا شود
+        view[index] = texts[index]
+        used += extra
+    return '\n'.join(view)
@@ -0,0 +1,95 @@
+"""
+Hedging - ارسال درخواست پشتیبان به provider بعدی وقتی provider اصلی کند است
+"""
+
+import math
+from collections import deque
+from typing import Optional, Dict, Any
+
+
+class LatencyTracker:
+    """نگهداری تأخیرهای اخیر هر provider برای محاسبه percentile"""
+    
+    def __init__(self, window: int = 100):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+    
+    def record(self, name: str, duration: float):
+        """ثبت تأخیر یک پاسخ موفق"""
+        if name not in self._samples:
+            self._samples[name] = deque(maxlen=self.window)
+        self._samples[name].append(duration)
+    
+    def count(self, name: str) -> int:
+        """تعداد نمونه‌های یک provider"""
+        return len(self._samples.get(name, ()))
+    
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        """percentile مرتبه q (0 تا 100) با روش nearest-rank"""
+        samples = self._samples.get(name)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        rank = max(math.ceil(q / 100 * len(ordered)), 1)
+        return ordered[rank - 1]
+
+
+class HedgingPolicy:
+    """سیاست hedging: چه زمانی درخواست پشتیبان ارسال شود"""
+    
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95,
+        min_samples: int = 5,
+        default_delay: float = 30.0,
+        min_delay: float = 1.0,
+        max_hedges: int = 1,
+        window: int = 100
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_hedges = max_hedges
+        self.latencies = LatencyTracker(window)
+        
+        self.stats = {
+            'races': 0,
+            'hedges': 0,          # درخواست‌های پشتیبان ارسال‌شده
+            'hedge_wins': 0,      # دفعاتی که درخواست پشتیبان زودتر تمام شد
+            'cancelled': 0,       # درخواست‌های بازنده که لغو شدند
+            'wasted_cost': 0.0    # هزینه پاسخ‌های موفقی که استفاده نشدند
+        }
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'HedgingPolicy':
+        """ساخت از بخش hedging تنظیمات"""
+        config = config or {}
+        return cls(
+            enabled=config.get('enabled', False),
+            percentile=config.get('percentile', 95),
+            min_samples=config.get('min_samples', 5),
+            default_delay=config.get('default_delay', 30.0),
+            min_delay=config.get('min_delay', 1.0),
+            max_hedges=config.get('max_hedges', 1)
+        )
+    
+    def record_latency(self, name: str, duration: float):
+        """ثبت تأخیر پاسخ موفق یک provider"""
+        self.latencies.record(name, duration)
+    
+    def hedge_delay(self, name: str) -> float:
+        """مدت انتظار برای provider قبل از ارسال درخواست پشتیبان"""
+        if self.latencies.count(name) < self.min_samples:
+            return self.default_delay
+        return max(self.latencies.percentile(name, self.percentile), self.min_delay)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار hedging"""
+        return {
+            **self.stats,
+            'wasted_cost': round(self.stats['wasted_cost'], 4),
+            'enabled': self.enabled
+        }
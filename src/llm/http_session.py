@@ -0,0 +1,121 @@
+"""
+HTTP Session Pool - session مشترک و بلندمدت aiohttp با connection pooling
+"""
+
+import asyncio
+from typing import Optional, Dict, Any, List
+
+import aiohttp
+
+
+class PooledSession:
+    """Session بلندمدت aiohttp با TCPConnector تنظیم‌شده و شمارنده‌های استفاده مجدد"""
+    
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 10,
+        keepalive_timeout: float = 60.0,
+        dns_cache_ttl: int = 300
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stale: List[aiohttp.ClientSession] = []  # session های loop های قبلی (در close بسته می‌شوند)
+        
+        # شمارنده‌ها برای بررسی استفاده مجدد از اتصال‌ها
+        self.stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0,
+            'sessions_created': 0
+        }
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'PooledSession':
+        """ساخت از بخش connection_pool تنظیمات"""
+        config = config or {}
+        return cls(
+            limit=config.get('limit', 100),
+            limit_per_host=config.get('limit_per_host', 10),
+            keepalive_timeout=config.get('keepalive_timeout', 60.0),
+            dns_cache_ttl=config.get('dns_cache_ttl', 300)
+        )
+    
+    def _build_trace_config(self) -> aiohttp.TraceConfig:
+        """ثبت callback ها برای شمارش اتصال‌ها"""
+        trace_config = aiohttp.TraceConfig()
+        
+        def counter(key: str):
+            async def _increment(session, context, params):
+                self.stats[key] += 1
+            return _increment
+        
+        trace_config.on_request_start.append(counter('requests'))
+        trace_config.on_connection_create_end.append(counter('connections_created'))
+        trace_config.on_connection_reuseconn.append(counter('connections_reused'))
+        trace_config.on_dns_cache_hit.append(counter('dns_cache_hits'))
+        trace_config.on_dns_cache_miss.append(counter('dns_cache_misses'))
+        return trace_config
+    
+    def session(self) -> aiohttp.ClientSession:
+        """دریافت session مشترک (در صورت نیاز ساخته می‌شود)
+
+        باید از داخل یک coroutine فراخوانی شود. اگر event loop عوض شده باشد
+        (مثلاً چند بار asyncio.run) session جدید ساخته می‌شود و session قبلی
+        برای بستن در close نگه داشته می‌شود.
+        """
+        loop = asyncio.get_running_loop()
+        
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed:
+                self._stale.append(self._session)
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[self._build_trace_config()]
+            )
+            self._loop = loop
+            self.stats['sessions_created'] += 1
+        
+        return self._session
+    
+    async def close(self):
+        """بستن session (و session های loop های قبلی) و آزاد کردن اتصال‌ها"""
+        for stale in self._stale:
+            try:
+                await stale.close()
+            except RuntimeError:
+                pass  # loop قبلی بسته شده؛ connector با این حال بسته علامت خورده است
+        self._stale.clear()
+        
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+    
+    @property
+    def is_open(self) -> bool:
+        """آیا session باز است؟"""
+        return self._session is not None and not self._session.closed
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار اتصال‌ها"""
+        total = self.stats['connections_created'] + self.stats['connections_reused']
+        return {
+            **self.stats,
+            'reuse_rate': round(self.stats['connections_reused'] / total, 3) if total else 0.0,
+            'open': self.is_open
+        }
@@ -0,0 +1,743 @@
+"""
+Inference Server - پردازه محلی inference با continuous batching برای حالت offline
+
+مدل یک بار (با mmap) بارگذاری می‌شود و در حافظه می‌ماند. درخواست‌های هم‌زمان
+از طریق unix socket (JSON در هر خط) دریافت می‌شوند و در هر گام decode کنار هم
+قرار می‌گیرند: درخواست جدید بدون منتظر ماندن برای پایان بقیه وارد batch می‌شود.
+KV cache پیشوندهای پرتکرار (system prompt مشترک generate_code/generate_tests)
+در sequence های رزرو شده نگه داشته و برای درخواست‌های بعدی کپی می‌شود.
+
+اجرا:
+    python src/llm/inference_server.py --model ./models/model.gguf --socket /tmp/auto-dev-llm.sock
+"""
+
+import argparse
+import asyncio
+import ctypes
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Tuple
+
+DEFAULT_SOCKET_PATH = "/tmp/auto-dev-llm.sock"
+
+# (token, position, seq_id, نیاز به logits)
+BatchEntry = Tuple[int, int, int, bool]
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    """طول بلندترین پیشوند مشترک دو لیست token"""
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+class LlamaCppBackend:
+    """دسترسی سطح پایین به llama.cpp (batch چند sequence و عملیات KV cache)
+
+    از API سطح پایین llama-cpp-python (نسخه 0.3.x با llama_vocab و
+    llama_memory) استفاده می‌شود چون کلاس Llama فقط یک sequence دارد.
+    """
+    
+    def __init__(
+        self,
+        model_path: str,
+        n_ctx: int = 8192,
+        n_batch: int = 512,
+        n_seq_max: int = 8,
+        n_threads: Optional[int] = None,
+        n_gpu_layers: int = 0,
+        use_mmap: bool = True,
+        use_mlock: bool = False
+    ):
+        try:
+            import numpy as np
+            import llama_cpp
+        except ImportError as e:
+            raise ImportError(
+                "سرور inference به llama-cpp-python>=0.3.16 و numpy نیاز دارد "
+                f"(pip install 'llama-cpp-python>=0.3.16' numpy): {e}"
+            ) from e
+        
+        self.np = np
+        self.llama_cpp = llama_cpp
+        self.n_batch = n_batch
+        
+        llama_cpp.llama_backend_init()
+        
+        model_params = llama_cpp.llama_model_default_params()
+        model_params.n_gpu_layers = n_gpu_layers
+        model_params.use_mmap = use_mmap
+        model_params.use_mlock = use_mlock
+        self.model = llama_cpp.llama_model_load_from_file(model_path.encode('utf-8'), model_params)
+        if not self.model:
+            raise RuntimeError(f"بارگذاری مدل ناموفق بود: {model_path}")
+        self.vocab = llama_cpp.llama_model_get_vocab(self.model)
+        
+        threads = n_threads or os.cpu_count() or 4
+        context_params = llama_cpp.llama_context_default_params()
+        context_params.n_ctx = n_ctx
+        context_params.n_batch = n_batch
+        context_params.n_seq_max = n_seq_max
+        context_params.n_threads = threads
+        context_params.n_threads_batch = threads
+        # KV cache مشترک بین sequence ها تا پیشوندها کپی (و ظرفیت کل n_ctx) باشد
+        context_params.kv_unified = True
+        self.ctx = llama_cpp.llama_init_from_model(self.model, context_params)
+        if not self.ctx:
+            raise RuntimeError("ساخت context ناموفق بود")
+        
+        self.memory = llama_cpp.llama_get_memory(self.ctx)
+        self.n_ctx = llama_cpp.llama_n_ctx(self.ctx)
+        self.n_vocab = llama_cpp.llama_vocab_n_tokens(self.vocab)
+        self.batch = llama_cpp.llama_batch_init(n_batch, 0, n_seq_max)
+        self.eos_token = llama_cpp.llama_vocab_eos(self.vocab)
+        self.bos_text = self.token_to_piece(llama_cpp.llama_vocab_bos(self.vocab)).decode('utf-8', errors='ignore')
+        self.eos_text = self.token_to_piece(self.eos_token).decode('utf-8', errors='ignore')
+        self.chat_template = self._metadata('tokenizer.chat_template')
+    
+    def _metadata(self, key: str) -> Optional[str]:
+        """خواندن یک مقدار متنی از metadata فایل GGUF"""
+        size = 64 * 1024
+        buf = ctypes.create_string_buffer(size)
+        length = self.llama_cpp.llama_model_meta_val_str(self.model, key.encode('utf-8'), buf, size)
+        if length <= 0:
+            return None
+        return buf.value.decode('utf-8', errors='ignore')
+    
+    def format_chat(self, messages: List[Dict[str, str]]) -> Tuple[str, List[str]]:
+        """تبدیل messages به prompt با قالب chat مدل (و stop های قالب)"""
+        if self.chat_template:
+            from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+            
+            formatter = Jinja2ChatFormatter(
+                template=self.chat_template,
+                eos_token=self.eos_text,
+                bos_token=self.bos_text
+            )
+            result = formatter(messages=messages)
+            stop = result.stop if isinstance(result.stop, list) else [result.stop] if result.stop else []
+            return result.prompt, stop
+        
+        # قالب ساده برای مدل‌های بدون chat_template
+        parts = []
+        for message in messages:
+            parts.append(f"### {message['role'].capitalize()}:\n{message['content']}\n")
+        parts.append("### Assistant:\n")
+        return '\n'.join(parts), ["### User:"]
+    
+    def tokenize(self, text: str) -> List[int]:
+        """تبدیل متن به token ها"""
+        data = text.encode('utf-8')
+        add_special = not (self.bos_text and text.startswith(self.bos_text))
+        n_max = len(data) + 8
+        while True:
+            tokens = (self.llama_cpp.llama_token * n_max)()
+            n = self.llama_cpp.llama_tokenize(self.vocab, data, len(data), tokens, n_max, add_special, True)
+            if n >= 0:
+                return list(tokens[:n])
+            n_max = -n
+    
+    def token_to_piece(self, token: int) -> bytes:
+        """بایت‌های متن یک token"""
+        buf = ctypes.create_string_buffer(64)
+        n = self.llama_cpp.llama_token_to_piece(self.vocab, token, buf, len(buf), 0, False)
+        if n < 0:
+            buf = ctypes.create_string_buffer(-n)
+            n = self.llama_cpp.llama_token_to_piece(self.vocab, token, buf, len(buf), 0, False)
+        return buf.raw[:n]
+    
+    def is_end_token(self, token: int) -> bool:
+        """آیا token پایان تولید است"""
+        return bool(self.llama_cpp.llama_vocab_is_eog(self.vocab, token))
+    
+    def decode(self, entries: List[BatchEntry]) -> Dict[int, Any]:
+        """یک گام decode برای همه entry ها؛ خروجی: اندیس entry -> logits"""
+        batch = self.batch
+        for i, (token, pos, seq_id, want_logits) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = pos
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq_id
+            batch.logits[i] = want_logits
+        batch.n_tokens = len(entries)
+        
+        result = self.llama_cpp.llama_decode(self.ctx, batch)
+        if result != 0:
+            raise RuntimeError(f"llama_decode ناموفق بود (کد {result}، احتمالاً KV cache پر است)")
+        
+        logits = {}
+        for i, entry in enumerate(entries):
+            if entry[3]:
+                pointer = self.llama_cpp.llama_get_logits_ith(self.ctx, i)
+                logits[i] = self.np.ctypeslib.as_array(pointer, shape=(self.n_vocab,)).copy()
+        return logits
+    
+    def sample(self, logits, temperature: float) -> int:
+        """انتخاب token بعدی (greedy برای دمای صفر)"""
+        np = self.np
+        if temperature <= 0:
+            return int(np.argmax(logits))
+        scaled = (logits - logits.max()) / temperature
+        probs = np.exp(scaled)
+        probs /= probs.sum()
+        return int(np.random.choice(len(probs), p=probs))
+    
+    def kv_copy(self, src_seq: int, dst_seq: int, p0: int, p1: int):
+        """اشتراک KV cache بازه [p0, p1) از یک sequence با sequence دیگر"""
+        self.llama_cpp.llama_memory_seq_cp(self.memory, src_seq, dst_seq, p0, p1)
+    
+    def kv_remove(self, seq_id: int):
+        """حذف کامل KV cache یک sequence"""
+        self.llama_cpp.llama_memory_seq_rm(self.memory, seq_id, -1, -1)
+    
+    def close(self):
+        """آزاد کردن context و مدل"""
+        self.llama_cpp.llama_batch_free(self.batch)
+        self.llama_cpp.llama_free(self.ctx)
+        self.llama_cpp.llama_model_free(self.model)
+
+
+@dataclass
+class Sequence:
+    """یک درخواست در حال تولید"""
+    prompt_tokens: List[int]
+    max_tokens: int
+    temperature: float
+    stop: List[str]
+    future: asyncio.Future
+    seq_id: int = -1
+    n_past: int = 0              # token هایی که در KV cache هستند
+    reused_tokens: int = 0       # token های پیشوند که از کش کپی شدند
+    kv_cells: int = 0            # خانه‌های KV رزروشده (prompt بدون پیشوند کش‌شده + max_tokens)
+    generated: List[int] = field(default_factory=list)
+    text: bytes = b''
+    start_time: float = field(default_factory=time.time)
+    
+    @property
+    def prefilled(self) -> bool:
+        return self.n_past >= len(self.prompt_tokens)
+
+
+class BatchScheduler:
+    """زمان‌بند continuous batching
+
+    در هر گام: یک token برای هر sequence در حال تولید، و باقی ظرفیت batch
+    برای prefill درخواست‌های تازه. sequence های 0 تا prefix_slots-1 برای
+    نگهداری KV پیشوندهای پرتکرار رزرو شده‌اند.
+
+    KV cache (n_ctx خانه) بین همه sequence ها و پیشوندهای کش‌شده مشترک است؛
+    درخواست فقط وقتی وارد batch می‌شود که prompt و max_tokens آن در ظرفیت
+    باقی‌مانده جا شود و تا آن زمان در صف می‌ماند.
+    """
+    
+    def __init__(
+        self,
+        backend,
+        n_parallel: int = 4,
+        n_batch: int = 512,
+        prefix_slots: int = 2,
+        min_prefix_tokens: int = 32
+    ):
+        self.backend = backend
+        self.n_batch = n_batch
+        self.min_prefix_tokens = min_prefix_tokens
+        
+        self.waiting: deque = deque()
+        self.active: Dict[int, Sequence] = {}
+        self.free_ids = list(range(prefix_slots + n_parallel - 1, prefix_slots - 1, -1))
+        self.prefix_ids = list(range(prefix_slots))
+        self.prefixes: "OrderedDict[int, List[int]]" = OrderedDict()  # slot -> token ها (LRU)
+        
+        # decode در یک thread جدا تا event loop برای پذیرش درخواست‌ها آزاد بماند
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-decode")
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        
+        self.stats = {
+            'requests': 0,
+            'completed': 0,
+            'steps': 0,
+            'batched_tokens': 0,
+            'max_batch_sequences': 0,
+            'prompt_tokens': 0,
+            'generated_tokens': 0,
+            'prefix_hits': 0,
+            'reused_tokens': 0,
+            'evicted_prefixes': 0,
+            'errors': 0
+        }
+    
+    def start(self):
+        """شروع حلقه زمان‌بند"""
+        self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        """توقف حلقه و thread"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+    
+    async def submit(
+        self,
+        prompt_tokens: List[int],
+        max_tokens: int,
+        temperature: float,
+        stop: List[str]
+    ) -> Dict[str, Any]:
+        """افزودن درخواست به صف و انتظار برای نتیجه"""
+        if len(prompt_tokens) + max_tokens > self.backend.n_ctx:
+            raise ValueError(
+                f"prompt ({len(prompt_tokens)}) + max_tokens ({max_tokens}) "
+                f"از n_ctx ({self.backend.n_ctx}) بیشتر است"
+            )
+        
+        sequence = Sequence(
+            prompt_tokens=prompt_tokens,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stop=stop,
+            future=asyncio.get_running_loop().create_future()
+        )
+        self.waiting.append(sequence)
+        self.stats['requests'] += 1
+        self._wakeup.set()
+        return await sequence.future
+    
+    def _kv_free(self) -> int:
+        """خانه‌های آزاد KV cache (پیشوندهای کش‌شده و رزرو sequence های فعال کم می‌شوند)"""
+        used = sum(len(tokens) for tokens in self.prefixes.values())
+        used += sum(sequence.kv_cells for sequence in self.active.values())
+        return self.backend.n_ctx - used
+    
+    def _best_prefix(self, sequence: Sequence) -> Tuple[Optional[int], int]:
+        """پیشوند کش‌شده قابل استفاده (حداقل آخرین token باید decode شود)"""
+        best_slot, best_length = None, 0
+        for slot, tokens in self.prefixes.items():
+            length = common_prefix_length(tokens, sequence.prompt_tokens)
+            if length > best_length:
+                best_slot, best_length = slot, length
+        best_length = min(best_length, len(sequence.prompt_tokens) - 1)
+        if best_slot is None or best_length < self.min_prefix_tokens:
+            return None, 0
+        return best_slot, best_length
+    
+    def _admit(self):
+        """ورود درخواست‌های منتظر به batch (تا پر شدن sequence ها یا KV cache)"""
+        while self.waiting and self.free_ids:
+            sequence = self.waiting[0]
+            best_slot, best_length = self._best_prefix(sequence)
+            kv_cells = len(sequence.prompt_tokens) - best_length + sequence.max_tokens
+            
+            if kv_cells > self._kv_free():
+                if self.active or not self.prefixes:
+                    # منتظر پایان sequence های فعال (ترتیب صف حفظ می‌شود)
+                    return
+                # batch خالی است: آزاد کردن قدیمی‌ترین پیشوند کش‌شده
+                slot, _ = self.prefixes.popitem(last=False)
+                self.backend.kv_remove(slot)
+                self.stats['evicted_prefixes'] += 1
+                continue
+            
+            self.waiting.popleft()
+            sequence.seq_id = self.free_ids.pop()
+            sequence.kv_cells = kv_cells
+            self.active[sequence.seq_id] = sequence
+            
+            if best_slot is not None:
+                self.backend.kv_copy(best_slot, sequence.seq_id, 0, best_length)
+                self.prefixes.move_to_end(best_slot)
+                sequence.n_past = best_length
+                sequence.reused_tokens = best_length
+                self.stats['prefix_hits'] += 1
+                self.stats['reused_tokens'] += best_length
+    
+    def _cache_prefix(self, sequence: Sequence):
+        """نگهداری KV پرامپت یک درخواست بدون پیشوند کش‌شده برای درخواست‌های بعدی"""
+        if sequence.reused_tokens >= self.min_prefix_tokens or not self.prefix_ids:
+            return
+        if len(sequence.prompt_tokens) < self.min_prefix_tokens:
+            return
+        
+        if len(self.prefixes) < len(self.prefix_ids):
+            slot = next(s for s in self.prefix_ids if s not in self.prefixes)
+        else:
+            slot, _ = self.prefixes.popitem(last=False)
+            self.backend.kv_remove(slot)
+        
+        self.backend.kv_copy(sequence.seq_id, slot, 0, len(sequence.prompt_tokens))
+        self.prefixes[slot] = list(sequence.prompt_tokens)
+    
+    def _build_batch(self) -> Tuple[List[BatchEntry], List[Tuple[int, Sequence]]]:
+        """ساخت batch گام بعد
+
+        Returns:
+            (entry ها، لیست (اندیس entry دارای logits, sequence))
+        """
+        entries: List[BatchEntry] = []
+        sampled: List[Tuple[int, Sequence]] = []
+        
+        # اول sequence های در حال تولید (یک token برای هر کدام)
+        for sequence in self.active.values():
+            if sequence.prefilled and sequence.generated:
+                entries.append((sequence.generated[-1], sequence.n_past, sequence.seq_id, True))
+                sampled.append((len(entries) - 1, sequence))
+        
+        # سپس prefill (تکه‌تکه، در ظرفیت باقی‌مانده)
+        for sequence in self.active.values():
+            if sequence.prefilled:
+                continue
+            budget = self.n_batch - len(entries)
+            if budget <= 0:
+                break
+            
+            end = min(len(sequence.prompt_tokens), sequence.n_past + budget)
+            for pos in range(sequence.n_past, end):
+                is_last = pos == len(sequence.prompt_tokens) - 1
+                entries.append((sequence.prompt_tokens[pos], pos, sequence.seq_id, is_last))
+                if is_last:
+                    sampled.append((len(entries) - 1, sequence))
+        
+        return entries, sampled
+    
+    def _finish(self, sequence: Sequence, finish_reason: str, error: Optional[str] = None):
+        """پایان یک sequence و آزاد کردن جایگاه آن"""
+        self.backend.kv_remove(sequence.seq_id)
+        del self.active[sequence.seq_id]
+        self.free_ids.append(sequence.seq_id)
+        
+        if sequence.future.done():
+            return
+        if error:
+            sequence.future.set_exception(RuntimeError(error))
+            return
+        
+        text = sequence.text.decode('utf-8', errors='ignore')
+        for stop in sequence.stop:
+            if stop and stop in text:
+                text = text[:text.index(stop)]
+        
+        self.stats['completed'] += 1
+        sequence.future.set_result({
+            'content': text,
+            'prompt_tokens': len(sequence.prompt_tokens),
+            'completion_tokens': len(sequence.generated),
+            'cached_tokens': sequence.reused_tokens,
+            'finish_reason': finish_reason,
+            'duration': time.time() - sequence.start_time
+        })
+    
+    def _accept_token(self, sequence: Sequence, token: int):
+        """افزودن token نمونه‌برداری‌شده و بررسی شرط پایان"""
+        if self.backend.is_end_token(token):
+            self._finish(sequence, 'stop')
+            return
+        
+        sequence.generated.append(token)
+        sequence.text += self.backend.token_to_piece(token)
+        self.stats['generated_tokens'] += 1
+        
+        if sequence.stop:
+            # فقط انتهای متن بررسی می‌شود
+            tail = sequence.text[-256:].decode('utf-8', errors='ignore')
+            if any(stop and stop in tail for stop in sequence.stop):
+                self._finish(sequence, 'stop')
+                return
+        
+        if len(sequence.generated) >= sequence.max_tokens:
+            self._finish(sequence, 'length')
+    
+    async def _step(self):
+        """یک گام decode برای کل batch"""
+        entries, sampled = self._build_batch()
+        if not entries:
+            return
+        
+        loop = asyncio.get_running_loop()
+        try:
+            logits = await loop.run_in_executor(self.executor, self.backend.decode, entries)
+        except Exception as e:
+            for sequence in list(self.active.values()):
+                self._finish(sequence, 'error', error=str(e))
+            return
+        
+        self.stats['steps'] += 1
+        self.stats['batched_tokens'] += len(entries)
+        self.stats['max_batch_sequences'] = max(
+            self.stats['max_batch_sequences'], len({entry[2] for entry in entries})
+        )
+        
+        for token, pos, seq_id, _ in entries:
+            sequence = self.active[seq_id]
+            sequence.n_past = max(sequence.n_past, pos + 1)
+            if pos < len(sequence.prompt_tokens):
+                self.stats['prompt_tokens'] += 1
+        
+        for index, sequence in sampled:
+            if sequence.generated == [] and sequence.prefilled:
+                self._cache_prefix(sequence)
+            token = self.backend.sample(logits[index], sequence.temperature)
+            self._accept_token(sequence, token)
+    
+    def _fail_all(self, error: str):
+        """شکست همه درخواست‌های فعال و منتظر و آزاد کردن جایگاه‌ها (بدون اتکا به backend سالم)"""
+        while self.waiting:
+            sequence = self.waiting.popleft()
+            if not sequence.future.done():
+                sequence.future.set_exception(RuntimeError(error))
+        for sequence in list(self.active.values()):
+            try:
+                self.backend.kv_remove(sequence.seq_id)
+            except Exception:
+                pass
+            del self.active[sequence.seq_id]
+            self.free_ids.append(sequence.seq_id)
+            if not sequence.future.done():
+                sequence.future.set_exception(RuntimeError(error))
+    
+    async def _run(self):
+        """حلقه اصلی: پذیرش درخواست‌ها و اجرای گام‌ها تا خالی شدن صف"""
+        while True:
+            if not self.waiting and not self.active:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            
+            try:
+                self._admit()
+                await self._step()
+            except Exception as e:
+                # خطای پیش‌بینی‌نشده نباید حلقه را متوقف کند و future ها را بی‌پاسخ بگذارد
+                print(f"❌ خطا در زمان‌بند inference: {e}")
+                self.stats['errors'] += 1
+                self._fail_all(str(e) or type(e).__name__)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار batching"""
+        steps = self.stats['steps']
+        return {
+            **self.stats,
+            'active': len(self.active),
+            'waiting': len(self.waiting),
+            'cached_prefixes': len(self.prefixes),
+            'kv_free': self._kv_free(),
+            'avg_batch_tokens': round(self.stats['batched_tokens'] / steps, 1) if steps else 0.0
+        }
+
+
+class InferenceServer:
+    """سرور unix socket (هر خط یک درخواست/پاسخ JSON)"""
+    
+    def __init__(self, backend, scheduler: BatchScheduler, socket_path: str = DEFAULT_SOCKET_PATH):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.socket_path = socket_path
+        self.server = None
+    
+    async def _handle_request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """پردازش یک درخواست"""
+        if message.get('op') == 'stats':
+            return {'stats': self.scheduler.get_stats()}
+        
+        prompt, template_stop = self.backend.format_chat(message['messages'])
+        result = await self.scheduler.submit(
+            prompt_tokens=self.backend.tokenize(prompt),
+            max_tokens=message.get('max_tokens', 2048),
+            temperature=message.get('temperature', 0.7),
+            stop=template_stop + (message.get('stop') or [])
+        )
+        return result
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """خواندن درخواست‌ها از یک اتصال (درخواست‌های یک اتصال هم هم‌زمان اجرا می‌شوند)"""
+        write_lock = asyncio.Lock()
+        tasks = set()
+        
+        async def respond(message: Dict[str, Any]):
+            try:
+                response = await self._handle_request(message)
+            except Exception as e:
+                response = {'error': str(e) or type(e).__name__}
+            response['id'] = message.get('id')
+            async with write_lock:
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(respond(json.loads(line)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def serve_forever(self):
+        """اجرای سرور تا زمان توقف"""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        
+        self.scheduler.start()
+        self.server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path)
+        print(f"✅ سرور inference آماده است: {self.socket_path}")
+        
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            await self.scheduler.stop()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class InferenceServerClient:
+    """کلاینت سرور inference محلی (با راه‌اندازی خودکار پردازه در صورت نیاز)"""
+    
+    def __init__(
+        self,
+        socket_path: str = DEFAULT_SOCKET_PATH,
+        autostart: bool = False,
+        server_args: Optional[List[str]] = None,
+        startup_timeout: float = 300.0
+    ):
+        self.socket_path = socket_path
+        self.autostart = autostart
+        self.server_args = server_args or []
+        self.startup_timeout = startup_timeout
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+    
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """اتصال به سرور (و راه‌اندازی آن اگر autostart فعال باشد)"""
+        try:
+            return await asyncio.open_unix_connection(self.socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if not self.autostart:
+                raise
+        
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        
+        async with self._start_lock:
+            if self.process is None or self.process.returncode is not None:
+                print("⏳ راه‌اندازی سرور inference محلی...")
+                self.process = await asyncio.create_subprocess_exec(
+                    sys.executable, os.path.abspath(__file__),
+                    '--socket', self.socket_path, *self.server_args
+                )
+            
+            deadline = time.time() + self.startup_timeout
+            while True:
+                try:
+                    return await asyncio.open_unix_connection(self.socket_path)
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if self.process.returncode is not None:
+                        raise RuntimeError(f"سرور inference متوقف شد (کد {self.process.returncode})")
+                    if time.time() > deadline:
+                        raise
+                    await asyncio.sleep(0.5)
+    
+    async def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """ارسال یک درخواست و دریافت پاسخ"""
+        reader, writer = await self._connect()
+        try:
+            writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("اتصال سرور inference بسته شد")
+            response = json.loads(line)
+        finally:
+            writer.close()
+        
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+    
+    async def generate(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float,
+        stop: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """تولید متن روی سرور"""
+        return await self.request({
+            'messages': messages,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'stop': stop or []
+        })
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """آمار batching سرور"""
+        return (await self.request({'op': 'stats'}))['stats']
+    
+    async def close(self):
+        """توقف پردازه سرور اگر توسط همین کلاینت راه‌اندازی شده باشد"""
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="سرور inference محلی با continuous batching")
+    parser.add_argument('--model', required=True, help="مسیر فایل GGUF")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help="مسیر unix socket")
+    parser.add_argument('--n-ctx', type=int, default=8192, help="اندازه context مشترک همه sequence ها")
+    parser.add_argument('--n-batch', type=int, default=512)
+    parser.add_argument('--n-parallel', type=int, default=4, help="حداکثر درخواست هم‌زمان در batch")
+    parser.add_argument('--prefix-slots', type=int, default=2, help="تعداد پیشوندهای کش‌شده")
+    parser.add_argument('--min-prefix-tokens', type=int, default=32)
+    parser.add_argument('--n-threads', type=int, default=None)
+    parser.add_argument('--n-gpu-layers', type=int, default=0)
+    parser.add_argument('--no-mmap', action='store_true')
+    parser.add_argument('--mlock', action='store_true')
+    args = parser.parse_args()
+    
+    print(f"⏳ در حال بارگذاری مدل از: {args.model}")
+    backend = LlamaCppBackend(
+        model_path=args.model,
+        n_ctx=args.n_ctx,
+        n_batch=args.n_batch,
+        n_seq_max=args.prefix_slots + args.n_parallel,
+        n_threads=args.n_threads,
+        n_gpu_layers=args.n_gpu_layers,
+        use_mmap=not args.no_mmap,
+        use_mlock=args.mlock
+    )
+    print("✅ مدل بارگذاری شد")
+    
+    async def run():
+        scheduler = BatchScheduler(
+            backend,
+            n_parallel=args.n_parallel,
+            n_batch=args.n_batch,
+            prefix_slots=args.prefix_slots,
+            min_prefix_tokens=args.min_prefix_tokens
+        )
+        await InferenceServer(backend, scheduler, args.socket).serve_forever()
+    
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
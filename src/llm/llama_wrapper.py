@@ -3,14 +3,54 @@ LLM Wrapper - رابط یکپارچه برای تمام LLMها (Custom API, MCP
 """
 
 import asyncio
-import aiohttp
 import time
-from typing import Optional, Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
 from enum import Enum
-from dataclasses import dataclass
-import json
+from dataclasses import dataclass, replace
 import os
 
+from llm.http_session import PooledSession
+from llm.streaming import StreamChunk, StreamState, read_text_stream
+from llm.response_cache import ResponseCache, request_fingerprint
+from llm.single_flight import SingleFlight
+from llm.prompt_cache import (
+    build_messages, flatten_prompt, parse_usage, total_tokens, PromptCacheStats
+)
+from llm.adaptive_concurrency import AdaptiveConcurrencyLimiter
+from llm.hedging import HedgingPolicy
+from llm.circuit_breaker import CircuitBreaker
+from llm.inference_server import InferenceServerClient, DEFAULT_SOCKET_PATH
+from llm.token_counter import TokenCounter
+from llm.cost_ledger import CostLedger
+from llm.continuation import generate_with_continuation, stream_with_continuation, is_truncated, STALLED_REASON
+from llm.timeouts import PhaseTimeouts
+from llm.retry_policy import RetryPolicy, APIError, classify_error
+from llm.model_router import ModelRouter
+from llm.best_of_n import candidate_temperatures, select_best, combine_candidates, first_failure
+from llm.edit_blocks import EDIT_FORMAT, EditError, parse_edit_blocks, apply_edits, validate_edit, edit_view
+from llm.multi_file import MULTI_FILE_FORMAT, parse_multi_file, validate_file
+from llm.output_lengths import OutputLengthModel
+from llm.symbol_index import parse_module
+from reviewers.code_reviewer import AICodeReviewer
+from llm.rate_limiter import (
+    ProviderRateLimiter, RateLimitError, estimate_request_tokens
+)
+
+
+def _extension(file_path: str) -> str:
+    """پسوند فایل برای گروه‌بندی طول خروجی"""
+    return os.path.splitext(file_path)[1] or 'none'
+
+
+def _code_stub(code: str) -> Optional[str]:
+    """نمای stub کد Python (امضا و خلاصه docstring)؛ None اگر parse نشود"""
+    try:
+        symbols = parse_module(code)['symbols']
+    except SyntaxError:
+        return None
+    return '\n\n'.join(symbols.values()) or None
+
 
 class LLMProvider(Enum):
     """ارائه‌دهندگان LLM"""
@@ -29,6 +69,14 @@ class LLMRequest:
     temperature: float = 0.7
     system_prompt: Optional[str] = None
     context: Optional[List[Dict[str, str]]] = None
+    bypass_cache: bool = False  # نادیده گرفتن کش پاسخ‌ها
+    stable_context: Optional[List[str]] = None  # بلوک‌های ثابت (feature، مخزن) قبل از prompt، قابل کش
+    feature: Optional[str] = None  # برای آمار prompt cache و بودجه به تفکیک feature
+    task: Optional[str] = None  # برای ثبت هزینه به تفکیک task
+    stop: Optional[List[str]] = None  # توقف تولید با رسیدن به این رشته‌ها
+    output_kind: Optional[str] = None  # نوع خروجی (code:.py، tests:.py، ...) برای تعیین تطبیقی max_tokens
+    deadline: Optional[float] = None  # پایان مهلت (time.time) در تمام retry ها و fallback ها
+    model: Optional[str] = None  # مدل انتخاب‌شده توسط مسیریابی (None = مدل پیش‌فرض کلاینت)
 
 
 @dataclass
@@ -42,6 +90,16 @@ class LLMResponse:
     success: bool
     cost: float = 0.0  # هزینه برآوردی
     error: Optional[str] = None
+    error_kind: Optional[str] = None  # دسته خطا (classify_error)
+    time_to_first_token: Optional[float] = None  # فقط در حالت stream
+    cached: bool = False  # پاسخ از کش دیسک خوانده شده
+    tokens_per_second: Optional[float] = None  # سرعت تولید (مدل آفلاین)
+    input_tokens: int = 0  # token های ورودی بدون کش
+    cache_creation_tokens: int = 0  # token های نوشته‌شده در prompt cache
+    cache_read_tokens: int = 0  # token های خوانده‌شده از prompt cache
+    finish_reason: Optional[str] = None  # دلیل پایان تولید (stop، length، max_tokens، ...)
+    continuations: int = 0  # تعداد درخواست‌های ادامه برای پاسخ‌های قطع‌شده
+    request: Optional[LLMRequest] = None  # درخواست تولید این محتوا (برای ادامه گفتگو در تولید تست)
 
 
 class CustomAPIClient:
@@ -55,7 +113,8 @@ class CustomAPIClient:
         timeout: int = 300,
         retry: int = 3,
         custom_headers: Optional[Dict[str, str]] = None,
-        use_cache: bool = True
+        use_cache: bool = True,
+        pool_config: Optional[Dict[str, Any]] = None
     ):
         self.base_url = base_url.rstrip('/')
         self.api_key = api_key
@@ -64,6 +123,11 @@ class CustomAPIClient:
         self.retry = retry
         self.custom_headers = custom_headers or {}
         self.use_cache = use_cache
+        self.http = PooledSession.from_config(pool_config)
+        self.rate_limiter = ProviderRateLimiter()  # بدون محدودیت تا زمان تنظیم
+        self.timeouts = PhaseTimeouts(total=timeout)
+        self.retry_policy = RetryPolicy()  # سیاست مشترک پس از راه‌اندازی جایگزین می‌شود
+        self.max_continuations = 0  # ادامه خودکار پاسخ‌های قطع‌شده (تا زمان تنظیم خاموش)
         
         # قیمت‌گذاری Sonnet 4.5 (per million tokens)
         self.pricing = {
@@ -72,27 +136,23 @@ class CustomAPIClient:
             'cache_write': 3.75,
             'cache_read': 0.30
         }
+        self.model_pricing: Dict[str, Dict[str, float]] = {}  # قیمت مدل‌های جدول مسیریابی
     
-    def _calculate_cost(
-        self,
-        input_tokens: int,
-        output_tokens: int,
-        cache_hit: bool = False
-    ) -> float:
-        """محاسبه هزینه"""
-        if cache_hit:
-            input_cost = (input_tokens * self.pricing['cache_read']) / 1_000_000
-        else:
-            input_cost = (input_tokens * self.pricing['input']) / 1_000_000
+    def _calculate_cost(self, usage: Dict[str, int], model: Optional[str] = None) -> float:
+        """محاسبه هزینه (ورودی عادی، نوشتن و خواندن کش هر کدام با نرخ خود)"""
+        pricing = self.model_pricing.get(model or self.model, self.pricing)
+        input_cost = (
+            usage['input_tokens'] * pricing['input']
+            + usage['cache_creation_input_tokens'] * pricing['cache_write']
+            + usage['cache_read_input_tokens'] * pricing['cache_read']
+        ) / 1_000_000
         
-        output_cost = (output_tokens * self.pricing['output']) / 1_000_000
+        output_cost = (usage['output_tokens'] * pricing['output']) / 1_000_000
         
         return input_cost + output_cost
     
-    async def generate(self, request: LLMRequest) -> LLMResponse:
-        """ارسال درخواست به API سفارشی"""
-        start_time = time.time()
-        
+    def _build_request(self, request: LLMRequest) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """ساخت headers و payload درخواست"""
         # ساخت headers
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -100,799 +160,2022 @@ class CustomAPIClient:
             **self.custom_headers
         }
         
-        # ساخت messages
-        messages = []
-        if request.system_prompt:
-            messages.append({
-                "role": "system",
-                "content": request.system_prompt
-            })
-        
-        if request.context:
-            messages.extend(request.context)
-        
-        messages.append({
-            "role": "user",
-            "content": request.prompt
-        })
+        # ساخت messages (بخش‌های ثابت اول، با breakpoint کش)
+        _, messages = build_messages(request, self.use_cache)
         
         # ساخت payload
         payload = {
-            "model": self.model,
+            "model": request.model or self.model,
             "messages": messages,
             "max_tokens": request.max_tokens,
             "temperature": request.temperature
         }
         
+        if request.stop:
+            payload["stop"] = request.stop
+        
         # اضافه کردن cache headers
         if self.use_cache:
             headers["anthropic-beta"] = "prompt-caching-2024-07-31"
-            # علامت‌گذاری system prompt برای cache
-            if messages and messages[0]["role"] == "system":
-                messages[0]["cache_control"] = {"type": "ephemeral"}
+        
+        return headers, payload
+    
+    async def generate(self, request: LLMRequest) -> LLMResponse:
+        """ارسال درخواست به API سفارشی (با ادامه خودکار پاسخ‌های قطع‌شده)"""
+        return await generate_with_continuation(self._generate_once, request, self.max_continuations)
+    
+    async def _generate_once(self, request: LLMRequest) -> LLMResponse:
+        """یک درخواست به API سفارشی"""
+        start_time = time.time()
+        headers, payload = self._build_request(request)
+        estimated_tokens = estimate_request_tokens(request)
+        delay = 0.0
         
         for attempt in range(self.retry):
             try:
-                async with aiohttp.ClientSession() as session:
-                    # URL کامل
-                    url = f"{self.base_url}/chat/completions"
-                    
-                    async with session.post(
-                        url,
-                        headers=headers,
-                        json=payload,
-                        timeout=aiohttp.ClientTimeout(total=self.timeout)
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            duration = time.time() - start_time
-                            
-                            # استخراج محتوا (OpenAI format)
-                            if 'choices' in data:
-                                content = data['choices'][0]['message']['content']
-                                tokens = data.get('usage', {})
-                                input_tokens = tokens.get('prompt_tokens', 0)
-                                output_tokens = tokens.get('completion_tokens', 0)
-                                total_tokens = tokens.get('total_tokens', input_tokens + output_tokens)
-                            # یا Anthropic format
-                            elif 'content' in data:
-                                content = data['content'][0]['text']
-                                usage = data.get('usage', {})
-                                input_tokens = usage.get('input_tokens', 0)
-                                output_tokens = usage.get('output_tokens', 0)
-                                total_tokens = input_tokens + output_tokens
-                            else:
-                                raise Exception("فرمت پاسخ نامعتبر")
-                            
-                            # محاسبه هزینه
-                            cache_hit = data.get('usage', {}).get('cache_read_input_tokens', 0) > 0
-                            cost = self._calculate_cost(input_tokens, output_tokens, cache_hit)
-                            
-                            return LLMResponse(
-                                content=content,
-                                model=self.model,
-                                provider=LLMProvider.CUSTOM,
-                                tokens_used=total_tokens,
-                                duration=duration,
-                                success=True,
-                                cost=cost
-                            )
+                session = self.http.session()
+                # URL کامل
+                url = f"{self.base_url}/chat/completions"
+                
+                async with self.rate_limiter.reserve(estimated_tokens) as reservation, session.post(
+                    url,
+                    headers=headers,
+                    json=payload,
+                    timeout=self.timeouts.client_timeout(time_left=self.retry_policy.time_left(request.deadline))
+                ) as response:
+                    self.timeouts.record('first_byte', time.time() - reservation.acquired_at)
+                    retry_after = self.rate_limiter.observe(response.status, response.headers)
+                    if response.status == 200:
+                        data = await response.json()
+                        duration = time.time() - start_time
+                        
+                        # استخراج محتوا (OpenAI format)
+                        if 'choices' in data:
+                            content = data['choices'][0]['message']['content']
+                            finish_reason = data['choices'][0].get('finish_reason')
+                        # یا Anthropic format
+                        elif 'content' in data:
+                            content = data['content'][0]['text']
+                            finish_reason = data.get('stop_reason')
                         else:
-                            error_text = await response.text()
-                            raise Exception(f"API error {response.status}: {error_text}")
+                            raise Exception("فرمت پاسخ نامعتبر")
+                        
+                        # محاسبه هزینه
+                        usage = parse_usage(data.get('usage'))
+                        cost = self._calculate_cost(usage, request.model)
+                        reservation.settle(total_tokens(usage))
+                        
+                        return LLMResponse(
+                            content=content,
+                            model=request.model or self.model,
+                            provider=LLMProvider.CUSTOM,
+                            tokens_used=total_tokens(usage),
+                            duration=duration,
+                            success=True,
+                            cost=cost,
+                            input_tokens=usage['input_tokens'],
+                            cache_creation_tokens=usage['cache_creation_input_tokens'],
+                            cache_read_tokens=usage['cache_read_input_tokens'],
+                            finish_reason=finish_reason
+                        )
+                    else:
+                        error_text = await response.text()
+                        if response.status == 429:
+                            raise RateLimitError(f"API error 429: {error_text}", retry_after)
+                        raise APIError(f"API error {response.status}: {error_text}", response.status)
             
             except Exception as e:
-                if attempt == self.retry - 1:
+                self.timeouts.record_error(e)
+                # خطای قطعی، آخرین تلاش یا نبود وقت کافی تا پایان مهلت: بدون retry
+                delay = self.retry_policy.next_delay(e, attempt, self.retry, delay, request.deadline)
+                if delay is None:
                     duration = time.time() - start_time
                     return LLMResponse(
                         content='',
-                        model=self.model,
+                        model=request.model or self.model,
                         provider=LLMProvider.CUSTOM,
                         tokens_used=0,
                         duration=duration,
                         success=False,
                         cost=0.0,
-                        error=str(e)
+                        error=str(e) or type(e).__name__,
+                        error_kind=classify_error(e)
+                    )
+                await asyncio.sleep(delay)
+    
+    async def stream(self, request: LLMRequest) -> AsyncIterator[StreamChunk]:
+        """ارسال درخواست به صورت stream (SSE) با ادامه خودکار پاسخ‌های قطع‌شده"""
+        async for chunk in stream_with_continuation(self._stream_once, request, self.max_continuations):
+            yield chunk
+    
+    async def _stream_once(self, request: LLMRequest) -> AsyncIterator[StreamChunk]:
+        """یک درخواست stream
+
+        retry فقط تا قبل از رسیدن اولین token انجام می‌شود. توقف stream پس
+        از آن با finish_reason=stalled گزارش می‌شود تا از همان نقطه ادامه یابد.
+        """
+        state = StreamState()
+        headers, payload = self._build_request(request)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        parts: List[str] = []
+        estimated_tokens = estimate_request_tokens(request)
+        delay = 0.0
+        
+        for attempt in range(self.retry):
+            try:
+                session = self.http.session()
+                async with self.rate_limiter.reserve(estimated_tokens) as reservation, session.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=headers,
+                    json=payload,
+                    timeout=self.timeouts.client_timeout(
+                        streaming=True, time_left=self.retry_policy.time_left(request.deadline)
                     )
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                ) as response:
+                    self.timeouts.record('first_byte', time.time() - reservation.acquired_at)
+                    retry_after = self.rate_limiter.observe(response.status, response.headers)
+                    if response.status != 200:
+                        error_text = await response.text()
+                        if response.status == 429:
+                            raise RateLimitError(f"API error 429: {error_text}", retry_after)
+                        raise APIError(f"API error {response.status}: {error_text}", response.status)
+                    
+                    async for text in self.timeouts.watch(read_text_stream(response, state)):
+                        if not parts:
+                            self.timeouts.record('first_token', state.first_token_time - reservation.acquired_at)
+                        parts.append(text)
+                        yield StreamChunk(text=text)
+                    
+                    reservation.settle(state.total_tokens)
+                
+                yield StreamChunk(text='', done=True, response=LLMResponse(
+                    content=''.join(parts),
+                    model=request.model or self.model,
+                    provider=LLMProvider.CUSTOM,
+                    tokens_used=state.total_tokens,
+                    duration=time.time() - state.start_time,
+                    success=True,
+                    cost=self._calculate_cost(state.usage(), request.model),
+                    time_to_first_token=state.time_to_first_token,
+                    input_tokens=state.input_tokens,
+                    cache_creation_tokens=state.cache_creation_input_tokens,
+                    cache_read_tokens=state.cache_read_input_tokens,
+                    finish_reason=state.finish_reason
+                ))
+                return
+            
+            except Exception as e:
+                phase = self.timeouts.record_error(e, streaming=True, first_token_seen=bool(parts))
+                # پس از ارسال اولین token امکان retry وجود ندارد
+                if not parts:
+                    delay = self.retry_policy.next_delay(e, attempt, self.retry, delay, request.deadline)
+                if parts or delay is None:
+                    if parts:
+                        state.estimate_partial(request, ''.join(parts))
+                    yield StreamChunk(text='', done=True, response=LLMResponse(
+                        content=''.join(parts),
+                        model=request.model or self.model,
+                        provider=LLMProvider.CUSTOM,
+                        tokens_used=state.total_tokens,
+                        duration=time.time() - state.start_time,
+                        success=False,
+                        cost=self._calculate_cost(state.usage(), request.model),
+                        error=str(e) or type(e).__name__,
+                        error_kind=classify_error(e),
+                        time_to_first_token=state.time_to_first_token,
+                        input_tokens=state.input_tokens,
+                        cache_creation_tokens=state.cache_creation_input_tokens,
+                        cache_read_tokens=state.cache_read_input_tokens,
+                        finish_reason=STALLED_REASON if phase == 'stall' else None
+                    ))
+                    return
+                await asyncio.sleep(delay)
+    
+    async def close(self):
+        """بستن اتصال‌های HTTP"""
+        await self.http.close()
 
 
-class LLMWrapper:
-    """رابط یکپارچه برای تمام LLMها"""
+class MCPClient:
+    """کلاینت MCP Server"""
     
-    def __init__(self, config: Dict[str, Any]):
-        self.config = config
-        self.mode = config.get('mode', 'custom')
+    def __init__(
+        self,
+        api_url: str,
+        timeout: int = 300,
+        retry: int = 3,
+        pool_config: Optional[Dict[str, Any]] = None
+    ):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.retry = retry
+        self.http = PooledSession.from_config(pool_config)
+        self.rate_limiter = ProviderRateLimiter()  # بدون محدودیت تا زمان تنظیم
+        self.timeouts = PhaseTimeouts(total=timeout)
+        self.retry_policy = RetryPolicy()  # سیاست مشترک پس از راه‌اندازی جایگزین می‌شود
+    
+    async def generate(self, request: LLMRequest) -> LLMResponse:
+        """ارسال درخواست به MCP"""
+        start_time = time.time()
         
-        # آماده‌سازی کلاینت‌ها
-        self.custom_client = None
-        self.mcp_client = None
-        self.offline_llm = None
+        payload = {
+            "prompt": flatten_prompt(request),
+            "max_tokens": request.max_tokens,
+            "temperature": request.temperature,
+            "system_prompt": request.system_prompt
+        }
+        if request.stop:
+            payload["stop"] = request.stop
+        estimated_tokens = estimate_request_tokens(request)
+        delay = 0.0
         
-        # ردگیری هزینه
-        self.total_cost = 0.0
-        self.max_total_cost = config.get('cost_control', {}).get('max_total_cost', 10.0)
+        for attempt in range(self.retry):
+            try:
+                session = self.http.session()
+                async with self.rate_limiter.reserve(estimated_tokens) as reservation, session.post(
+                    f"{self.api_url}/generate",
+                    json=payload,
+                    timeout=self.timeouts.client_timeout(time_left=self.retry_policy.time_left(request.deadline))
+                ) as response:
+                    self.timeouts.record('first_byte', time.time() - reservation.acquired_at)
+                    retry_after = self.rate_limiter.observe(response.status, response.headers)
+                    if response.status == 200:
+                        data = await response.json()
+                        duration = time.time() - start_time
+                        reservation.settle(data.get('tokens', 0))
+                        
+                        return LLMResponse(
+                            content=data.get('content', ''),
+                            model=data.get('model', 'mcp-model'),
+                            provider=LLMProvider.MCP,
+                            tokens_used=data.get('tokens', 0),
+                            duration=duration,
+                            success=True
+                        )
+                    else:
+                        error_text = await response.text()
+                        if response.status == 429:
+                            raise RateLimitError(f"MCP error: 429 - {error_text}", retry_after)
+                        raise APIError(f"MCP error: {response.status} - {error_text}", response.status)
+            
+            except Exception as e:
+                self.timeouts.record_error(e)
+                delay = self.retry_policy.next_delay(e, attempt, self.retry, delay, request.deadline)
+                if delay is None:
+                    duration = time.time() - start_time
+                    return LLMResponse(
+                        content='',
+                        model='mcp-failed',
+                        provider=LLMProvider.MCP,
+                        tokens_used=0,
+                        duration=duration,
+                        success=False,
+                        error=str(e) or type(e).__name__,
+                        error_kind=classify_error(e)
+                    )
+                await asyncio.sleep(delay)
+    
+    async def close(self):
+        """بستن اتصال‌های HTTP"""
+        await self.http.close()
+
+
+class OfflineLLM:
+    """LLM آفلاین (فایل GGUF با llama.cpp روی CPU)
+
+    مدل با mmap بارگذاری می‌شود و inference در یک thread اختصاصی اجرا می‌شود
+    تا event loop مسدود نشود. مدل llama.cpp thread-safe نیست، پس درخواست‌ها
+    در همان thread به ترتیب اجرا می‌شوند.
+
+    با فعال بودن server، مدل در پردازه جداگانه inference_server می‌ماند و
+    درخواست‌های هم‌زمان آنجا continuous batch می‌شوند.
+    """
+    
+    def __init__(
+        self,
+        model_path: str,
+        model_name: Optional[str] = None,
+        n_ctx: int = 4096,
+        n_threads: Optional[int] = None,
+        n_gpu_layers: int = 0,
+        use_mmap: bool = True,
+        use_mlock: bool = False,
+        stop: Optional[List[str]] = None,
+        server: Optional[Dict[str, Any]] = None
+    ):
+        self.model_path = model_path
+        self.model_name = model_name or os.path.splitext(os.path.basename(model_path))[0]
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.n_gpu_layers = n_gpu_layers
+        self.use_mmap = use_mmap
+        self.use_mlock = use_mlock
+        self.stop = stop or []
+        self.model = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="offline-llm")
+        self.server_client: Optional[InferenceServerClient] = None
         
-        self._setup_clients()
+        server = server or {}
+        if server.get('enabled'):
+            self.server_client = self._create_server_client(server)
+        else:
+            self._load_model()
     
-    def _setup_clients(self):
-        """راه‌اندازی کلاینت‌ها"""
+    def _create_server_client(self, server: Dict[str, Any]) -> InferenceServerClient:
+        """کلاینت سرور inference محلی (آرگومان‌ها برای راه‌اندازی خودکار)"""
+        server_args = [
+            '--model', self.model_path,
+            '--n-ctx', str(server.get('n_ctx', 8192)),
+            '--n-parallel', str(server.get('n_parallel', 4)),
+            '--prefix-slots', str(server.get('prefix_slots', 2)),
+            '--n-gpu-layers', str(self.n_gpu_layers)
+        ]
+        if self.n_threads:
+            server_args += ['--n-threads', str(self.n_threads)]
+        if not self.use_mmap:
+            server_args.append('--no-mmap')
+        if self.use_mlock:
+            server_args.append('--mlock')
         
-        # Custom API (اولویت اول)
-        custom_config = self.config.get('custom_api', {})
-        if custom_config.get('enabled') or self.mode == 'custom':
-            api_key = os.getenv(custom_config.get('api_key_env', 'CUSTOM_API_KEY'))
-            
-            if api_key:
-                self.custom_client = CustomAPIClient(
-                    base_url=custom_config.get('base_url', 'http://localhost:8000'),
-                    api_key=api_key,
-                    model=custom_config.get('model', 'claude-sonnet-4-20250514'),
-                    timeout=custom_config.get('timeout', 300),
-                    retry=custom_config.get('retry', 3),
-                    custom_headers=custom_config.get('custom_headers', {}),
-                    use_cache=self.config.get('online', {}).get('use_cache', True)
-                )
+        return InferenceServerClient(
+            socket_path=server.get('socket_path', DEFAULT_SOCKET_PATH),
+            autostart=server.get('autostart', True),
+            server_args=server_args,
+            startup_timeout=server.get('startup_timeout', 300)
+        )
+    
+    def _load_model(self):
+        """بارگذاری مدل"""
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            print("❌ llama-cpp-python نصب نیست (pip install llama-cpp-python)")
+            return
         
-        # MCP (fallback)
-        if self.config.get('fallback_to_mcp'):
-            from llm.mcp_client import MCPClient
-            mcp_config = self.config.get('mcp', {})
-            self.mcp_client = MCPClient(
-                api_url=mcp_config.get('api_url', 'http://localhost:5005'),
-                timeout=mcp_config.get('timeout', 300),
-                retry=mcp_config.get('retry', 2)
+        if not os.path.exists(self.model_path):
+            print(f"❌ فایل مدل یافت نشد: {self.model_path}")
+            return
+        
+        try:
+            print(f"⏳ در حال بارگذاری مدل از: {self.model_path}")
+            start_time = time.time()
+            
+            self.model = Llama(
+                model_path=self.model_path,
+                n_ctx=self.n_ctx,
+                n_threads=self.n_threads,
+                n_gpu_layers=self.n_gpu_layers,
+                use_mmap=self.use_mmap,
+                use_mlock=self.use_mlock,
+                verbose=False
             )
+            
+            print(f"✅ مدل بارگذاری شد ({time.time() - start_time:.1f}s)")
+        except Exception as e:
+            print(f"❌ خطا در بارگذاری مدل: {e}")
+            self.model = None
     
-    def check_cost_limit(self, estimated_cost: float) -> bool:
-        """بررسی محدودیت هزینه"""
-        if self.total_cost + estimated_cost > self.max_total_cost:
-            return False
-        return True
+    def _build_messages(self, request: LLMRequest) -> List[Dict[str, str]]:
+        """ساخت messages (قالب chat از metadata فایل GGUF خوانده می‌شود)"""
+        _, messages = build_messages(request, use_cache=False)
+        return messages
+    
+    def _run(self, request: LLMRequest) -> Dict[str, Any]:
+        """اجرای inference (داخل thread اختصاصی)"""
+        return self.model.create_chat_completion(
+            messages=self._build_messages(request),
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            stop=self.stop + (request.stop or [])
+        )
+    
+    async def _generate_remote(self, request: LLMRequest) -> LLMResponse:
+        """تولید از طریق سرور inference محلی"""
+        start_time = time.time()
+        
+        try:
+            data = await self.server_client.generate(
+                messages=self._build_messages(request),
+                max_tokens=request.max_tokens,
+                temperature=request.temperature,
+                stop=self.stop + (request.stop or [])
+            )
+            duration = time.time() - start_time
+            output_tokens = data.get('completion_tokens', 0)
+            
+            return LLMResponse(
+                content=data.get('content', ''),
+                model=self.model_name,
+                provider=LLMProvider.OFFLINE,
+                tokens_used=data.get('prompt_tokens', 0) + output_tokens,
+                duration=duration,
+                success=True,
+                tokens_per_second=round(output_tokens / duration, 2) if duration > 0 else None
+            )
+        
+        except Exception as e:
+            return LLMResponse(
+                content='',
+                model='llama-server-failed',
+                provider=LLMProvider.OFFLINE,
+                tokens_used=0,
+                duration=time.time() - start_time,
+                success=False,
+                error=str(e) or type(e).__name__,
+                error_kind=classify_error(e)
+            )
     
     async def generate(self, request: LLMRequest) -> LLMResponse:
-        """تولید کد با استفاده از LLM"""
+        """تولید کد با مدل آفلاین"""
+        if self.server_client:
+            return await self._generate_remote(request)
         
-        # بررسی محدودیت هزینه
-        estimated_cost = 0.042  # تخمینی per task
-        if not self.check_cost_limit(estimated_cost):
+        if not self.model:
             return LLMResponse(
                 content='',
-                model='none',
-                provider=LLMProvider.CUSTOM,
+                model='offline-not-loaded',
+                provider=LLMProvider.OFFLINE,
                 tokens_used=0,
                 duration=0,
                 success=False,
-                cost=0.0,
-                error=f"محدودیت هزینه رسیده: ${self.total_cost:.3f} / ${self.max_total_cost}"
+                error="مدل بارگذاری نشده است"
             )
         
-        # تلاش با Custom API
-        if self.custom_client:
-            response = await self.custom_client.generate(request)
-            if response.success:
-                self.total_cost += response.cost
-                return response
-            
-            print(f"⚠️  Custom API ناموفق بود: {response.error}")
+        start_time = time.time()
         
-        # Fallback به MCP
-        if self.config.get('fallback_to_mcp') and self.mcp_client:
-            print("🔄 Fallback به MCP...")
-            response = await self.mcp_client.generate(request)
-            if response.success:
-                return response
+        try:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self.executor, self._run, request)
+            duration = time.time() - start_time
+            
+            content = data['choices'][0]['message']['content'] or ''
+            usage = data.get('usage', {})
+            output_tokens = usage.get('completion_tokens', 0)
+            
+            return LLMResponse(
+                content=content,
+                model=self.model_name,
+                provider=LLMProvider.OFFLINE,
+                tokens_used=usage.get('total_tokens', 0),
+                duration=duration,
+                success=True,
+                tokens_per_second=round(output_tokens / duration, 2) if duration > 0 else None
+            )
         
-        # همه روش‌ها ناموفق بودند
-        return LLMResponse(
-            content='',
-            model='none',
-            provider=LLMProvider.CUSTOM,
-            tokens_used=0,
-            duration=0,
-            success=False,
-            cost=0.0,
-            error="هیچ LLM موفقی در دسترس نیست"
-        )
+        except Exception as e:
+            duration = time.time() - start_time
+            return LLMResponse(
+                content='',
+                model='llama-failed',
+                provider=LLMProvider.OFFLINE,
+                tokens_used=0,
+                duration=duration,
+                success=False,
+                error=str(e) or type(e).__name__,
+                error_kind=classify_error(e)
+            )
     
-    async def generate_code(
-        self,
-        task_description: str,
-        file_path: str,
-        context: Optional[str] = None
-    ) -> LLMResponse:
-        """تولید کد برای یک task خاص"""
-        
-        system_prompt = """شما یک برنامه‌نویس ماهر Python هستید.
-
-قوانین مهم:
-1. کد کامل، قابل اجرا و بدون خطا بنویسید
-2. از type hints استفاده کنید
-3. docstring برای توابع و کلاس‌ها الزامی است
-4. error handling مناسب داشته باشید
-5. کد تمیز و خوانا باشد (PEP 8)
-6. فقط کد را برگردانید، بدون markdown یا توضیحات اضافی
-7. کد باید self-contained باشد (همه import ها در ابتدا)"""
-        
-        prompt = f"""Task: {task_description}
+    async def close(self):
+        """آزاد کردن thread و مدل (و توقف سرور inference راه‌اندازی‌شده)"""
+        self.executor.shutdown(wait=False)
+        self.model = None
+        if self.server_client:
+            await self.server_client.close()
 
-Target File: {file_path}
 
-{f"Context:\n{context}\n" if context else ""}
-لطفاً کد کامل این فایل را بنویسید. فقط کد Python، بدون ``` یا markdown."""
-        
-        request = LLMRequest(
-            prompt=prompt,
-            system_prompt=system_prompt,
-            max_tokens=self.config.get('cost_control', {}).get('max_output_tokens', 3000),
-            temperature=0.3
-        )
-        
-        return await self.generate(request)
+class OnlineLLM:
+    """LLM آنلاین (OpenAI/Anthropic)"""
     
-    async def generate_tests(
+    def __init__(
         self,
-        code: str,
-        file_path: str
-    ) -> LLMResponse:
-        """تولید تست برای کد"""
-        
-        system_prompt = """شما یک تست‌نویس متخصص هستید.
-
-قوانین:
-1. تست‌های جامع با pytest بنویسید
-2. موارد مرزی را پوشش دهید
-3. تست‌ها باید قابل اجرا باشند
-4. از fixtures مناسب استفاده کنید
-5. docstring برای هر تست بنویسید"""
-        
-        prompt = f"""کد زیر را تست کنید:
-
-{code}
-
-Target Test File: {file_path}
-
-تست‌های pytest کامل بنویسید. فقط کد Python."""
-        
-        request = LLMRequest(
-            prompt=prompt,
-            system_prompt=system_prompt,
-            max_tokens=2048,
-            temperature=0.3
-        )
+        provider: str,
+        api_key: str,
+        model: str,
+        pool_config: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True
+    ):
+        self.provider = provider
+        self.api_key = api_key
+        self.model = model
+        self.use_cache = use_cache  # breakpoint های prompt cache (فقط Anthropic)
+        self.http = PooledSession.from_config(pool_config)
+        self.rate_limiter = ProviderRateLimiter()  # بدون محدودیت تا زمان تنظیم
+        self.timeouts = PhaseTimeouts(total=120)
+        self.retry_policy = RetryPolicy()  # فقط برای مهلت درخواست (بدون retry)
+        self.max_continuations = 0  # ادامه خودکار پاسخ‌های قطع‌شده (تا زمان تنظیم خاموش)
+    
+    async def generate(self, request: LLMRequest) -> LLMResponse:
+        """تولید کد با API آنلاین (با ادامه خودکار پاسخ‌های قطع‌شده)"""
+        return await generate_with_continuation(self._generate_once, request, self.max_continuations)
+    
+    async def _generate_once(self, request: LLMRequest) -> LLMResponse:
+        """یک درخواست به API آنلاین"""
+        start_time = time.time()
         
-        return await self.generate(request)
+        if self.provider == "openai":
+            return await self._generate_openai(request, start_time)
+        elif self.provider == "anthropic":
+            return await self._generate_anthropic(request, start_time)
+        else:
+            return LLMResponse(
+                content='',
+                model='unknown',
+                provider=LLMProvider.OPENAI,
+                tokens_used=0,
+                duration=0,
+                success=False,
+                error=f"ارائه‌دهنده نامعتبر: {self.provider}"
+            )
     
-    def get_cost_summary(self) -> Dict[str, Any]:
-        """خلاصه هزینه‌ها"""
-        return {
-            'total_cost': round(self.total_cost, 3),
-            'max_cost': self.max_total_cost,
-            'remaining': round(self.max_total_cost - self.total_cost, 3),
-            'percentage': round((self.total_cost / self.max_total_cost) * 100, 1)
-        }
-
-
-# تست سریع
-if __name__ == "__main__":
-    async def test_custom_api():
-        config = {
-            'mode': 'custom',
-            'custom_api': {
-                'enabled': True,
-                'base_url': 'https://your-api-server.com/v1',
-                'api_key_env': 'CUSTOM_API_KEY',
-                'model': 'claude-sonnet-4-20250514',
-                'timeout': 300,
-                'retry': 3
-            },
-            'online': {
-                'use_cache': True
-            },
-            'cost_control': {
-                'max_total_cost': 2.0,
-                'max_output_tokens': 3000
-            },
-            'fallback_to_mcp': False
+    def _build_openai_request(self, request: LLMRequest) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """ساخت url، headers و payload برای OpenAI"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
         }
         
-        wrapper = LLMWrapper(config)
+        # OpenAI پیشوندهای تکراری را خودکار کش می‌کند؛ فقط ترتیب مهم است
+        _, messages = build_messages(request, use_cache=False)
         
-        # تست تولید کد
-        response = await wrapper.generate_code(
-            task_description="ایجاد تابع محاسبه فیبوناچی با memoization",
-            file_path="fibonacci.py"
-        )
+        payload = {
+            "model": request.model or self.model,
+            "messages": messages,
+            "max_tokens": request.max_tokens,
+            "temperature": request.temperature
+        }
         
-        if response.success:
-            print(f"✅ کد تولید شد!")
-            print(f"📊 Model: {response.model}")
-            print(f"💰 Cost: ${response.cost:.4f}")
-            print(f"⏱️  Duration: {response.duration:.2f}s")
-            print(f"🎯 Tokens: {response.tokens_used}")
-            print(f"\n📝 Generated Code:\n{response.content[:300]}...")
-            
-            # خلاصه هزینه
-            summary = wrapper.get_cost_summary()
-            print(f"\n💳 Cost Summary:")
-            print(f"   Total: ${summary['total_cost']}")
-            print(f"   Remaining: ${summary['remaining']}")
-            print(f"   Used: {summary['percentage']}%")
-        else:
-            print(f"❌ خطا: {response.error}")
-    
-    asyncio.run(test_custom_api())"""
-LLM Wrapper - رابط یکپارچه برای تمام LLMها (MCP, Offline, Online)
-"""
-
-import asyncio
-import aiohttp
-import time
-from typing import Optional, Dict, Any, List
-from enum import Enum
-from dataclasses import dataclass
-import json
-
-
-class LLMProvider(Enum):
-    """ارائه‌دهندگان LLM"""
-    MCP = "mcp"
-    OFFLINE = "offline"
-    OPENAI = "openai"
-    ANTHROPIC = "anthropic"
-
-
-@dataclass
-class LLMRequest:
-    """درخواست به LLM"""
-    prompt: str
-    max_tokens: int = 2048
-    temperature: float = 0.7
-    system_prompt: Optional[str] = None
-    context: Optional[List[Dict[str, str]]] = None
-
-
-@dataclass
-class LLMResponse:
-    """پاسخ از LLM"""
-    content: str
-    model: str
-    provider: LLMProvider
-    tokens_used: int
-    duration: float
-    success: bool
-    error: Optional[str] = None
-
-
-class MCPClient:
-    """کلاینت MCP Server"""
-    
-    def __init__(self, api_url: str, timeout: int = 300, retry: int = 3):
-        self.api_url = api_url
-        self.timeout = timeout
-        self.retry = retry
+        if request.stop:
+            payload["stop"] = request.stop
+        
+        return "https://api.openai.com/v1/chat/completions", headers, payload
     
-    async def generate(self, request: LLMRequest) -> LLMResponse:
-        """ارسال درخواست به MCP"""
-        start_time = time.time()
+    def _build_anthropic_request(self, request: LLMRequest) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+        """ساخت url، headers و payload برای Anthropic"""
+        headers = {
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01",
+            "Content-Type": "application/json"
+        }
+        
+        system, messages = build_messages(request, self.use_cache, system_in_messages=False)
         
         payload = {
-            "prompt": request.prompt,
+            "model": request.model or self.model,
+            "messages": messages,
             "max_tokens": request.max_tokens,
-            "temperature": request.temperature,
-            "system_prompt": request.system_prompt
+            "temperature": request.temperature
         }
         
-        for attempt in range(self.retry):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        f"{self.api_url}/generate",
-                        json=payload,
-                        timeout=aiohttp.ClientTimeout(total=self.timeout)
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            duration = time.time() - start_time
-                            
-                            return LLMResponse(
-                                content=data.get('content', ''),
-                                model=data.get('model', 'mcp-model'),
-                                provider=LLMProvider.MCP,
-                                tokens_used=data.get('tokens', 0),
-                                duration=duration,
-                                success=True
-                            )
-                        else:
-                            error_text = await response.text()
-                            raise Exception(f"MCP error: {response.status} - {error_text}")
+        if system:
+            payload["system"] = system
+        
+        if request.stop:
+            payload["stop_sequences"] = request.stop
+        
+        return "https://api.anthropic.com/v1/messages", headers, payload
+    
+    async def _generate_openai(self, request: LLMRequest, start_time: float) -> LLMResponse:
+        """تولید با OpenAI API"""
+        try:
+            session = self.http.session()
+            url, headers, payload = self._build_openai_request(request)
             
-            except Exception as e:
-                if attempt == self.retry - 1:
+            async with self.rate_limiter.reserve(estimate_request_tokens(request)) as reservation, session.post(
+                url,
+                headers=headers,
+                json=payload,
+                timeout=self.timeouts.client_timeout(time_left=self.retry_policy.time_left(request.deadline))
+            ) as response:
+                self.timeouts.record('first_byte', time.time() - reservation.acquired_at)
+                retry_after = self.rate_limiter.observe(response.status, response.headers)
+                if response.status == 200:
+                    data = await response.json()
+                    content = data['choices'][0]['message']['content']
+                    usage = parse_usage(data.get('usage'))
                     duration = time.time() - start_time
+                    reservation.settle(total_tokens(usage))
+                    
                     return LLMResponse(
-                        content='',
-                        model='mcp-failed',
-                        provider=LLMProvider.MCP,
-                        tokens_used=0,
+                        content=content,
+                        model=request.model or self.model,
+                        provider=LLMProvider.OPENAI,
+                        tokens_used=total_tokens(usage),
                         duration=duration,
-                        success=False,
-                        error=str(e)
+                        success=True,
+                        input_tokens=usage['input_tokens'],
+                        cache_read_tokens=usage['cache_read_input_tokens'],
+                        finish_reason=data['choices'][0].get('finish_reason')
                     )
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-
-
-class OfflineLLM:
-    """LLM آفلاین (LLaMA/StarCoder)"""
-    
-    def __init__(self, model_path: str):
-        self.model_path = model_path
-        self.model = None
-        self._load_model()
-    
-    def _load_model(self):
-        """بارگذاری مدل"""
-        try:
-            # این قسمت باید با کتابخانه واقعی پیاده‌سازی شود
-            # مثلاً llama-cpp-python یا transformers
-            print(f"⏳ در حال بارگذاری مدل از: {self.model_path}")
-            
-            # TODO: پیاده‌سازی واقعی با llama.cpp یا ctransformers
-            # from llama_cpp import Llama
-            # self.model = Llama(model_path=self.model_path)
-            
-            print("✅ مدل بارگذاری شد")
+                else:
+                    error_text = await response.text()
+                    if response.status == 429:
+                        raise RateLimitError(f"OpenAI error: 429 - {error_text}", retry_after)
+                    raise APIError(f"OpenAI error: {response.status} - {error_text}", response.status)
+        
         except Exception as e:
-            print(f"❌ خطا در بارگذاری مدل: {e}")
-            self.model = None
-    
-    async def generate(self, request: LLMRequest) -> LLMResponse:
-        """تولید کد با مدل آفلاین"""
-        if not self.model:
+            self.timeouts.record_error(e)
+            duration = time.time() - start_time
             return LLMResponse(
                 content='',
-                model='offline-not-loaded',
-                provider=LLMProvider.OFFLINE,
+                model=request.model or self.model,
+                provider=LLMProvider.OPENAI,
                 tokens_used=0,
-                duration=0,
+                duration=duration,
                 success=False,
-                error="مدل بارگذاری نشده است"
+                error=str(e) or type(e).__name__,
+                error_kind=classify_error(e)
             )
-        
-        start_time = time.time()
-        
+    
+    async def _generate_anthropic(self, request: LLMRequest, start_time: float) -> LLMResponse:
+        """تولید با Anthropic API"""
         try:
-            # TODO: پیاده‌سازی واقعی
-            # output = self.model(
-            #     request.prompt,
-            #     max_tokens=request.max_tokens,
-            #     temperature=request.temperature
-            # )
-            
-            # شبیه‌سازی برای تست
-            await asyncio.sleep(1)
-            output = "# کد تولید شده با LLM آفلاین\npass"
+            session = self.http.session()
+            url, headers, payload = self._build_anthropic_request(request)
             
-            duration = time.time() - start_time
-            
-            return LLMResponse(
-                content=output,
-                model='llama-3.1-7b',
-                provider=LLMProvider.OFFLINE,
-                tokens_used=len(output.split()),
-                duration=duration,
-                success=True
-            )
+            async with self.rate_limiter.reserve(estimate_request_tokens(request)) as reservation, session.post(
+                url,
+                headers=headers,
+                json=payload,
+                timeout=self.timeouts.client_timeout(time_left=self.retry_policy.time_left(request.deadline))
+            ) as response:
+                self.timeouts.record('first_byte', time.time() - reservation.acquired_at)
+                retry_after = self.rate_limiter.observe(response.status, response.headers)
+                if response.status == 200:
+                    data = await response.json()
+                    content = data['content'][0]['text']
+                    usage = parse_usage(data.get('usage'))
+                    duration = time.time() - start_time
+                    reservation.settle(total_tokens(usage))
+                    
+                    return LLMResponse(
+                        content=content,
+                        model=request.model or self.model,
+                        provider=LLMProvider.ANTHROPIC,
+                        tokens_used=total_tokens(usage),
+                        duration=duration,
+                        success=True,
+                        input_tokens=usage['input_tokens'],
+                        cache_creation_tokens=usage['cache_creation_input_tokens'],
+                        cache_read_tokens=usage['cache_read_input_tokens'],
+                        finish_reason=data.get('stop_reason')
+                    )
+                else:
+                    error_text = await response.text()
+                    if response.status == 429:
+                        raise RateLimitError(f"Anthropic error: 429 - {error_text}", retry_after)
+                    raise APIError(f"Anthropic error: {response.status} - {error_text}", response.status)
         
         except Exception as e:
+            self.timeouts.record_error(e)
             duration = time.time() - start_time
             return LLMResponse(
                 content='',
-                model='llama-failed',
-                provider=LLMProvider.OFFLINE,
+                model=request.model or self.model,
+                provider=LLMProvider.ANTHROPIC,
                 tokens_used=0,
                 duration=duration,
                 success=False,
-                error=str(e)
+                error=str(e) or type(e).__name__,
+                error_kind=classify_error(e)
             )
-
-
-class OnlineLLM:
-    """LLM آنلاین (OpenAI/Anthropic)"""
     
-    def __init__(self, provider: str, api_key: str, model: str):
-        self.provider = provider
-        self.api_key = api_key
-        self.model = model
+    async def stream(self, request: LLMRequest) -> AsyncIterator[StreamChunk]:
+        """تولید به صورت stream (SSE) با ادامه خودکار پاسخ‌های قطع‌شده"""
+        async for chunk in stream_with_continuation(self._stream_once, request, self.max_continuations):
+            yield chunk
     
-    async def generate(self, request: LLMRequest) -> LLMResponse:
-        """تولید کد با API آنلاین"""
-        start_time = time.time()
+    async def _stream_once(self, request: LLMRequest) -> AsyncIterator[StreamChunk]:
+        """یک درخواست stream"""
+        state = StreamState()
+        parts: List[str] = []
         
         if self.provider == "openai":
-            return await self._generate_openai(request, start_time)
+            url, headers, payload = self._build_openai_request(request)
+            payload["stream_options"] = {"include_usage": True}
+            provider = LLMProvider.OPENAI
         elif self.provider == "anthropic":
-            return await self._generate_anthropic(request, start_time)
+            url, headers, payload = self._build_anthropic_request(request)
+            provider = LLMProvider.ANTHROPIC
         else:
-            return LLMResponse(
-                content='',
-                model='unknown',
-                provider=LLMProvider.OPENAI,
-                tokens_used=0,
-                duration=0,
+            yield StreamChunk(text='', done=True, response=await self._generate_once(request))
+            return
+        
+        payload["stream"] = True
+        
+        try:
+            session = self.http.session()
+            async with self.rate_limiter.reserve(estimate_request_tokens(request)) as reservation, session.post(
+                url,
+                headers=headers,
+                json=payload,
+                timeout=self.timeouts.client_timeout(
+                    streaming=True, time_left=self.retry_policy.time_left(request.deadline)
+                )
+            ) as response:
+                self.timeouts.record('first_byte', time.time() - reservation.acquired_at)
+                retry_after = self.rate_limiter.observe(response.status, response.headers)
+                if response.status != 200:
+                    error_text = await response.text()
+                    if response.status == 429:
+                        raise RateLimitError(f"{self.provider} error: 429 - {error_text}", retry_after)
+                    raise APIError(f"{self.provider} error: {response.status} - {error_text}", response.status)
+                
+                async for text in self.timeouts.watch(read_text_stream(response, state)):
+                    if not parts:
+                        self.timeouts.record('first_token', state.first_token_time - reservation.acquired_at)
+                    parts.append(text)
+                    yield StreamChunk(text=text)
+                
+                reservation.settle(state.total_tokens)
+            
+            yield StreamChunk(text='', done=True, response=LLMResponse(
+                content=''.join(parts),
+                model=request.model or self.model,
+                provider=provider,
+                tokens_used=state.total_tokens,
+                duration=time.time() - state.start_time,
+                success=True,
+                time_to_first_token=state.time_to_first_token,
+                input_tokens=state.input_tokens,
+                cache_creation_tokens=state.cache_creation_input_tokens,
+                cache_read_tokens=state.cache_read_input_tokens,
+                finish_reason=state.finish_reason
+            ))
+        
+        except Exception as e:
+            phase = self.timeouts.record_error(e, streaming=True, first_token_seen=bool(parts))
+            if parts:
+                state.estimate_partial(request, ''.join(parts))
+            yield StreamChunk(text='', done=True, response=LLMResponse(
+                content=''.join(parts),
+                model=request.model or self.model,
+                provider=provider,
+                tokens_used=state.total_tokens,
+                duration=time.time() - state.start_time,
                 success=False,
-                error=f"ارائه‌دهنده نامعتبر: {self.provider}"
+                error=str(e) or type(e).__name__,
+                error_kind=classify_error(e),
+                time_to_first_token=state.time_to_first_token,
+                input_tokens=state.input_tokens,
+                cache_creation_tokens=state.cache_creation_input_tokens,
+                cache_read_tokens=state.cache_read_input_tokens,
+                finish_reason=STALLED_REASON if phase == 'stall' else None
+            ))
+    
+    async def close(self):
+        """بستن اتصال‌های HTTP"""
+        await self.http.close()
+
+
+class LLMWrapper:
+    """رابط یکپارچه برای تمام LLMها"""
+    
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.mode = config.get('mode', 'mcp')
+        self.streaming = config.get('streaming', False)
+        
+        # آماده‌سازی کلاینت‌ها
+        self.custom_client = None
+        self.mcp_client = None
+        self.offline_llm = None
+        self.online_llm = None
+        
+        # ردگیری هزینه (total_cost فقط این اجرا؛ دفتر دائمی بین اجراها مشترک است)
+        cost_config = config.get('cost_control', {})
+        self.total_cost = 0.0
+        self.max_total_cost = cost_config.get('max_total_cost', 10.0)
+        self.ledger = CostLedger.from_config(cost_config)
+        
+        # pre-flight: شمارش محلی token ها قبل از هر فراخوانی
+        self.token_counter = TokenCounter.from_config(cost_config)
+        self.context_window = cost_config.get('context_window', 200_000)
+        self.max_input_tokens = cost_config.get('max_input_tokens')
+        self.min_output_tokens = cost_config.get('min_output_tokens', 256)
+        self.max_cost_per_task = cost_config.get('max_cost_per_task')
+        self.max_continuations = config.get('continuation', {}).get('max_continuations', 2)
+        adaptive_config = cost_config.get('adaptive_max_tokens', {})
+        self.output_lengths = (
+            OutputLengthModel.from_config(adaptive_config) if adaptive_config.get('enabled', True) else None
+        )
+        self.preflight_stats = {
+            'trimmed_messages': 0,
+            'max_tokens_reduced': 0,
+            'rejected_context': 0,
+            'rejected_budget': 0
+        }
+        
+        # کش پاسخ‌ها روی دیسک
+        cache_config = config.get('response_cache', {})
+        self.response_cache = ResponseCache.from_config(cache_config) if cache_config.get('enabled') else None
+        
+        # ادغام درخواست‌های یکسان هم‌زمان
+        self.coalesce_requests = config.get('coalesce_requests', True)
+        self.single_flight = SingleFlight()
+        
+        # آمار prompt cache به تفکیک feature
+        self.prompt_cache_stats = PromptCacheStats()
+        
+        # best-of-N: چند نسخه هم‌زمان و انتخاب بهترین با بررسی ایستای کد
+        best_of_n = config.get('best_of_n', {})
+        self.temperature_spread = best_of_n.get('temperature_spread', 0.4)
+        self.reviewer = AICodeReviewer()
+        self.best_of_n_stats = {
+            'runs': 0,
+            'candidates': 0,
+            'unusable_candidates': 0,
+            'selected': 0,
+            'best_score_total': 0.0
+        }
+        
+        # حالت ویرایش: بلوک‌های SEARCH/REPLACE به جای بازنویسی کل فایل
+        self.edit_fuzzy_threshold = config.get('edit_mode', {}).get('fuzzy_threshold', 0.9)
+        self.edit_stats = {
+            'edits': 0,
+            'applied': 0,
+            'fuzzy_blocks': 0,
+            'fallbacks': 0,
+            'fallback_reasons': {},  # request_failed، apply_failed یا invalid -> تعداد
+            'partial_views': 0,  # فایل‌های بزرگ که فقط بخش‌های مرتبطشان فرستاده شد
+            'output_tokens_saved': 0
+        }
+        
+        # تولید چند فایل در یک فراخوانی
+        self.multi_file_max_tokens = config.get('multi_file', {}).get('max_tokens', 8000)
+        self.multi_file_stats = {
+            'calls': 0,
+            'files': 0,
+            'fallback_files': 0
+        }
+        
+        # سقف تطبیقی درخواست‌های هم‌زمان upstream (AIMD)
+        self.concurrency = AdaptiveConcurrencyLimiter.from_config(config.get('adaptive_concurrency', {}))
+        
+        # درخواست پشتیبان به provider بعدی برای کاهش tail latency
+        self.hedging = HedgingPolicy.from_config(config.get('hedging', {}))
+        
+        # سیاست مشترک retry و مهلت کل هر درخواست
+        self.retry_policy = RetryPolicy.from_config(config.get('retry_policy', {}))
+        
+        # انتخاب مدل هر درخواست از جدول مسیریابی (None = همیشه مدل پیش‌فرض)
+        self.router = ModelRouter.from_config(config.get('model_routing', {}))
+        
+        # circuit breaker هر provider (نام provider -> breaker)
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        
+        self._setup_clients()
+    
+    def _setup_clients(self):
+        """راه‌اندازی کلاینت‌ها"""
+        pool_config = self.config.get('connection_pool', {})
+        
+        # Custom API (اولویت اول)
+        custom_config = self.config.get('custom_api', {})
+        if custom_config.get('enabled') or self.mode == 'custom':
+            api_key = os.getenv(custom_config.get('api_key_env', 'CUSTOM_API_KEY'))
+            
+            if api_key:
+                self.custom_client = CustomAPIClient(
+                    base_url=custom_config.get('base_url', 'http://localhost:8000'),
+                    api_key=api_key,
+                    model=custom_config.get('model', 'claude-sonnet-4-20250514'),
+                    timeout=custom_config.get('timeout', 300),
+                    retry=custom_config.get('retry', 3),
+                    custom_headers=custom_config.get('custom_headers', {}),
+                    use_cache=self.config.get('online', {}).get('use_cache', True),
+                    pool_config=pool_config
+                )
+        
+        # MCP
+        if self.mode == 'mcp' or self.config.get('fallback_to_mcp'):
+            mcp_config = self.config.get('mcp', {})
+            self.mcp_client = MCPClient(
+                api_url=mcp_config.get('api_url', 'http://localhost:5005'),
+                timeout=mcp_config.get('timeout', 300),
+                retry=mcp_config.get('retry', 3),
+                pool_config=pool_config
             )
+        
+        # Offline
+        if self.mode == 'offline':
+            offline_config = self.config.get('offline_model', {})
+            self.offline_llm = OfflineLLM(
+                model_path=offline_config.get('path', './models/model.gguf'),
+                model_name=offline_config.get('name'),
+                n_ctx=offline_config.get('n_ctx', 4096),
+                n_threads=offline_config.get('n_threads'),
+                n_gpu_layers=offline_config.get('n_gpu_layers', 0),
+                use_mmap=offline_config.get('use_mmap', True),
+                use_mlock=offline_config.get('use_mlock', False),
+                stop=offline_config.get('stop', []),
+                server=offline_config.get('server', {})
+            )
+        
+        # Online (Fallback)
+        online_config = self.config.get('online', {})
+        if (self.mode == 'online' or self.config.get('fallback_online')) \
+                and online_config.get('provider', 'openai') != 'custom':
+            api_key = os.getenv(online_config.get('api_key_env', 'OPENAI_API_KEY'))
+            
+            self.online_llm = OnlineLLM(
+                provider=online_config.get('provider', 'openai'),
+                api_key=api_key or '',
+                model=online_config.get('model', 'gpt-4'),
+                pool_config=pool_config,
+                use_cache=online_config.get('use_cache', True)
+            )
+        
+        # محدودیت نرخ (RPM/TPM) هر provider
+        rate_limits = self.config.get('rate_limits', {})
+        for name, client in self._http_clients().items():
+            client.rate_limiter = ProviderRateLimiter.from_config(rate_limits.get(name))
+        
+        # timeout جداگانه اتصال، اولین بایت، اولین token و توقف stream هر provider
+        timeouts = self.config.get('timeouts', {})
+        for name, client in self._http_clients().items():
+            client.timeouts = PhaseTimeouts.from_config(timeouts.get(name), total=client.timeouts.total)
+        
+        for client in self._http_clients().values():
+            client.retry_policy = self.retry_policy
+        
+        # ادامه خودکار پاسخ‌هایی که به سقف max_tokens رسیده‌اند
+        for client in (self.custom_client, self.online_llm):
+            if client:
+                client.max_continuations = self.max_continuations
+        
+        # قیمت مدل‌های جدول مسیریابی برای محاسبه هزینه
+        routed_client = self._routed_client()
+        if routed_client is not None and hasattr(routed_client, 'model_pricing'):
+            routed_client.model_pricing = self.router.pricing()
     
-    async def _generate_openai(self, request: LLMRequest, start_time: float) -> LLMResponse:
-        """تولید با OpenAI API"""
+    def _routed_client(self):
+        """کلاینتی که مدل آن با مسیریابی انتخاب می‌شود (None اگر مسیریابی فعال نیست)"""
+        if not self.router:
+            return None
+        return self._http_clients().get(self.router.provider)
+    
+    def _http_clients(self) -> Dict[str, Any]:
+        """کلاینت‌هایی که session HTTP دارند"""
+        clients = {
+            'custom': self.custom_client,
+            'mcp': self.mcp_client,
+            'online': self.online_llm
+        }
+        return {name: client for name, client in clients.items() if client}
+    
+    async def startup(self):
+        """ساخت session های HTTP پیش از اولین درخواست"""
+        for client in self._http_clients().values():
+            client.http.session()
+    
+    async def close(self):
+        """بستن تمام session ها و اتصال‌های باز"""
+        for client in self._http_clients().values():
+            await client.close()
+        
+        if self.offline_llm:
+            await self.offline_llm.close()
+        
+        if self.output_lengths:
+            self.output_lengths.flush()
+        if self.router:
+            self.router.flush()
+        self.ledger.close()
+    
+    async def __aenter__(self) -> 'LLMWrapper':
+        await self.startup()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+    
+    def get_connection_stats(self) -> Dict[str, Dict[str, Any]]:
+        """آمار استفاده مجدد از اتصال‌ها برای هر کلاینت"""
+        return {
+            name: client.http.get_stats()
+            for name, client in self._http_clients().items()
+        }
+    
+    def get_rate_limit_stats(self) -> Dict[str, Dict[str, Any]]:
+        """آمار محدودیت نرخ (انتظارها و 429 ها) برای هر کلاینت"""
+        return {
+            name: client.rate_limiter.get_stats()
+            for name, client in self._http_clients().items()
+        }
+    
+    def get_timeout_stats(self) -> Dict[str, Dict[str, Any]]:
+        """timeout ها و زمان هر مرحله (اولین بایت، اولین token، بیشترین توقف) برای هر کلاینت"""
+        return {
+            name: client.timeouts.get_stats()
+            for name, client in self._http_clients().items()
+        }
+    
+    def get_retry_stats(self) -> Dict[str, Any]:
+        """آمار retry ها، دسته خطاها و مهلت‌های تمام‌شده"""
+        return self.retry_policy.get_stats()
+    
+    def get_routing_stats(self) -> Optional[Dict[str, Any]]:
+        """تعداد درخواست هر مدل، ارتقاها و نرخ موفقیت (None اگر مسیریابی غیرفعال است)"""
+        return self.router.get_stats() if self.router else None
+    
+    def record_task_result(self, feature: str, task: str, success: bool):
+        """ثبت نتیجه نهایی یک task (پس از اعتبارسنجی) برای نرخ موفقیت مدل‌ها"""
+        if self.router:
+            self.router.record_task_result(feature, task, success)
+    
+    def get_concurrency_stats(self) -> Dict[str, Any]:
+        """سقف فعلی هم‌زمانی و تاریخچه تغییرات آن"""
+        return {
+            **self.concurrency.get_stats(),
+            'history': self.concurrency.get_history()
+        }
+    
+    def get_circuit_stats(self) -> Dict[str, Dict[str, Any]]:
+        """وضعیت circuit breaker هر provider"""
+        return {name: breaker.get_stats() for name, breaker in self.breakers.items()}
+    
+    def get_hedging_stats(self) -> Dict[str, Any]:
+        """آمار درخواست‌های پشتیبان (hedge)"""
+        return self.hedging.get_stats()
+    
+    def check_cost_limit(self, estimated_cost: float) -> bool:
+        """بررسی محدودیت هزینه (با احتساب درخواست‌های در حال اجرا)"""
+        return estimated_cost <= self.ledger.remaining()
+    
+    def _estimate_pricing(self) -> Optional[Dict[str, float]]:
+        """گران‌ترین قیمت‌گذاری بین provider های زنجیره (None اگر همه رایگان‌اند)"""
+        prices = [
+            client.pricing for _, client in self._provider_chain()
+            if getattr(client, 'pricing', None)
+        ]
+        routed_client = self._routed_client()
+        if routed_client is not None:
+            prices += list(getattr(routed_client, 'model_pricing', {}).values())
+        if not prices:
+            return None
+        return max(prices, key=lambda pricing: pricing['input'] + pricing['output'])
+    
+    def _input_limit(self) -> int:
+        """حداکثر token ورودی یک درخواست (جا برای min_output_tokens در context)"""
+        input_limit = self.context_window - self.min_output_tokens
+        if self.max_input_tokens:
+            input_limit = min(input_limit, self.max_input_tokens)
+        return input_limit
+    
+    async def _preflight(self, request: LLMRequest) -> Tuple[Optional[LLMRequest], Optional[int], Optional[LLMResponse]]:
+        """برآورد محلی قبل از ارسال
+
+        تاریخچه قدیمی (به جز آخرین تبادل) کوتاه می‌شود تا ورودی در context جا شود، max_tokens به
+        فضای باقی‌مانده context و بودجه محدود می‌شود و درخواست‌هایی که حتی با
+        min_output_tokens جا نمی‌شوند بدون round trip رد می‌شوند. هزینه برآوردی
+        در دفتر هزینه رزرو می‌شود و با ثبت هزینه پاسخ (_record_cost) تسویه یا
+        با ledger.arelease آزاد می‌شود. مهلت کل
+        درخواست هم از همین لحظه شروع می‌شود و در پایان مدل درخواست از جدول
+        مسیریابی انتخاب می‌شود.
+        
+        Returns:
+            (درخواست اندازه‌شده, شناسه رزرو یا None, پاسخ رد یا None)
+        """
+        if request.deadline is None:
+            request = replace(request, deadline=self.retry_policy.new_deadline())
+        
+        # max_tokens از توزیع طول خروجی‌های قبلی همین نوع فایل و task
+        if self.output_lengths and request.output_kind:
+            request = replace(request, max_tokens=self.output_lengths.suggest(request))
+        
+        input_limit = self._input_limit()
+        input_tokens = self.token_counter.count_request(request)
+        if input_tokens > input_limit and request.context:
+            # حذف قدیمی‌ترین پیام‌های تاریخچه تا جا شدن ورودی؛ آخرین تبادل
+            # (مثلاً کدی که برایش تست خواسته شده) هرگز حذف نمی‌شود
+            history = list(request.context)
+            pinned = history[-2:] if history[-1].get('role') == 'assistant' else []
+            history = history[:len(history) - len(pinned)]
+            while history and input_tokens > input_limit:
+                history.pop(0)
+                self.preflight_stats['trimmed_messages'] += 1
+                # تاریخچه باید با پیام user شروع شود
+                while history and history[0].get('role') != 'user':
+                    history.pop(0)
+                    self.preflight_stats['trimmed_messages'] += 1
+                request = replace(request, context=history + pinned)
+                input_tokens = self.token_counter.count_request(request)
+        
+        if input_tokens > input_limit:
+            self.preflight_stats['rejected_context'] += 1
+            return None, None, self._preflight_error_response(
+                f"ورودی ({input_tokens} token) از سقف مجاز ({input_limit} token) بزرگ‌تر است"
+            )
+        
+        max_tokens = min(request.max_tokens, self.context_window - input_tokens)
+        
+        pricing = self._estimate_pricing()
+        estimated_cost = None
+        if pricing:
+            # hedge ها ممکن است همان درخواست را چند بار ارسال کنند
+            copies = 1 + (self.hedging.max_hedges if self.hedging.enabled else 0)
+            budget = await self.ledger.aremaining(request.feature)
+            if self.max_cost_per_task is not None:
+                budget = min(budget, self.max_cost_per_task * copies)
+            
+            # هر نسخه تا max_continuations درخواست ادامه دارد که ورودی آن‌ها
+            # پاسخ‌های قبلی (هر کدام حداکثر max_tokens) را هم شامل می‌شود
+            calls = 1 + self.max_continuations
+            input_cost = calls * input_tokens * pricing['input'] / 1_000_000
+            token_cost = (
+                calls * pricing['output'] + calls * (calls - 1) / 2 * pricing['input']
+            ) / 1_000_000
+            affordable = int((budget / copies - input_cost) / token_cost)
+            if affordable < min(max_tokens, self.min_output_tokens):
+                self.preflight_stats['rejected_budget'] += 1
+                return None, None, self._cost_limit_response(await self.ledger.atotal_cost())
+            max_tokens = min(max_tokens, affordable)
+            estimated_cost = copies * (input_cost + max_tokens * token_cost)
+        
+        reservation = None
+        if estimated_cost is not None:
+            # بررسی و رزرو اتمیک (درخواست‌های هم‌زمان یا پردازه‌های دیگر ممکن است جلو زده باشند)
+            reservation = await self.ledger.areserve(estimated_cost, request.feature, request.task)
+            if reservation is None:
+                self.preflight_stats['rejected_budget'] += 1
+                return None, None, self._cost_limit_response(await self.ledger.atotal_cost())
+        
+        if max_tokens < request.max_tokens:
+            self.preflight_stats['max_tokens_reduced'] += 1
+            request = replace(request, max_tokens=max_tokens)
+        
+        if self.router and request.model is None:
+            request = replace(request, model=self.router.route(request, input_tokens).model)
+        
+        return request, reservation, None
+    
+    async def _prepare(
+        self,
+        request: LLMRequest
+    ) -> Tuple[Optional[str], Optional[LLMRequest], Optional[int], Optional[LLMResponse]]:
+        """بررسی کش و pre-flight یک درخواست
+
+        مدل درخواست جزو کلید کش است. درخواست‌هایی که مدلشان را مسیریابی
+        انتخاب می‌کند پس از pre-flight در کش جستجو می‌شوند تا پاسخ مدل دیگری
+        پس از تغییر مسیریابی (مثلاً ارتقا پس از شکست task) دوباره برنگردد.
+        
+        Returns:
+            (کلید کش, درخواست اندازه‌شده, شناسه رزرو یا None, پاسخ کش یا رد یا None)
+        """
+        routed = self.router is not None and request.model is None
+        if not routed:
+            cache_key = self._cache_key(request)
+            cached = self._cached_response(cache_key)
+            if cached:
+                return cache_key, request, None, cached
+        
+        sized, reservation, rejection = await self._preflight(request)
+        if rejection:
+            return None, None, None, rejection
+        
+        if routed:
+            # کلید از درخواست پیش از اندازه‌گیری max_tokens، با مدل انتخاب‌شده
+            cache_key = self._cache_key(replace(request, model=sized.model))
+            cached = self._cached_response(cache_key)
+            if cached:
+                await self.ledger.arelease(reservation)
+                return cache_key, sized, None, cached
+        
+        return cache_key, sized, reservation, None
+    
+    async def _record_cost(self, request: LLMRequest, response: LLMResponse, reservation: Optional[int] = None):
+        """ثبت هزینه یک پاسخ upstream در این اجرا و در دفتر دائمی (و تسویه رزرو در همان تراکنش)"""
+        self.total_cost += response.cost
+        await self.ledger.arecord(response, request.feature, request.task, reservation)
+        if self.output_lengths:
+            self.output_lengths.record(request, response)
+    
+    def _provider_chain(self) -> List[Tuple[str, Any]]:
+        """کلاینت‌ها به ترتیب اولویت (Custom → MCP → Offline → Online)"""
+        chain = [
+            ('Custom API', self.custom_client),
+            ('MCP', self.mcp_client),
+            ('Offline LLM', self.offline_llm),
+            ('Online API', self.online_llm)
+        ]
+        return [(name, client) for name, client in chain if client]
+    
+    def _breaker(self, name: str) -> CircuitBreaker:
+        """circuit breaker یک provider (ساخت در اولین استفاده)"""
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker.from_config(name, self.config.get('circuit_breaker', {}))
+        return self.breakers[name]
+    
+    def _provider_identity(self) -> List[str]:
+        """شناسه provider/model های زنجیره (بخشی از کلید کش)"""
+        identity = []
+        for name, client in self._provider_chain():
+            label = getattr(client, 'model', None)
+            if not isinstance(label, str):
+                label = getattr(client, 'model_path', None) or getattr(client, 'api_url', '')
+            identity.append(f"{name}:{label}")
+        return identity
+    
+    def _request_key(self, request: LLMRequest, scope: Optional[Dict[str, Optional[str]]] = None) -> str:
+        """کلید یکتای درخواست (برای کش و ادغام)"""
+        return request_fingerprint(
+            prompt=request.prompt,
+            system_prompt=request.system_prompt,
+            context=request.context,
+            max_tokens=request.max_tokens,
+            temperature=request.temperature,
+            providers=self._provider_identity(),
+            stop=request.stop,
+            stable_context=request.stable_context,
+            model=request.model,
+            scope=scope
+        )
+    
+    def _flight_key(self, request: LLMRequest) -> str:
+        """کلید ادغام درخواست‌های هم‌زمان
+
+        هزینه، دفتر و بودجه، مسیریابی و نمونه‌های طول خروجی فقط به درخواست
+        اولی نسبت داده می‌شوند، پس درخواست‌های feature، task یا نوع خروجی
+        متفاوت با هم ادغام نمی‌شوند.
+        """
+        return self._request_key(request, scope={
+            'feature': request.feature,
+            'task': request.task,
+            'output_kind': request.output_kind
+        })
+    
+    def _cache_key(self, request: LLMRequest) -> Optional[str]:
+        """کلید کش درخواست (None اگر نباید کش شود)"""
+        if not self.response_cache or request.bypass_cache:
+            return None
+        if not self.response_cache.is_cacheable(request.temperature):
+            return None
+        
+        return self._request_key(request)
+    
+    def _cached_response(self, cache_key: Optional[str]) -> Optional[LLMResponse]:
+        """خواندن پاسخ از کش"""
+        if not cache_key:
+            return None
+        
+        start_time = time.time()
+        entry = self.response_cache.get(cache_key)
+        if not entry:
+            return None
+        
+        return LLMResponse(
+            content=entry['content'],
+            model=entry['model'],
+            provider=LLMProvider(entry['provider']),
+            tokens_used=0,
+            duration=time.time() - start_time,
+            success=True,
+            cost=0.0,
+            cached=True
+        )
+    
+    def _store_response(self, cache_key: Optional[str], response: LLMResponse):
+        """ذخیره پاسخ موفق و کامل در کش"""
+        if not cache_key or not response.success or not response.content or is_truncated(response):
+            return
+        
+        self.response_cache.put(cache_key, {
+            'content': response.content,
+            'model': response.model,
+            'provider': response.provider.value,
+            'tokens_used': response.tokens_used,
+            'cost': response.cost
+        })
+    
+    def _cost_limit_response(self, ledger_total: float) -> LLMResponse:
+        """پاسخ خطا برای رسیدن به سقف هزینه"""
+        return LLMResponse(
+            content='',
+            model='none',
+            provider=LLMProvider.CUSTOM,
+            tokens_used=0,
+            duration=0,
+            success=False,
+            cost=0.0,
+            error=f"محدودیت هزینه رسیده: ${ledger_total:.3f} / ${self.max_total_cost}"
+        )
+    
+    def _preflight_error_response(self, error: str) -> LLMResponse:
+        """پاسخ خطا برای درخواستی که در pre-flight رد شد"""
+        return LLMResponse(
+            content='',
+            model='none',
+            provider=LLMProvider.CUSTOM,
+            tokens_used=0,
+            duration=0,
+            success=False,
+            cost=0.0,
+            error=error
+        )
+    
+    def _circuit_open_response(self, name: str) -> LLMResponse:
+        """پاسخ خطا برای provider ای که breaker آن باز است"""
+        return LLMResponse(
+            content='',
+            model='none',
+            provider=LLMProvider.CUSTOM,
+            tokens_used=0,
+            duration=0,
+            success=False,
+            cost=0.0,
+            error=f"Circuit {name} باز است (رد بدون ارسال)"
+        )
+    
+    def _no_provider_response(self) -> LLMResponse:
+        """پاسخ خطا وقتی هیچ LLM موفق نبود"""
+        return LLMResponse(
+            content='',
+            model='none',
+            provider=LLMProvider.CUSTOM,
+            tokens_used=0,
+            duration=0,
+            success=False,
+            cost=0.0,
+            error="هیچ LLM موفقی در دسترس نیست"
+        )
+    
+    def _deadline_expired(self, request: LLMRequest) -> bool:
+        """آیا مهلت درخواست برای fallback به provider بعدی تمام شده است"""
+        if not self.retry_policy.expired(request.deadline):
+            return False
+        self.retry_policy.stats['fallbacks_skipped'] += 1
+        print("⌛ مهلت درخواست تمام شد؛ fallback انجام نمی‌شود")
+        return True
+    
+    async def generate(self, request: LLMRequest) -> LLMResponse:
+        """تولید کد با استفاده از LLM
+
+        درخواست‌های یکسان هم‌زمان (با همان feature، task و نوع خروجی) فقط یک
+        فراخوانی upstream دارند و همه منتظرها همان LLMResponse را دریافت می‌کنند.
+        """
+        if not self.coalesce_requests or request.bypass_cache:
+            return await self._generate(request)
+        
+        return await self.single_flight.run(
+            self._flight_key(request),
+            lambda: self._generate(request)
+        )
+    
+    async def _generate(self, request: LLMRequest) -> LLMResponse:
+        """تولید با زنجیره provider ها (بدون ادغام)"""
+        
+        # بررسی کش، برآورد token و هزینه، و رزرو بودجه تا پایان درخواست
+        cache_key, request, reservation, ready = await self._prepare(request)
+        if ready:
+            return ready
+        
+        chain = self._provider_chain()
+        try:
+            if self.hedging.enabled and len(chain) > 1:
+                response = await self._generate_hedged(chain, request)
+            else:
+                response = await self._generate_sequential(chain, request)
+            
+            if response is not None:
+                await self._record_cost(request, response, reservation)
+                reservation = None
+        finally:
+            await self.ledger.arelease(reservation)
+        
+        if response is None:
+            # همه روش‌ها ناموفق بودند
+            return self._no_provider_response()
+        
+        self.prompt_cache_stats.record(request.feature, response)
+        self._store_response(cache_key, response)
+        return response
+    
+    def _client_request(self, client, request: LLMRequest) -> LLMRequest:
+        """درخواست برای یک کلاینت (مدل مسیریابی فقط برای کلاینت مسیریابی‌شده)"""
+        if request.model and client is not self._routed_client():
+            return replace(request, model=None)
+        return request
+    
+    def _escalate(self, request: LLMRequest) -> Optional[LLMRequest]:
+        """درخواست با مدل قوی‌تر بعدی پس از پاسخ ناموفق (None اگر ممکن نیست)"""
+        if not self.router or not request.model or self.retry_policy.expired(request.deadline):
+            return None
+        route = self.router.find(request.model)
+        stronger = self.router.escalate(route, request) if route else None
+        if stronger is None:
+            return None
+        print(f"⬆️  ارتقا از {route.model} به {stronger.model}...")
+        return replace(request, model=stronger.model)
+    
+    async def _call_client(self, name: str, client, request: LLMRequest) -> LLMResponse:
+        """فراخوانی یک provider داخل سقف هم‌زمانی و ثبت تأخیر و سلامت آن
+
+        پاسخ ناموفق کلاینت مسیریابی‌شده پیش از fallback به provider بعدی با
+        مدل‌های قوی‌تر جدول دوباره امتحان می‌شود.
+        """
+        breaker = self._breaker(name)
+        if not breaker.allow_request():
+            return self._circuit_open_response(name)
+        
+        request = self._client_request(client, request)
+        while True:
+            try:
+                async with self.concurrency.slot() as slot:
+                    response = await client.generate(request)
+                    slot.record(response)
+            except BaseException:
+                breaker.release()
+                raise
+            
+            breaker.record_response(response)
+            if response.success:
+                self.hedging.record_latency(name, response.duration)
+                return response
+            
+            request = self._escalate(request)
+            if request is None or not breaker.allow_request():
+                return response
+    
+    async def _generate_sequential(self, chain: List[Tuple[str, Any]], request: LLMRequest) -> Optional[LLMResponse]:
+        """امتحان provider ها به ترتیب تا اولین پاسخ موفق"""
+        for index, (name, client) in enumerate(chain):
+            if index > 0:
+                if self._deadline_expired(request):
+                    break
+                print(f"🔄 Fallback به {name}...")
+            
+            response = await self._call_client(name, client, request)
+            if response.success:
+                return response
+            
+            print(f"⚠️  {name} ناموفق بود: {response.error}")
+        
+        return None
+    
+    async def _generate_hedged(self, chain: List[Tuple[str, Any]], request: LLMRequest) -> Optional[LLMResponse]:
+        """مسابقه provider ها (hedged request)
+
+        اگر provider فعلی در percentile تأخیر خود پاسخ نداد، همان درخواست به
+        provider بعدی هم ارسال می‌شود و اولین پاسخ موفق برنده است. بازنده‌ها
+        لغو می‌شوند؛ هزینه پاسخ موفقی که استفاده نشد هم حساب می‌شود.
+        """
+        pending: Dict[asyncio.Task, str] = {}
+        next_index = 0
+        hedges = 0
+        self.hedging.stats['races'] += 1
+        
+        def launch() -> str:
+            nonlocal next_index
+            name, client = chain[next_index]
+            next_index += 1
+            pending[asyncio.ensure_future(self._call_client(name, client, request))] = name
+            return name
+        
+        current = launch()
+        winner: Optional[LLMResponse] = None
+        
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
+            while pending and winner is None:
+                can_hedge = next_index < len(chain) and hedges < self.hedging.max_hedges
+                timeout = self.hedging.hedge_delay(current) if can_hedge else None
                 
-                messages = []
-                if request.system_prompt:
-                    messages.append({"role": "system", "content": request.system_prompt})
-                
-                if request.context:
-                    messages.extend(request.context)
-                
-                messages.append({"role": "user", "content": request.prompt})
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
                 
-                payload = {
-                    "model": self.model,
-                    "messages": messages,
-                    "max_tokens": request.max_tokens,
-                    "temperature": request.temperature
-                }
+                if not done:
+                    hedges += 1
+                    self.hedging.stats['hedges'] += 1
+                    print(f"⏱️  {current} بیش از {timeout:.1f}s طول کشید؛ hedge به {chain[next_index][0]}...")
+                    current = launch()
+                    continue
                 
-                async with session.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=120)
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        content = data['choices'][0]['message']['content']
-                        tokens = data['usage']['total_tokens']
-                        duration = time.time() - start_time
-                        
-                        return LLMResponse(
-                            content=content,
-                            model=self.model,
-                            provider=LLMProvider.OPENAI,
-                            tokens_used=tokens,
-                            duration=duration,
-                            success=True
-                        )
+                for task in done:
+                    name = pending.pop(task)
+                    response = task.result()
+                    
+                    if not response.success:
+                        print(f"⚠️  {name} ناموفق بود: {response.error}")
+                    elif winner is None:
+                        winner = response
+                        if name != chain[0][0]:
+                            self.hedging.stats['hedge_wins'] += 1
                     else:
-                        error_text = await response.text()
-                        raise Exception(f"OpenAI error: {response.status} - {error_text}")
+                        # هر دو در یک لحظه تمام شدند؛ پاسخ دوم هم هزینه داشته
+                        self.hedging.stats['wasted_cost'] += response.cost
+                        await self._record_cost(request, response)
+                
+                # fallback وقتی همه درخواست‌های جاری ناموفق بودند
+                if winner is None and not pending and next_index < len(chain) \
+                        and not self._deadline_expired(request):
+                    print(f"🔄 Fallback به {chain[next_index][0]}...")
+                    current = launch()
+        finally:
+            # لغو بازنده‌ها (و همه درخواست‌ها اگر خود فراخوانی لغو شده باشد)
+            for task in pending:
+                task.cancel()
+            self.hedging.stats['cancelled'] += len(pending)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
         
-        except Exception as e:
-            duration = time.time() - start_time
-            return LLMResponse(
-                content='',
-                model=self.model,
-                provider=LLMProvider.OPENAI,
-                tokens_used=0,
-                duration=duration,
-                success=False,
-                error=str(e)
-            )
+        return winner
     
-    async def _generate_anthropic(self, request: LLMRequest, start_time: float) -> LLMResponse:
-        """تولید با Anthropic API"""
+    async def generate_stream(self, request: LLMRequest) -> AsyncIterator[StreamChunk]:
+        """تولید به صورت stream
+
+        تکه‌های متن به ترتیب yield می‌شوند و chunk پایانی (done=True)
+        شامل LLMResponse کامل است. fallback به provider بعدی فقط تا قبل
+        از رسیدن اولین token ممکن است. کلاینت‌های بدون stream (MCP، Offline)
+        کل پاسخ را در یک chunk برمی‌گردانند.
+        """
+        
+        # بررسی کش، برآورد token و هزینه، و رزرو بودجه تا پایان درخواست
+        cache_key, request, reservation, ready = await self._prepare(request)
+        if ready:
+            if ready.cached:
+                yield StreamChunk(text=ready.content)
+            yield StreamChunk(text='', done=True, response=ready)
+            return
+        
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {
-                    "x-api-key": self.api_key,
-                    "anthropic-version": "2023-06-01",
-                    "Content-Type": "application/json"
-                }
+            async for chunk in self._stream_chain(cache_key, request, reservation):
+                yield chunk
+        finally:
+            # پس از تسویه در _stream_chain حذف دوباره رزرو اثری ندارد
+            await self.ledger.arelease(reservation)
+    
+    async def _stream_chain(
+        self,
+        cache_key: Optional[str],
+        request: LLMRequest,
+        reservation: Optional[int] = None
+    ) -> AsyncIterator[StreamChunk]:
+        """stream با زنجیره provider ها و fallback تا قبل از اولین token"""
+        chain = self._provider_chain()
+        for index, (name, client) in enumerate(chain):
+            if index > 0:
+                if self._deadline_expired(request):
+                    break
+                print(f"🔄 Fallback به {name}...")
+            
+            breaker = self._breaker(name)
+            if not breaker.allow_request():
+                print(f"⛔ {name} رد شد (circuit باز است)")
+                continue
+            
+            client_request = self._client_request(client, request)
+            while client_request is not None:
+                emitted = False
                 
-                messages = []
-                if request.context:
-                    messages.extend(request.context)
+                try:
+                    async with self.concurrency.slot() as slot:
+                        if hasattr(client, 'stream'):
+                            response = None
+                            async for chunk in client.stream(client_request):
+                                if chunk.done:
+                                    response = chunk.response
+                                    break
+                                emitted = True
+                                yield chunk
+                        else:
+                            response = await client.generate(client_request)
+                            if response.success and response.content:
+                                emitted = True
+                                yield StreamChunk(text=response.content)
+                        slot.record(response)
+                except BaseException:
+                    breaker.release()
+                    raise
                 
-                messages.append({"role": "user", "content": request.prompt})
+                breaker.record_response(response)
+                if response.success:
+                    await self._record_cost(client_request, response, reservation)
+                    self.prompt_cache_stats.record(request.feature, response)
+                    self._store_response(cache_key, response)
+                    yield StreamChunk(text='', done=True, response=response)
+                    return
                 
-                payload = {
-                    "model": self.model,
-                    "messages": messages,
-                    "max_tokens": request.max_tokens,
-                    "temperature": request.temperature
-                }
+                print(f"⚠️  {name} ناموفق بود: {response.error}")
                 
-                if request.system_prompt:
-                    payload["system"] = request.system_prompt
+                # بخشی از پاسخ ارسال شده و دیگر نمی‌توان سراغ مدل یا provider بعدی رفت
+                if emitted:
+                    # token های ارسال‌شده هزینه دارند، پس پاسخ ناقص هم ثبت می‌شود
+                    await self._record_cost(client_request, response, reservation)
+                    yield StreamChunk(text='', done=True, response=response)
+                    return
                 
-                async with session.post(
-                    "https://api.anthropic.com/v1/messages",
-                    headers=headers,
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=120)
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        content = data['content'][0]['text']
-                        tokens = data['usage']['input_tokens'] + data['usage']['output_tokens']
-                        duration = time.time() - start_time
-                        
-                        return LLMResponse(
-                            content=content,
-                            model=self.model,
-                            provider=LLMProvider.ANTHROPIC,
-                            tokens_used=tokens,
-                            duration=duration,
-                            success=True
-                        )
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"Anthropic error: {response.status} - {error_text}")
+                # مدل قوی‌تر همین provider پیش از fallback
+                client_request = self._escalate(client_request)
+                if client_request is not None and not breaker.allow_request():
+                    break
         
-        except Exception as e:
-            duration = time.time() - start_time
-            return LLMResponse(
-                content='',
-                model=self.model,
-                provider=LLMProvider.ANTHROPIC,
-                tokens_used=0,
-                duration=duration,
-                success=False,
-                error=str(e)
-            )
+        # همه روش‌ها ناموفق بودند
+        yield StreamChunk(text='', done=True, response=self._no_provider_response())
+    
+    def build_code_request(
+        self,
+        task_description: str,
+        file_path: str,
+        context: Optional[str] = None,
+        feature: Optional[str] = None,
+        shared_context: Optional[str] = None,
+        task: Optional[str] = None,
+        relevant_code: Optional[str] = None
+    ) -> LLMRequest:
+        """ساخت درخواست تولید کد
 
+        context مخزن (بین همه feature ها ثابت) و context feature (بین task های
+        یک feature ثابت) پیش از بخش متغیر task می‌آیند تا در prompt cache بمانند.
+        relevant_code (تکه‌های بازیابی‌شده برای همین task) بخشی از prompt متغیر است.
+        """
+        
+        system_prompt = """شما یک برنامه‌نویس ماهر Python هستید.
 
-class LLMWrapper:
-    """رابط یکپارچه برای تمام LLMها"""
-    
-    def __init__(self, config: Dict[str, Any]):
-        self.config = config
-        self.mode = config.get('mode', 'mcp')
+قوانین مهم:
+1. کد کامل، قابل اجرا و بدون خطا بنویسید
+2. از type hints استفاده کنید
+3. docstring برای توابع و کلاس‌ها الزامی است
+4. error handling مناسب داشته باشید
+5. کد تمیز و خوانا باشد (PEP 8)
+6. فقط کد را برگردانید، بدون markdown یا توضیحات اضافی
+7. کد باید self-contained باشد (همه import ها در ابتدا)"""
         
-        # آماده‌سازی کلاینت‌ها
-        self.mcp_client = None
-        self.offline_llm = None
-        self.online_llm = None
+        relevant_block = f"Relevant Code:\n{relevant_code}\n\n" if relevant_code else ""
+        prompt = f"""{relevant_block}Task: {task_description}
+
+Target File: {file_path}
+
+لطفاً کد کامل این فایل را بنویسید. فقط کد Python، بدون ``` یا markdown."""
         
-        self._setup_clients()
+        stable_context = []
+        if shared_context:
+            stable_context.append(f"Repository Context:\n{shared_context}")
+        if context:
+            stable_context.append(f"Context:\n{context}")
+        
+        return LLMRequest(
+            prompt=prompt,
+            system_prompt=system_prompt,
+            max_tokens=self.config.get('cost_control', {}).get('max_output_tokens', 3000),
+            temperature=0.3,
+            stable_context=stable_context,
+            feature=feature,
+            task=task,
+            output_kind=f"code:{_extension(file_path)}"
+        )
     
-    def _setup_clients(self):
-        """راه‌اندازی کلاینت‌ها"""
-        # MCP
-        if self.mode == 'mcp' or self.config.get('fallback_online'):
-            mcp_config = self.config.get('mcp', {})
-            self.mcp_client = MCPClient(
-                api_url=mcp_config.get('api_url', 'http://localhost:5005'),
-                timeout=mcp_config.get('timeout', 300),
-                retry=mcp_config.get('retry', 3)
-            )
+    async def generate_code(
+        self,
+        task_description: str,
+        file_path: str,
+        context: Optional[str] = None,
+        feature: Optional[str] = None,
+        shared_context: Optional[str] = None,
+        task: Optional[str] = None,
+        relevant_code: Optional[str] = None,
+        candidates: int = 1
+    ) -> LLMResponse:
+        """تولید کد برای یک task خاص
+
+        با candidates > 1 چند نسخه هم‌زمان تولید و بهترین انتخاب می‌شود.
+        """
+        request = self.build_code_request(
+            task_description, file_path, context, feature, shared_context, task, relevant_code
+        )
+        if candidates > 1:
+            response = await self._generate_best_of_n(request, file_path, candidates)
+        else:
+            response = await self.generate(request)
+        return replace(response, request=request)
+    
+    async def _generate_best_of_n(self, request: LLMRequest, file_path: str, candidates: int) -> LLMResponse:
+        """تولید هم‌زمان چند نسخه با دماهای متفاوت و انتخاب بهترین با AICodeReviewer
+
+        کش پاسخ‌ها دور زده می‌شود (معمولاً برای task هایی است که قبلاً شکست
+        خورده‌اند). هر نسخه جداگانه از pre-flight و دفتر هزینه عبور می‌کند.
+        """
+        start_time = time.time()
+        temperatures = candidate_temperatures(request.temperature, candidates, self.temperature_spread)
+        print(f"🎲 تولید {candidates} نسخه هم‌زمان (دما: {', '.join(map(str, temperatures))})")
         
-        # Offline
-        if self.mode == 'offline':
-            offline_config = self.config.get('offline_model', {})
-            self.offline_llm = OfflineLLM(
-                model_path=offline_config.get('path', './models/model.gguf')
-            )
+        responses = await asyncio.gather(*[
+            self.generate(replace(request, temperature=temperature, bypass_cache=True))
+            for temperature in temperatures
+        ])
+        best, review, scores = await select_best(responses, self.reviewer, file_path)
         
-        # Online (Fallback)
-        if self.config.get('fallback_online'):
-            online_config = self.config.get('online', {})
-            import os
-            api_key = os.getenv(online_config.get('api_key_env', 'OPENAI_API_KEY'))
-            
-            self.online_llm = OnlineLLM(
-                provider=online_config.get('provider', 'openai'),
-                api_key=api_key or '',
-                model=online_config.get('model', 'gpt-4')
-            )
+        self.best_of_n_stats['runs'] += 1
+        self.best_of_n_stats['candidates'] += candidates
+        self.best_of_n_stats['unusable_candidates'] += candidates - len(scores)
+        
+        if best is None:
+            return first_failure(responses)
+        
+        self.best_of_n_stats['selected'] += 1
+        self.best_of_n_stats['best_score_total'] += review.quality_score
+        print(f"🏆 بهترین نسخه: نمره {review.quality_score:.1f} از {[round(s, 1) for s in scores]}")
+        return combine_candidates(best, responses, time.time() - start_time)
     
-    async def generate(self, request: LLMRequest) -> LLMResponse:
-        """تولید کد با استفاده از LLM"""
+    def _build_edit_request(
+        self,
+        task_description: str,
+        file_path: str,
+        existing_code: str,
+        context: Optional[str] = None,
+        feature: Optional[str] = None,
+        shared_context: Optional[str] = None,
+        task: Optional[str] = None,
+        relevant_code: Optional[str] = None
+    ) -> LLMRequest:
+        """ساخت درخواست ویرایش یک فایل موجود (خروجی: بلوک‌های SEARCH/REPLACE)
+
+        فایلی که کامل در سقف ورودی جا نمی‌شود به صورت نمای جزئی (edit_view)
+        فرستاده می‌شود: بخش‌های مرتبط با task کامل و بقیه فقط به صورت طرح کلی.
+        """
+        request = self.build_code_request(
+            task_description, file_path, context, feature, shared_context, task, relevant_code
+        )
         
-        # تلاش با MCP
-        if self.mode == 'mcp' and self.mcp_client:
-            response = await self.mcp_client.generate(request)
-            if response.success:
-                return response
-            
-            print(f"⚠️  MCP ناموفق بود: {response.error}")
+        system_prompt = f"""شما یک برنامه‌نویس ماهر Python هستید که فایل‌های موجود را ویرایش می‌کنید.
+
+قوانین مهم:
+1. فقط بخش‌هایی را که برای task لازم است تغییر دهید
+2. سبک، نام‌گذاری و ساختار فایل فعلی را حفظ کنید
+3. از type hints و docstring استفاده کنید
+4. کد نهایی باید بدون خطا اجرا شود
+
+{EDIT_FORMAT}"""
         
-        # تلاش با Offline
-        if self.mode == 'offline' and self.offline_llm:
-            response = await self.offline_llm.generate(request)
-            if response.success:
-                return response
-            
-            print(f"⚠️  Offline LLM ناموفق بود: {response.error}")
+        relevant_block = f"Relevant Code:\n{relevant_code}\n\n" if relevant_code else ""
         
-        # Fallback به Online
-        if self.config.get('fallback_online') and self.online_llm:
-            print("🔄 Fallback به API آنلاین...")
-            response = await self.online_llm.generate(request)
-            return response
+        def edit_prompt(header: str, file_view: str) -> str:
+            return f"""{relevant_block}{header}
+{file_view}
+
+Task: {task_description}
+
+تغییرات لازم را فقط به صورت بلوک‌های SEARCH/REPLACE بنویسید."""
         
-        # همه روش‌ها ناموفق بودند
-        return LLMResponse(
-            content='',
-            model='none',
-            provider=LLMProvider.MCP,
-            tokens_used=0,
-            duration=0,
-            success=False,
-            error="هیچ LLM موفقی در دسترس نیست"
+        request = replace(
+            request,
+            prompt=edit_prompt(f"Current File: {file_path}", existing_code),
+            system_prompt=system_prompt,
+            output_kind=f"edit:{_extension(file_path)}"
         )
+        
+        input_limit = self._input_limit()
+        if self.token_counter.count_request(request) <= input_limit:
+            return request
+        
+        header = f"Current File: {file_path} (نمای جزئی؛ بخش‌های حذف‌شده را در SEARCH نیاورید)"
+        budget = input_limit - self.token_counter.count_request(replace(request, prompt=edit_prompt(header, "")))
+        file_view = edit_view(existing_code, file_path, task_description, budget, self.token_counter)
+        if file_view is None:
+            return request  # pre-flight رد می‌کند و فایل کامل بازنویسی می‌شود
+        
+        self.edit_stats['partial_views'] += 1
+        return replace(request, prompt=edit_prompt(header, file_view))
     
-    async def generate_code(
+    async def generate_edit(
         self,
         task_description: str,
         file_path: str,
-        context: Optional[str] = None
+        existing_code: str,
+        context: Optional[str] = None,
+        feature: Optional[str] = None,
+        shared_context: Optional[str] = None,
+        task: Optional[str] = None,
+        relevant_code: Optional[str] = None
     ) -> LLMResponse:
-        """تولید کد برای یک task خاص"""
+        """ویرایش یک فایل موجود با بلوک‌های SEARCH/REPLACE
+
+        بلوک‌ها محلی اعمال و اعتبارسنجی می‌شوند (با تطابق تقریبی در صورت
+        نیاز). اگر درخواست، اعمال یا اعتبارسنجی شکست بخورد، دلیل آن ثبت و کل
+        فایل دوباره تولید می‌شود. content پاسخ موفق همیشه متن کامل فایل جدید است.
+        """
+        self.edit_stats['edits'] += 1
+        request = self._build_edit_request(
+            task_description, file_path, existing_code, context, feature, shared_context, task, relevant_code
+        )
+        response = await self.generate(request)
         
-        system_prompt = """شما یک برنامه‌نویس ماهر هستید که کد با کیفیت بالا تولید می‌کنید.
-قوانین:
-1. کد باید کامل، قابل اجرا و بدون خطا باشد
-2. از type hints استفاده کنید
-3. docstring برای توابع و کلاس‌ها بنویسید
-4. error handling مناسب داشته باشید
-5. کد باید تمیز و خوانا باشد (PEP 8)
-6. فقط کد را برگردانید، بدون توضیحات اضافی"""
+        if not response.success:
+            reason, detail = 'request_failed', response.error
+        else:
+            try:
+                blocks = parse_edit_blocks(response.content)
+                if not blocks:
+                    raise EditError("هیچ بلوک SEARCH/REPLACE در پاسخ نبود")
+                edited, methods = apply_edits(existing_code, blocks, self.edit_fuzzy_threshold)
+            except EditError as e:
+                reason, detail = 'apply_failed', str(e)
+            else:
+                reason, detail = 'invalid', validate_edit(file_path, existing_code, edited)
+            
+            if not detail:
+                self.edit_stats['applied'] += 1
+                self.edit_stats['fuzzy_blocks'] += sum(method != 'exact' for method in methods)
+                self.edit_stats['output_tokens_saved'] += max(
+                    self.token_counter.count(edited) - self.token_counter.count(response.content), 0
+                )
+                print(f"✏️  {len(blocks)} بلوک ویرایش روی {file_path} اعمال شد ({', '.join(methods)})")
+                return replace(response, content=edited, request=request)
         
-        prompt = f"""Task: {task_description}
-File: {file_path}
+        summary = str(detail).splitlines()[0] if detail else reason
+        print(f"⚠️  ویرایش {file_path} ناموفق بود ({reason}: {summary})؛ بازنویسی کامل فایل")
+        self.edit_stats['fallbacks'] += 1
+        self.edit_stats['fallback_reasons'][reason] = self.edit_stats['fallback_reasons'].get(reason, 0) + 1
+        fallback = await self.generate_code(
+            task_description, file_path, context, feature, shared_context, task, relevant_code
+        )
+        if not response.success:
+            return fallback
+        # هزینه تلاش ویرایش هم در پاسخ نهایی حساب می‌شود
+        return replace(
+            fallback,
+            tokens_used=fallback.tokens_used + response.tokens_used,
+            cost=fallback.cost + response.cost,
+            duration=fallback.duration + response.duration
+        )
+    
+    async def generate_files(
+        self,
+        task_description: str,
+        file_paths: List[str],
+        context: Optional[str] = None,
+        feature: Optional[str] = None,
+        shared_context: Optional[str] = None,
+        task: Optional[str] = None,
+        relevant_code: Optional[str] = None
+    ) -> Dict[str, LLMResponse]:
+        """تولید همه فایل‌های یک task در یک فراخوانی
 
-{"Context:\n" + context if context else ""}
+        فایل‌هایی که در پاسخ نیستند، ناقص‌اند (پاسخ قطع‌شده) یا اعتبارسنجی
+        نمی‌شوند به صورت هم‌زمان و جداگانه با generate_code تولید می‌شوند.
+        usage و هزینه فراخوانی مشترک فقط روی پاسخ اولین فایل حساب می‌شود.
 
-لطفاً کد کامل این فایل را تولید کنید:"""
+        Returns:
+            مسیر فایل -> پاسخ با محتوای کامل همان فایل
+        """
+        self.multi_file_stats['calls'] += 1
+        self.multi_file_stats['files'] += len(file_paths)
         
-        request = LLMRequest(
-            prompt=prompt,
-            system_prompt=system_prompt,
-            max_tokens=4096,
-            temperature=0.3
+        request = self.build_code_request(
+            task_description, ', '.join(file_paths), context, feature, shared_context, task, relevant_code
         )
+        relevant_block = f"Relevant Code:\n{relevant_code}\n\n" if relevant_code else ""
+        targets = '\n'.join(f"- {path}" for path in file_paths)
+        prompt = f"""{relevant_block}Task: {task_description}
+
+Target Files:
+{targets}
+
+{MULTI_FILE_FORMAT}"""
+        request = replace(request, prompt=prompt, max_tokens=self.multi_file_max_tokens, output_kind="files")
         
-        return await self.generate(request)
+        response = replace(await self.generate(request), request=request)
+        files = parse_multi_file(response.content, file_paths) if response.success else {}
+        
+        results: Dict[str, LLMResponse] = {}
+        missing = []
+        for path in file_paths:
+            error = validate_file(path, files[path]) if path in files else "در پاسخ نبود"
+            if error:
+                print(f"⚠️  {path} از پاسخ چندفایلی قابل استفاده نیست ({error})؛ تولید جداگانه")
+                missing.append(path)
+                continue
+            # فایل کامل (با END FILE) حتی اگر بقیه پاسخ قطع شده باشد
+            shared = not results
+            results[path] = replace(
+                response,
+                content=files[path],
+                tokens_used=response.tokens_used if shared else 0,
+                cost=response.cost if shared else 0.0,
+                finish_reason=None
+            )
+        
+        if missing:
+            self.multi_file_stats['fallback_files'] += len(missing)
+            fallbacks = await asyncio.gather(*[
+                self.generate_code(
+                    task_description, path, context, feature, shared_context, task, relevant_code
+                )
+                for path in missing
+            ])
+            results.update(zip(missing, fallbacks))
+        
+        return {path: results[path] for path in file_paths}
+    
+    async def generate_code_stream(
+        self,
+        task_description: str,
+        file_path: str,
+        context: Optional[str] = None,
+        feature: Optional[str] = None,
+        shared_context: Optional[str] = None,
+        task: Optional[str] = None,
+        relevant_code: Optional[str] = None
+    ) -> AsyncIterator[StreamChunk]:
+        """تولید کد برای یک task به صورت stream"""
+        request = self.build_code_request(
+            task_description, file_path, context, feature, shared_context, task, relevant_code
+        )
+        async for chunk in self.generate_stream(request):
+            if chunk.done and chunk.response is not None:
+                chunk = replace(chunk, response=replace(chunk.response, request=request))
+            yield chunk
     
     async def generate_tests(
         self,
         code: str,
-        file_path: str
+        file_path: str,
+        feature: Optional[str] = None,
+        task: Optional[str] = None,
+        source_request: Optional[LLMRequest] = None
     ) -> LLMResponse:
-        """تولید تست برای کد"""
+        """تولید تست برای کد
+
+        با source_request (درخواست تولید همین کد، LLMResponse.request) گفتگو
+        ادامه پیدا می‌کند: system prompt و context ثابت آن درخواست (پیشوند گرم
+        در prompt cache) حفظ می‌شود و کد به عنوان پاسخ قبلی assistant می‌آید.
+        اگر درخواست تولید و کد با هم در سقف ورودی جا نشوند، کد در prompt
+        مستقل فرستاده می‌شود و اگر باز هم جا نشود، فقط stub آن.
+        درخواست‌های حالت ویرایش (generate_edit) خروجی SEARCH/REPLACE دارند، نه
+        کل فایل؛ برای آن‌ها هم prompt مستقل استفاده می‌شود تا مدل به قالب
+        بلوک ویرایش سوق داده نشود.
+        """
+        
+        rules = """قوانین:
+1. تست‌های جامع با pytest بنویسید
+2. موارد مرزی را پوشش دهید
+3. تست‌ها باید قابل اجرا باشند
+4. از fixtures مناسب استفاده کنید
+5. docstring برای هر تست بنویسید"""
         
-        system_prompt = """شما یک تست‌نویس متخصص هستید.
-قوانین:
-1. تست‌های جامع و کامل بنویسید
-2. از pytest استفاده کنید
-3. موارد مرزی را پوشش دهید
-4. تست‌ها باید قابل اجرا باشند
-5. docstring برای تست‌ها بنویسید"""
+        if source_request is not None and (source_request.output_kind or '').startswith('edit:'):
+            feature = feature or source_request.feature
+            task = task or source_request.task
+            source_request = None
         
-        prompt = f"""کد زیر را تست کنید:
+        if source_request is not None:
+            history = list(source_request.context or []) + [
+                {"role": "user", "content": source_request.prompt},
+                {"role": "assistant", "content": code}
+            ]
+            prompt = f"""حالا برای کدی که نوشتید تست بنویسید.
 
-```python
-{code}
-```
+{rules}
+
+Target Test File: {file_path}
+
+تست‌های pytest کامل بنویسید. فقط کد Python."""
+            
+            request = replace(
+                source_request,
+                prompt=prompt,
+                context=history,
+                max_tokens=2048,
+                temperature=0.3,
+                bypass_cache=False,
+                output_kind=f"tests:{_extension(file_path)}",
+                feature=feature or source_request.feature,
+                task=task or source_request.task
+            )
+            # pre-flight فقط تاریخچه قبل از آخرین تبادل (درخواست تولید و کد) را کوتاه می‌کند
+            if self.token_counter.count_request(replace(request, context=history[-2:])) <= self._input_limit():
+                return await self.generate(request)
+            print(f"⚠️  درخواست تولید و کد {file_path} در سقف ورودی جا نمی‌شوند؛ تست با prompt مستقل")
+        
+        system_prompt = f"""شما یک تست‌نویس متخصص هستید.
+
+{rules}"""
+        
+        def inline_prompt(source: str) -> str:
+            return f"""کد زیر را تست کنید:
+
+{source}
 
-File path: {file_path}
+Target Test File: {file_path}
 
-لطفاً تست‌های pytest کامل تولید کنید:"""
+تست‌های pytest کامل بنویسید. فقط کد Python."""
         
         request = LLMRequest(
-            prompt=prompt,
+            prompt=inline_prompt(code),
             system_prompt=system_prompt,
             max_tokens=2048,
-            temperature=0.3
+            temperature=0.3,
+            feature=feature,
+            task=task,
+            output_kind=f"tests:{_extension(file_path)}"
         )
         
+        if self.token_counter.count_request(request) > self._input_limit():
+            stub = _code_stub(code)
+            if stub:
+                print(f"⚠️  کد در سقف ورودی جا نمی‌شود؛ تست {file_path} از روی stub (امضا و docstring)")
+                request = replace(request, prompt=inline_prompt(stub))
+        
         return await self.generate(request)
     
     async def review_code(self, code: str) -> LLMResponse:
@@ -917,40 +2200,115 @@ File path: {file_path}
         )
         
         return await self.generate(request)
+    
+    def get_cost_summary(self) -> Dict[str, Any]:
+        """خلاصه هزینه‌ها
+
+        remaining و percentage از دفتر دائمی (همه اجراها، همان مبنای اعمال
+        سقف‌ها) محاسبه می‌شوند؛ run_cost فقط هزینه همین اجراست.
+        """
+        ledger = self.ledger.get_summary()
+        summary = {
+            'total_cost': ledger['total_cost'],
+            'run_cost': round(self.total_cost, 3),
+            'max_cost': self.max_total_cost,
+            'remaining': ledger['remaining'],
+            'percentage': round((ledger['total_cost'] / self.max_total_cost) * 100, 1),
+            'ledger': ledger
+        }
+        
+        summary['preflight'] = {
+            **self.preflight_stats,
+            'tokenizer': self.token_counter.backend
+        }
+        
+        if self.output_lengths:
+            summary['output_lengths'] = self.output_lengths.get_stats()
+        
+        if self.response_cache:
+            summary['cache'] = self.response_cache.get_stats()
+        
+        summary['coalescing'] = self.single_flight.get_stats()
+        summary['prompt_cache'] = self.prompt_cache_stats.get_stats()
+        
+        if self.multi_file_stats['calls']:
+            summary['multi_file'] = dict(self.multi_file_stats)
+        
+        if self.edit_stats['edits']:
+            summary['edit_mode'] = {**self.edit_stats, 'fallback_reasons': dict(self.edit_stats['fallback_reasons'])}
+        
+        if self.best_of_n_stats['runs']:
+            summary['best_of_n'] = {
+                **self.best_of_n_stats,
+                'avg_best_score': round(
+                    self.best_of_n_stats['best_score_total'] / max(self.best_of_n_stats['selected'], 1), 1
+                )
+            }
+        
+        summary['retries'] = self.get_retry_stats()
+        
+        if self.router:
+            summary['model_routing'] = self.get_routing_stats()
+        
+        if self.breakers:
+            summary['circuit_breakers'] = self.get_circuit_stats()
+        
+        return summary
 
 
 # تست سریع
 if __name__ == "__main__":
-    async def test_llm():
+    async def test_custom_api():
         config = {
-            'mode': 'mcp',
-            'mcp': {
-                'api_url': 'http://localhost:5005',
+            'mode': 'custom',
+            'custom_api': {
+                'enabled': True,
+                'base_url': 'https://your-api-server.com/v1',
+                'api_key_env': 'CUSTOM_API_KEY',
+                'model': 'claude-sonnet-4-20250514',
                 'timeout': 300,
                 'retry': 3
             },
-            'fallback_online': True,
             'online': {
-                'provider': 'openai',
-                'api_key_env': 'OPENAI_API_KEY',
-                'model': 'gpt-4'
-            }
+                'use_cache': True
+            },
+            'connection_pool': {
+                'limit_per_host': 10,
+                'keepalive_timeout': 60
+            },
+            'cost_control': {
+                'max_total_cost': 2.0,
+                'max_output_tokens': 3000
+            },
+            'fallback_to_mcp': False
         }
         
-        wrapper = LLMWrapper(config)
-        
-        # تولید کد ساده
-        response = await wrapper.generate_code(
-            task_description="ایجاد تابع محاسبه فیبوناچی",
-            file_path="fibonacci.py"
-        )
-        
-        if response.success:
-            print(f"✅ کد تولید شد ({response.provider.value}):")
-            print(response.content[:500])
-            print(f"\n⏱️  مدت زمان: {response.duration:.2f}s")
-            print(f"🎯 Tokens: {response.tokens_used}")
-        else:
-            print(f"❌ خطا: {response.error}")
+        async with LLMWrapper(config) as wrapper:
+            # تست تولید کد
+            response = await wrapper.generate_code(
+                task_description="ایجاد تابع محاسبه فیبوناچی با memoization",
+                file_path="fibonacci.py"
+            )
+            
+            if response.success:
+                print("✅ کد تولید شد!")
+                print(f"📊 Model: {response.model}")
+                print(f"💰 Cost: ${response.cost:.4f}")
+                print(f"⏱️  Duration: {response.duration:.2f}s")
+                print(f"🎯 Tokens: {response.tokens_used}")
+                print(f"\n📝 Generated Code:\n{response.content[:300]}...")
+                
+                # خلاصه هزینه
+                summary = wrapper.get_cost_summary()
+                print("\n💳 Cost Summary:")
+                print(f"   Total: ${summary['total_cost']}")
+                print(f"   Remaining: ${summary['remaining']}")
+                print(f"   Used: {summary['percentage']}%")
+            else:
+                print(f"❌ خطا: {response.error}")
+            
+            # آمار اتصال‌ها
+            for name, stats in wrapper.get_connection_stats().items():
+                print(f"🔌 {name}: reused={stats['connections_reused']}, created={stats['connections_created']}")
     
-    asyncio.run(test_llm())
\ No newline at end of file
+    asyncio.run(test_custom_api())
@@ -0,0 +1,218 @@
+"""
+Model Router - انتخاب مدل هر درخواست از جدول مسیریابی و ارتقا به مدل قوی‌تر در صورت شکست
+"""
+
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Set, Tuple
+
+from utils.file_utils import AtomicFileWriter
+
+
+@dataclass
+class ModelRoute:
+    """یک ردیف جدول مسیریابی (ردیف‌ها از ارزان و سریع به قوی مرتب‌اند)"""
+    name: str
+    model: str
+    pricing: Optional[Dict[str, float]] = None  # per million tokens (input، output، cache_write، cache_read)
+    kinds: List[str] = field(default_factory=list)  # پیشوند output_kind مجاز (خالی = همه)
+    max_prompt_tokens: Optional[int] = None
+    max_output_tokens: Optional[int] = None
+    min_success_rate: float = 0.0  # کمتر از این نرخ موفقیت task ها، ردیف برای آن نوع کنار می‌رود
+    
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'ModelRoute':
+        """ساخت از یک ردیف model_routing.routes"""
+        return cls(
+            name=config.get('name', config['model']),
+            model=config['model'],
+            pricing=config.get('pricing'),
+            kinds=config.get('kinds', []),
+            max_prompt_tokens=config.get('max_prompt_tokens'),
+            max_output_tokens=config.get('max_output_tokens'),
+            min_success_rate=config.get('min_success_rate', 0.0)
+        )
+    
+    def accepts(self, request, prompt_tokens: int) -> bool:
+        """آیا درخواست در محدوده این ردیف است"""
+        if self.kinds and not any((request.output_kind or '').startswith(kind) for kind in self.kinds):
+            return False
+        if self.max_prompt_tokens is not None and prompt_tokens > self.max_prompt_tokens:
+            return False
+        if self.max_output_tokens is not None and request.max_tokens > self.max_output_tokens:
+            return False
+        return True
+
+
+class ModelRouter:
+    """مسیریابی درخواست‌ها بین مدل‌ها
+
+    اولین ردیفی که نوع خروجی، اندازه prompt و max_tokens (پس از تعیین
+    تطبیقی) درخواست را می‌پذیرد و نرخ موفقیتش برای آن نوع کمتر از
+    min_success_rate نیست انتخاب می‌شود؛ ردیف آخر پیش‌فرض است. هر شکست
+    task مدل‌های ضعیف‌تر را یک پله کنار می‌گذارد و پاسخ ناموفق API همان
+    درخواست را به مدل بعدی ارتقا می‌دهد. نرخ موفقیت فقط از نتیجه نهایی task ها
+    (بعد از اعتبارسنجی) محاسبه می‌شود، نه از خطاهای API، و حداکثر هر
+    save_interval ثانیه و در flush در فایل نوشته می‌شود.
+    """
+    
+    def __init__(
+        self,
+        routes: List[ModelRoute],
+        provider: str = 'custom',
+        path: str = "./.llm_cache/model_routing.json",
+        min_samples: int = 5,
+        save_interval: float = 30.0
+    ):
+        self.routes = routes
+        self.models = list(dict.fromkeys(route.model for route in routes))  # از ضعیف به قوی
+        self.provider = provider
+        self.path = Path(path)
+        self.min_samples = min_samples
+        self.save_interval = save_interval
+        
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self.outcomes: Dict[str, List[int]] = {}  # "مدل|نوع" -> [موفق، ناموفق]
+        self.task_failures: Dict[str, int] = {}  # task -> شکست‌های پیاپی
+        self.task_routes: Dict[str, Set[Tuple[str, str]]] = {}  # task -> (مدل، نوع) های استفاده‌شده
+        self.stats = {
+            'routed': {route.name: 0 for route in routes},
+            'escalations': 0
+        }
+        
+        self._load()
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> Optional['ModelRouter']:
+        """ساخت از بخش model_routing تنظیمات (None اگر غیرفعال است یا ردیفی ندارد)"""
+        config = config or {}
+        if not config.get('enabled', False) or not config.get('routes'):
+            return None
+        return cls(
+            routes=[ModelRoute.from_config(route) for route in config['routes']],
+            provider=config.get('provider', 'custom'),
+            path=config.get('path', './.llm_cache/model_routing.json'),
+            min_samples=config.get('min_samples', 5),
+            save_interval=config.get('save_interval', 30.0)
+        )
+    
+    def _load(self):
+        """بارگذاری نتایج ذخیره‌شده"""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.outcomes = json.load(f)
+        except Exception as e:
+            print(f"⚠️  تاریخچه مسیریابی مدل نامعتبر است و از نو شروع می‌شود: {e}")
+            self.outcomes = {}
+    
+    def _save(self):
+        """ذخیره atomic نتایج"""
+        with AtomicFileWriter(str(self.path)) as writer:
+            writer.write(json.dumps(self.outcomes))
+        self._dirty = False
+        self._last_save = time.monotonic()
+    
+    def flush(self):
+        """ذخیره نتایج نوشته‌نشده"""
+        if self._dirty:
+            self._save()
+    
+    @staticmethod
+    def kind_family(request) -> str:
+        """گروه نوع خروجی (code، edit، tests، files یا other)"""
+        return request.output_kind.split(':')[0] if request.output_kind else 'other'
+    
+    @staticmethod
+    def task_key(feature: Optional[str], task: Optional[str]) -> Optional[str]:
+        """کلید یک task"""
+        return f"{feature}.{task}" if task else None
+    
+    def pricing(self) -> Dict[str, Dict[str, float]]:
+        """قیمت‌گذاری هر مدل جدول"""
+        return {route.model: route.pricing for route in self.routes if route.pricing}
+    
+    def find(self, model: str) -> Optional[ModelRoute]:
+        """اولین ردیف یک مدل"""
+        return next((route for route in self.routes if route.model == model), None)
+    
+    def success_rate(self, route: ModelRoute, family: str) -> Optional[float]:
+        """نرخ موفقیت task های مدل یک ردیف برای یک نوع (None اگر نمونه کافی نیست)"""
+        successes, failures = self.outcomes.get(f"{route.model}|{family}", [0, 0])
+        if successes + failures < self.min_samples:
+            return None
+        return successes / (successes + failures)
+    
+    def _use(self, route: ModelRoute, request) -> ModelRoute:
+        """ثبت استفاده از یک ردیف برای درخواست"""
+        self.stats['routed'][route.name] += 1
+        key = self.task_key(request.feature, request.task)
+        if key:
+            self.task_routes.setdefault(key, set()).add((route.model, self.kind_family(request)))
+        return route
+    
+    def route(self, request, prompt_tokens: int) -> ModelRoute:
+        """انتخاب ردیف برای یک درخواست"""
+        family = self.kind_family(request)
+        key = self.task_key(request.feature, request.task)
+        level = min(self.task_failures.get(key, 0), len(self.models) - 1)
+        
+        for route in self.routes[:-1]:
+            if self.models.index(route.model) < level:
+                continue
+            if not route.accepts(request, prompt_tokens):
+                continue
+            rate = self.success_rate(route, family)
+            if rate is not None and rate < route.min_success_rate:
+                continue
+            return self._use(route, request)
+        return self._use(self.routes[-1], request)
+    
+    def escalate(self, route: ModelRoute, request) -> Optional[ModelRoute]:
+        """اولین ردیف مدل قوی‌تر بعدی پس از پاسخ ناموفق (None اگر قوی‌ترین مدل بود)"""
+        family = self.kind_family(request)
+        # خطای API (مثلاً 5xx گذرا) کیفیت خروجی نیست و در نرخ موفقیت شمرده نمی‌شود؛
+        # نتیجه task فقط به مدل‌هایی نسبت داده می‌شود که پاسخ داده‌اند
+        self.task_routes.get(self.task_key(request.feature, request.task), set()).discard((route.model, family))
+        tier = self.models.index(route.model)
+        if tier + 1 >= len(self.models):
+            return None
+        self.stats['escalations'] += 1
+        return self._use(self.find(self.models[tier + 1]), request)
+    
+    def _record(self, model: str, family: str, success: bool):
+        """ثبت یک نتیجه"""
+        counts = self.outcomes.setdefault(f"{model}|{family}", [0, 0])
+        counts[0 if success else 1] += 1
+    
+    def record_task_result(self, feature: str, task: str, success: bool):
+        """ثبت نتیجه نهایی task برای همه مدل‌هایی که در آن استفاده شدند"""
+        key = self.task_key(feature, task)
+        if success:
+            self.task_failures.pop(key, None)
+        else:
+            self.task_failures[key] = self.task_failures.get(key, 0) + 1
+        
+        used = self.task_routes.pop(key, set())
+        for model, family in used:
+            self._record(model, family, success)
+        if used:
+            self._dirty = True
+            if time.monotonic() - self._last_save >= self.save_interval:
+                self._save()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """تعداد درخواست هر ردیف، ارتقاها و نرخ موفقیت"""
+        return {
+            'routed': dict(self.stats['routed']),
+            'escalations': self.stats['escalations'],
+            'success_rates': {
+                key: round(successes / (successes + failures), 3)
+                for key, (successes, failures) in self.outcomes.items()
+                if successes + failures
+            }
+        }
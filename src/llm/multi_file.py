@@ -0,0 +1,77 @@
+"""
+Multi-File - تولید چند فایل کوچک یک task در یک فراخوانی و جدا کردن آن‌ها از پاسخ
+"""
+
+import ast
+import os
+import re
+from typing import Dict, List, Optional
+
+MULTI_FILE_FORMAT = """همه فایل‌ها را در یک پاسخ و دقیقاً با این قالب بنویسید:
+
+=== FILE: مسیر/فایل ===
+محتوای کامل فایل
+=== END FILE ===
+
+قوانین:
+1. برای هر فایل خواسته‌شده دقیقاً یک بلوک، با همان مسیر
+2. محتوای هر فایل کامل و بدون ``` یا markdown
+3. بیرون از بلوک‌ها چیزی ننویسید"""
+
+_FILE_HEADER = re.compile(r"^[ \t]*={3,}[ \t]*FILE:[ \t]*(.+?)[ \t]*={3,}[ \t]*$", re.MULTILINE)
+_FILE_END = re.compile(r"^[ \t]*={3,}[ \t]*END[ \t]*FILE[ \t]*={3,}[ \t]*$", re.MULTILINE)
+_FENCE = re.compile(r"^```[\w+-]*[ \t]*\n(.*?)\n?```[ \t]*$", re.DOTALL)
+
+
+def normalize_path(path: str) -> str:
+    """یکسان‌سازی مسیر (بدون ./، backtick یا نقل‌قول)"""
+    path = path.strip().strip('`"\'').replace('\\', '/')
+    return os.path.normpath(path).replace('\\', '/')
+
+
+def strip_fence(content: str) -> str:
+    """حذف ``` دور محتوای یک فایل (اگر مدل اضافه کرده باشد)"""
+    match = _FENCE.match(content.strip())
+    return match.group(1) if match else content
+
+
+def parse_multi_file(text: str, expected_paths: List[str]) -> Dict[str, str]:
+    """جدا کردن فایل‌ها از پاسخ
+
+    بلوک بدون END FILE (مثلاً پاسخ قطع‌شده) فقط وقتی پذیرفته می‌شود که
+    بلوک بعدی شروع شده باشد. مسیرهای ناشناخته نادیده گرفته می‌شوند.
+
+    Returns:
+        مسیر (همان شکل expected_paths) -> محتوا
+    """
+    expected = {normalize_path(path): path for path in expected_paths}
+    headers = list(_FILE_HEADER.finditer(text))
+    files: Dict[str, str] = {}
+    
+    for i, header in enumerate(headers):
+        path = expected.get(normalize_path(header.group(1)))
+        if path is None or path in files:
+            continue
+        
+        next_start = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        body = text[header.end():next_start]
+        end = _FILE_END.search(body)
+        if end:
+            body = body[:end.start()]
+        elif i + 1 == len(headers):
+            continue  # آخرین بلوک بدون پایان: احتمالاً ناقص
+        
+        files[path] = strip_fence(body.strip('\n')).rstrip() + '\n'
+    return files
+
+
+def validate_file(file_path: str, content: str) -> Optional[str]:
+    """بررسی یک فایل جداشده؛ پیام خطا یا None (__init__.py خالی مجاز است)"""
+    if not content.strip() and os.path.basename(file_path) != '__init__.py':
+        return "فایل خالی است"
+    if file_path.endswith('.py'):
+        try:
+            ast.parse(content)
+        except SyntaxError as e:
+            return f"خطای Syntax (خط {e.lineno}): {e.msg}"
+    return None
@@ -0,0 +1,156 @@
+"""
+Output Lengths - توزیع طول خروجی به تفکیک نوع فایل و task برای تعیین max_tokens
+"""
+
+import json
+import math
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+from utils.file_utils import AtomicFileWriter
+
+
+def output_tokens(response) -> int:
+    """token های خروجی یک پاسخ (کل منهای ورودی و کش)"""
+    return max(
+        response.tokens_used - response.input_tokens
+        - response.cache_creation_tokens - response.cache_read_tokens,
+        0
+    )
+
+
+def percentile(samples: List[int], percent: float) -> int:
+    """صدک با روش nearest-rank"""
+    ordered = sorted(samples)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class OutputLengthModel:
+    """تاریخچه دائمی طول خروجی و پیشنهاد max_tokens
+
+    برای هر درخواست دو کلید نگه داشته می‌شود: نوع خروجی (مثلاً code:.py یا
+    tests:.py) و همان نوع برای یک task مشخص. max_tokens از دقیق‌ترین کلیدی
+    که حداقل min_samples نمونه دارد برابر صدک percentile ضرب در margin است،
+    محدود به [min_tokens، مقدار پیش‌فرض درخواست]. پاسخ‌های قطع‌شده هم ثبت
+    می‌شوند و توزیع را بالا می‌برند؛ ادامه خودکار جلوی از دست رفتن خروجی را
+    می‌گیرد. تاریخچه حداکثر هر save_interval ثانیه و در flush نوشته می‌شود.
+    """
+    
+    def __init__(
+        self,
+        path: str = "./.llm_cache/output_lengths.json",
+        percentile: float = 95.0,
+        margin: float = 1.2,
+        min_samples: int = 5,
+        window: int = 200,
+        min_tokens: int = 256,
+        save_interval: float = 30.0
+    ):
+        self.path = Path(path)
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.window = window
+        self.min_tokens = min_tokens
+        self.save_interval = save_interval
+        
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self.samples: Dict[str, List[int]] = {}  # کلید -> آخرین window طول خروجی
+        self.stats = {
+            'sized_requests': 0,
+            'tokens_trimmed': 0
+        }
+        
+        self._load()
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'OutputLengthModel':
+        """ساخت از بخش cost_control.adaptive_max_tokens تنظیمات"""
+        config = config or {}
+        return cls(
+            path=config.get('path', './.llm_cache/output_lengths.json'),
+            percentile=config.get('percentile', 95.0),
+            margin=config.get('margin', 1.2),
+            min_samples=config.get('min_samples', 5),
+            window=config.get('window', 200),
+            min_tokens=config.get('min_tokens', 256),
+            save_interval=config.get('save_interval', 30.0)
+        )
+    
+    def _load(self):
+        """بارگذاری تاریخچه ذخیره‌شده"""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.samples = json.load(f)
+        except Exception as e:
+            print(f"⚠️  تاریخچه طول خروجی نامعتبر است و از نو شروع می‌شود: {e}")
+            self.samples = {}
+    
+    def _save(self):
+        """ذخیره atomic تاریخچه"""
+        with AtomicFileWriter(str(self.path)) as writer:
+            writer.write(json.dumps(self.samples))
+        self._dirty = False
+        self._last_save = time.monotonic()
+    
+    def flush(self):
+        """ذخیره تغییرات نوشته‌نشده"""
+        if self._dirty:
+            self._save()
+    
+    @staticmethod
+    def keys(request) -> List[str]:
+        """کلیدهای یک درخواست از دقیق به کلی (خالی اگر output_kind ندارد)"""
+        if not request.output_kind:
+            return []
+        keys = [request.output_kind]
+        if request.task:
+            keys.insert(0, f"{request.feature}.{request.task}|{request.output_kind}")
+        return keys
+    
+    def record(self, request, response):
+        """ثبت طول خروجی یک پاسخ موفق"""
+        keys = self.keys(request)
+        tokens = output_tokens(response)
+        if not keys or not response.success or not tokens:
+            return
+        
+        for key in keys:
+            samples = self.samples.setdefault(key, [])
+            samples.append(tokens)
+            del samples[:-self.window]
+        self._dirty = True
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self._save()
+    
+    def suggest(self, request) -> int:
+        """max_tokens پیشنهادی (همان مقدار درخواست اگر تاریخچه کافی نیست)"""
+        for key in self.keys(request):
+            samples = self.samples.get(key, [])
+            if len(samples) < self.min_samples:
+                continue
+            
+            sized = math.ceil(percentile(samples, self.percentile) * self.margin)
+            sized = min(max(sized, self.min_tokens), request.max_tokens)
+            self.stats['sized_requests'] += 1
+            self.stats['tokens_trimmed'] += request.max_tokens - sized
+            return sized
+        return request.max_tokens
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار و صدک هر نوع خروجی"""
+        return {
+            **self.stats,
+            'kinds': {
+                key: {
+                    'samples': len(samples),
+                    f'p{self.percentile:g}': percentile(samples, self.percentile)
+                }
+                for key, samples in self.samples.items() if '|' not in key and samples
+            }
+        }
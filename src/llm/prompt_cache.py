@@ -0,0 +1,170 @@
+"""
+Prompt Cache - چیدمان پیام‌ها برای prompt caching و حسابداری token های کش
+"""
+
+import hashlib
+from typing import Optional, Dict, Any, List, Tuple, Union
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+# سقف breakpoint های Anthropic در هر درخواست (یکی برای system prompt)
+MAX_BREAKPOINTS = 4
+
+
+def _text_block(text: str, cache: bool = False) -> Dict[str, Any]:
+    block = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = CACHE_CONTROL
+    return block
+
+
+def stable_blocks(request, use_cache: bool, breakpoints: int = MAX_BREAKPOINTS - 1) -> List[Dict[str, Any]]:
+    """بلوک‌های ثابت (feature، context مخزن) با breakpoint روی آخرین‌ها"""
+    texts = [text for text in (request.stable_context or []) if text]
+    first_marked = len(texts) - breakpoints
+    return [
+        _text_block(text, cache=use_cache and index >= first_marked)
+        for index, text in enumerate(texts)
+    ]
+
+
+def prefix_key(request) -> str:
+    """hash پیشوند ثابت درخواست (system prompt و context ثابت)
+
+    درخواست‌های با کلید یکسان پیشوند کش provider را با هم شریک‌اند.
+    """
+    texts = [request.system_prompt or ''] + [text for text in (request.stable_context or []) if text]
+    return hashlib.sha256('\0'.join(texts).encode('utf-8')).hexdigest()[:16]
+
+
+def flatten_prompt(request) -> str:
+    """prompt ساده (بدون بلوک) برای provider هایی که فقط متن می‌پذیرند"""
+    texts = [text for text in (request.stable_context or []) if text]
+    return '\n\n'.join(texts + [request.prompt])
+
+
+def build_messages(
+    request,
+    use_cache: bool,
+    system_in_messages: bool = True
+) -> Tuple[Optional[Union[str, List[Dict[str, Any]]]], List[Dict[str, Any]]]:
+    """ساخت پیام‌ها با ترتیب ثابت‌ترین به متغیرترین
+
+    system prompt، سپس context ثابت (feature، مخزن) و در آخر تاریخچه و
+    prompt خود درخواست؛ پس پیشوند درخواست‌های یک feature یکسان و قابل کش است.
+
+    Returns:
+        (system جداگانه برای Anthropic یا None, messages)
+    """
+    messages: List[Dict[str, Any]] = []
+    system = None
+    
+    if request.system_prompt:
+        if system_in_messages:
+            message = {"role": "system", "content": request.system_prompt}
+            if use_cache:
+                message["cache_control"] = CACHE_CONTROL
+            messages.append(message)
+        elif use_cache:
+            system = [_text_block(request.system_prompt, cache=True)]
+        else:
+            system = request.system_prompt
+    
+    blocks = stable_blocks(request, use_cache)
+    
+    if not use_cache:
+        # بدون کش صریح فقط ترتیب مهم است (کش خودکار پیشوند OpenAI)
+        if request.context:
+            if blocks:
+                messages.append({"role": "user", "content": '\n\n'.join(b["text"] for b in blocks)})
+            messages.extend(request.context)
+            messages.append({"role": "user", "content": request.prompt})
+        else:
+            messages.append({"role": "user", "content": flatten_prompt(request)})
+        return system, messages
+    
+    if request.context:
+        if blocks:
+            messages.append({"role": "user", "content": blocks})
+        messages.extend(request.context)
+        messages.append({"role": "user", "content": request.prompt})
+    elif blocks:
+        messages.append({"role": "user", "content": blocks + [_text_block(request.prompt)]})
+    else:
+        messages.append({"role": "user", "content": request.prompt})
+    
+    return system, messages
+
+
+def parse_usage(usage: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """یکسان‌سازی usage دو فرمت OpenAI و Anthropic
+
+    input_tokens همیشه فقط token های ورودی بدون کش است؛ token های نوشته/خوانده
+    شده از کش جداگانه برگردانده می‌شوند.
+    """
+    usage = usage or {}
+    cache_creation = usage.get('cache_creation_input_tokens') or 0
+    
+    if 'prompt_tokens' in usage:
+        # OpenAI: prompt_tokens شامل token های کش‌شده هم هست
+        details = usage.get('prompt_tokens_details') or {}
+        cache_read = usage.get('cache_read_input_tokens') or details.get('cached_tokens') or 0
+        input_tokens = max(usage.get('prompt_tokens', 0) - cache_read - cache_creation, 0)
+        output_tokens = usage.get('completion_tokens', 0)
+    else:
+        cache_read = usage.get('cache_read_input_tokens') or 0
+        input_tokens = usage.get('input_tokens', 0)
+        output_tokens = usage.get('output_tokens', 0)
+    
+    return {
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'cache_creation_input_tokens': cache_creation,
+        'cache_read_input_tokens': cache_read
+    }
+
+
+def total_tokens(usage: Dict[str, int]) -> int:
+    """مجموع همه token های ورودی و خروجی"""
+    return (
+        usage['input_tokens'] + usage['output_tokens']
+        + usage['cache_creation_input_tokens'] + usage['cache_read_input_tokens']
+    )
+
+
+class PromptCacheStats:
+    """آمار prompt caching به تفکیک feature"""
+    
+    def __init__(self):
+        self.features: Dict[str, Dict[str, int]] = {}
+    
+    def record(self, feature: Optional[str], response):
+        """ثبت token های یک پاسخ upstream (نه پاسخ‌های کش دیسک)"""
+        if not response.success or response.cached:
+            return
+        
+        stats = self.features.setdefault(feature or 'default', {
+            'requests': 0,
+            'requests_with_hits': 0,
+            'input_tokens': 0,
+            'cache_creation_tokens': 0,
+            'cache_read_tokens': 0
+        })
+        stats['requests'] += 1
+        if response.cache_read_tokens > 0:
+            stats['requests_with_hits'] += 1
+        stats['input_tokens'] += response.input_tokens
+        stats['cache_creation_tokens'] += response.cache_creation_tokens
+        stats['cache_read_tokens'] += response.cache_read_tokens
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """نرخ hit (بر اساس token و درخواست) برای هر feature"""
+        result = {}
+        for feature, stats in self.features.items():
+            prompt_tokens = stats['input_tokens'] + stats['cache_creation_tokens'] + stats['cache_read_tokens']
+            result[feature] = {
+                **stats,
+                'token_hit_rate': round(stats['cache_read_tokens'] / prompt_tokens, 3) if prompt_tokens else 0.0,
+                'request_hit_rate': round(stats['requests_with_hits'] / stats['requests'], 3) if stats['requests'] else 0.0
+            }
+        return result
@@ -0,0 +1,280 @@
+"""
+Rate Limiter - محدودیت نرخ درخواست (RPM) و توکن (TPM) برای هر provider
+"""
+
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, Mapping, AsyncIterator
+
+from llm.token_counter import default_counter
+
+
+class RateLimitError(Exception):
+    """خطای 429 همراه با زمان انتظار پیشنهادی سرور"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """تبدیل مدت زمان header ها به ثانیه
+
+    فرمت‌های پشتیبانی‌شده: عدد ثانیه ("12")، فرمت OpenAI ("6m0s"، "20ms")،
+    زمان RFC3339 (Anthropic) و HTTP-date (Retry-After).
+    """
+    if not value:
+        return None
+    value = value.strip()
+    
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    
+    # فرمت OpenAI مثل 1h2m3.5s یا 250ms
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if parts and ''.join(n + u for n, u in parts) == value:
+        units = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+        return sum(float(n) * units[u] for n, u in parts)
+    
+    # زمان مطلق (RFC3339 یا HTTP-date)
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            moment = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def _first_header(headers: Mapping[str, str], *names: str) -> Optional[str]:
+    """اولین header موجود از بین نام‌ها"""
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class TokenBucket:
+    """سطل توکن با پر شدن پیوسته (ظرفیت = سقف در دقیقه)"""
+    
+    def __init__(self, per_minute: Optional[float]):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0 if per_minute else None
+        self.tokens = float(per_minute) if per_minute else 0.0
+        self.updated_at = time.monotonic()
+    
+    @property
+    def unlimited(self) -> bool:
+        return not self.capacity
+    
+    def _refill(self):
+        now = time.monotonic()
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def time_until(self, amount: float) -> float:
+        """زمان لازم تا موجود شدن amount (درخواست‌های بزرگ‌تر از ظرفیت به ظرفیت محدود می‌شوند)"""
+        if self.unlimited:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def consume(self, amount: float):
+        """برداشت (ممکن است موقتاً منفی شود)"""
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens -= amount
+    
+    def refund(self, amount: float):
+        """بازگرداندن (یا برداشت اضافه با مقدار منفی)"""
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+    
+    def clamp(self, remaining: float):
+        """هماهنگ‌سازی با مقدار باقی‌مانده‌ای که سرور گزارش داده"""
+        if self.unlimited:
+            return
+        self._refill()
+        self.tokens = min(self.tokens, remaining)
+
+
+class Reservation:
+    """رزرو توکن برای یک درخواست؛ با settle مقدار واقعی ثبت می‌شود"""
+    
+    def __init__(self, limiter: 'ProviderRateLimiter', tokens: int):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.settled = False
+        self.acquired_at = time.time()  # زمان ارسال واقعی درخواست (پس از انتظار محدودیت نرخ)
+    
+    def settle(self, actual_tokens: int):
+        """ثبت مصرف واقعی (از usage پاسخ)"""
+        if self.settled:
+            return
+        # اگر usage گزارش نشده، همان تخمین باقی می‌ماند
+        if actual_tokens > 0:
+            self.limiter.token_bucket.refund(self.tokens - actual_tokens)
+            self.limiter.stats['reserved_tokens'] -= self.tokens - actual_tokens
+        self.settled = True
+    
+    def cancel(self):
+        """بازگرداندن کامل رزرو (درخواست مصرفی نداشته)"""
+        if self.settled:
+            return
+        self.limiter.token_bucket.refund(self.tokens)
+        self.limiter.stats['reserved_tokens'] -= self.tokens
+        self.settled = True
+
+
+class ProviderRateLimiter:
+    """محدودکننده RPM + TPM یک provider با پشتیبانی از Retry-After"""
+    
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0  # time.monotonic
+        self._lock: Optional[asyncio.Lock] = None
+        self._lock_loop = None
+        
+        self.stats = {
+            'requests': 0,
+            'reserved_tokens': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'throttled': 0
+        }
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'ProviderRateLimiter':
+        """ساخت از تنظیمات یک provider در rate_limits"""
+        config = config or {}
+        return cls(
+            requests_per_minute=config.get('requests_per_minute'),
+            tokens_per_minute=config.get('tokens_per_minute')
+        )
+    
+    def _get_lock(self) -> asyncio.Lock:
+        """Lock مخصوص event loop جاری (صف FIFO منتظرها)"""
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+    
+    async def acquire(self, estimated_tokens: int) -> Reservation:
+        """صبر تا آزاد شدن سهمیه و رزرو یک درخواست + توکن‌های تخمینی"""
+        async with self._get_lock():
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait <= 0:
+                    wait = max(
+                        self.request_bucket.time_until(1),
+                        self.token_bucket.time_until(estimated_tokens)
+                    )
+                if wait <= 0:
+                    break
+                
+                self.stats['waits'] += 1
+                self.stats['wait_time'] += wait
+                await asyncio.sleep(wait)
+            
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(estimated_tokens)
+            self.stats['requests'] += 1
+            self.stats['reserved_tokens'] += estimated_tokens
+        
+        return Reservation(self, estimated_tokens)
+    
+    @asynccontextmanager
+    async def reserve(self, estimated_tokens: int) -> AsyncIterator[Reservation]:
+        """رزرو برای مدت یک درخواست؛ رزرو settle نشده در پایان بازگردانده می‌شود"""
+        reservation = await self.acquire(estimated_tokens)
+        try:
+            yield reservation
+        finally:
+            reservation.cancel()
+    
+    def observe(self, status: int, headers: Mapping[str, str]) -> Optional[float]:
+        """به‌روزرسانی وضعیت از header های پاسخ
+
+        Returns:
+            زمان انتظار پیشنهادی سرور (ثانیه) یا None
+        """
+        now = time.monotonic()
+        
+        retry_after = None
+        retry_after_ms = headers.get('retry-after-ms')
+        if retry_after_ms:
+            retry_after = parse_duration(retry_after_ms)
+            retry_after = retry_after / 1000 if retry_after is not None else None
+        if retry_after is None:
+            retry_after = parse_duration(headers.get('retry-after'))
+        
+        if status == 429:
+            self.stats['throttled'] += 1
+        
+        if retry_after is not None and status in (429, 503):
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        
+        # header های OpenAI و Anthropic
+        limits = (
+            (self.request_bucket,
+             ('x-ratelimit-remaining-requests', 'anthropic-ratelimit-requests-remaining'),
+             ('x-ratelimit-reset-requests', 'anthropic-ratelimit-requests-reset')),
+            (self.token_bucket,
+             ('x-ratelimit-remaining-tokens', 'anthropic-ratelimit-tokens-remaining'),
+             ('x-ratelimit-reset-tokens', 'anthropic-ratelimit-tokens-reset'))
+        )
+        for bucket, remaining_names, reset_names in limits:
+            remaining = _first_header(headers, *remaining_names)
+            if remaining is None:
+                continue
+            try:
+                remaining_value = float(remaining)
+            except ValueError:
+                continue
+            
+            bucket.clamp(remaining_value)
+            if remaining_value <= 0:
+                reset = parse_duration(_first_header(headers, *reset_names))
+                if reset:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+        
+        return retry_after
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار limiter"""
+        return {
+            **self.stats,
+            'wait_time': round(self.stats['wait_time'], 2),
+            'rpm_limit': self.request_bucket.capacity,
+            'tpm_limit': self.token_bucket.capacity,
+            'blocked_for': round(max(self.blocked_until - time.monotonic(), 0.0), 2)
+        }
+
+
+def estimate_request_tokens(request) -> int:
+    """تخمین توکن‌های یک درخواست با شمارنده محلی + سقف خروجی"""
+    return default_counter.count_request(request) + request.max_tokens
+
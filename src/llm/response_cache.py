@@ -0,0 +1,212 @@
+"""
+Response Cache - کش پاسخ‌های LLM روی دیسک (content-addressed)
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple
+
+
+def _normalize(text: Optional[str]) -> Optional[str]:
+    """یکسان‌سازی متن (پایان خط و فاصله‌های انتهایی)"""
+    if text is None:
+        return None
+    lines = text.replace('\r\n', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+
+def request_fingerprint(
+    prompt: str,
+    system_prompt: Optional[str],
+    context: Optional[List[Dict[str, str]]],
+    max_tokens: int,
+    temperature: float,
+    providers: List[str],
+    stop: Optional[List[str]] = None,
+    stable_context: Optional[List[str]] = None,
+    model: Optional[str] = None,
+    scope: Optional[Dict[str, Optional[str]]] = None
+) -> str:
+    """hash درخواست نرمال‌شده به همراه provider/model ها
+
+    هم کلید کش و هم کلید ادغام درخواست‌های هم‌زمان است. model مدل
+    انتخاب‌شده درخواست (مثلاً با مسیریابی) است و providers مدل پیش‌فرض هر
+    کلاینت. scope (مثلاً
+    feature و task) فقط در کلید ادغام می‌آید تا پاسخ مشترک به درخواست‌دهنده
+    دیگری نسبت داده نشود.
+    """
+    normalized = {
+        'prompt': _normalize(prompt),
+        'system_prompt': _normalize(system_prompt),
+        'context': [
+            {'role': m.get('role'), 'content': _normalize(m.get('content'))}
+            for m in (context or [])
+        ],
+        'max_tokens': max_tokens,
+        'temperature': round(temperature, 3),
+        'providers': providers
+    }
+    if stop:
+        normalized['stop'] = stop
+    if stable_context:
+        normalized['stable_context'] = [_normalize(text) for text in stable_context]
+    if model:
+        normalized['model'] = model
+    if scope:
+        normalized['scope'] = scope
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """کش دائمی پاسخ‌ها با کلید hash درخواست و حذف LRU بر اساس حجم و سن"""
+    
+    def __init__(
+        self,
+        cache_path: str = "./.llm_cache",
+        max_size_mb: float = 200,
+        max_age_days: float = 30,
+        max_temperature: float = 0.5
+    ):
+        self.cache_path = Path(cache_path)
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.max_temperature = max_temperature
+        
+        # key -> حجم فایل (ترتیب = ترتیب LRU، قدیمی‌ترین اول)
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'bytes_saved': 0,
+            'cost_saved': 0.0
+        }
+        
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+    
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'ResponseCache':
+        """ساخت از بخش response_cache تنظیمات"""
+        return cls(
+            cache_path=config.get('path', './.llm_cache'),
+            max_size_mb=config.get('max_size_mb', 200),
+            max_age_days=config.get('max_age_days', 30),
+            max_temperature=config.get('max_temperature', 0.5)
+        )
+    
+    def is_cacheable(self, temperature: float) -> bool:
+        """فقط درخواست‌های کم‌دما (تقریباً قطعی) کش می‌شوند"""
+        return temperature <= self.max_temperature
+    
+    def _entry_path(self, key: str) -> Path:
+        """مسیر فایل یک کلید (دو کاراکتر اول به عنوان زیرپوشه)"""
+        return self.cache_path / key[:2] / f"{key}.json"
+    
+    def _load_index(self):
+        """بازسازی index از فایل‌های موجود (مرتب بر اساس زمان آخرین استفاده)"""
+        entries: List[Tuple[float, str, int]] = []
+        for path in self.cache_path.glob("*/*.json"):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, path.stem, stat.st_size))
+            except OSError:
+                continue
+        
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self.total_bytes += size
+        
+        self._evict()
+    
+    def _remove(self, key: str):
+        """حذف یک ورودی"""
+        size = self._index.pop(key, 0)
+        self.total_bytes -= size
+        try:
+            self._entry_path(key).unlink()
+        except OSError:
+            pass
+    
+    def _evict(self):
+        """حذف قدیمی‌ترین ورودی‌ها تا رسیدن به سقف حجم"""
+        while self._index and self.total_bytes > self.max_size_bytes:
+            oldest_key = next(iter(self._index))
+            self._remove(oldest_key)
+            self.stats['evictions'] += 1
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """خواندن پاسخ از کش (None در صورت miss یا انقضا)"""
+        if key not in self._index:
+            self.stats['misses'] += 1
+            return None
+        
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._remove(key)
+            self.stats['misses'] += 1
+            return None
+        
+        # بررسی سن
+        if time.time() - entry.get('created_at', 0) > self.max_age_seconds:
+            self._remove(key)
+            self.stats['evictions'] += 1
+            self.stats['misses'] += 1
+            return None
+        
+        # به‌روزرسانی ترتیب LRU
+        os.utime(path, None)
+        self._index.move_to_end(key)
+        
+        self.stats['hits'] += 1
+        self.stats['bytes_saved'] += len(entry.get('content', '').encode('utf-8'))
+        self.stats['cost_saved'] += entry.get('cost', 0.0)
+        return entry
+    
+    def put(self, key: str, entry: Dict[str, Any]):
+        """ذخیره پاسخ در کش (نوشتن atomic)"""
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        
+        data = json.dumps({**entry, 'created_at': time.time()}, ensure_ascii=False)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        
+        if key in self._index:
+            self.total_bytes -= self._index[key]
+        size = path.stat().st_size
+        self._index[key] = size
+        self._index.move_to_end(key)
+        self.total_bytes += size
+        self.stats['stores'] += 1
+        
+        self._evict()
+    
+    def clear(self):
+        """پاک کردن کامل کش"""
+        for key in list(self._index):
+            self._remove(key)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار کش"""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'cost_saved': round(self.stats['cost_saved'], 4),
+            'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else 0.0,
+            'entries': len(self._index),
+            'size_mb': round(self.total_bytes / (1024 * 1024), 2)
+        }
@@ -0,0 +1,184 @@
+"""
+Retry Policy - دسته‌بندی خطاها، backoff با decorrelated jitter و مهلت کل هر درخواست
+"""
+
+import random
+import time
+from typing import Optional, Dict, Any
+
+import aiohttp
+
+from llm.rate_limiter import RateLimitError
+from llm.timeouts import timeout_phase
+
+# خطاهایی که تکرار همان درخواست هرگز موفق نمی‌شود
+FATAL_ERRORS = {'client', 'context_length', 'deadline'}
+
+# مراحل timeout که یعنی درخواست گیر کرده (نه سرور در دسترس نیست)
+STALL_PHASES = {'first_byte', 'first_token', 'stall'}
+
+# نشانه‌های خطای بزرگ بودن ورودی در پیام‌های OpenAI، Anthropic و سرورهای سازگار
+CONTEXT_LENGTH_MARKERS = (
+    'context_length_exceeded',
+    'maximum context length',
+    'context window',
+    'prompt is too long'
+)
+
+
+class APIError(Exception):
+    """پاسخ خطای HTTP از provider به همراه status"""
+    
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+class DeadlineExceeded(Exception):
+    """مهلت کل درخواست (در تمام retry ها و fallback ها) تمام شده است"""
+
+
+def classify_error(error: Exception) -> str:
+    """دسته خطا
+
+    قابل تکرار: rate_limit، timeout، server (5xx)، connection و unknown.
+    قطعی: client (4xx)، context_length و deadline.
+    """
+    if isinstance(error, DeadlineExceeded):
+        return 'deadline'
+    if isinstance(error, RateLimitError):
+        return 'rate_limit'
+    if timeout_phase(error):
+        return 'timeout'
+    
+    message = str(error).lower()
+    if any(marker in message for marker in CONTEXT_LENGTH_MARKERS):
+        return 'context_length'
+    
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        if status == 429:
+            return 'rate_limit'
+        if status == 408:
+            return 'timeout'
+        if status >= 500:
+            return 'server'
+        if 400 <= status < 500:
+            return 'client'
+    
+    if isinstance(error, aiohttp.ClientError):
+        return 'connection'
+    return 'unknown'
+
+
+class RetryPolicy:
+    """سیاست مشترک retry همه کلاینت‌ها
+
+    خطاهای قطعی تکرار نمی‌شوند. فاصله retry ها با decorrelated jitter
+    (تصادفی بین base_delay و سه برابر انتظار قبلی، حداکثر max_delay) است تا
+    task های هم‌زمان با هم دوباره ارسال نکنند؛ Retry-After سرور رعایت
+    می‌شود. درخواست گیرکرده (timeout اولین بایت، اولین token یا توقف
+    stream) فقط در تلاش اول بلافاصله دوباره ارسال می‌شود؛ timeout اتصال،
+    408 و گیرکردن‌های تکراری مثل بقیه خطاها backoff دارند.
+    هر درخواست منطقی حداکثر deadline ثانیه در تمام retry ها و fallback ها
+    وقت دارد (LLMRequest.deadline).
+    """
+    
+    def __init__(
+        self,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        deadline: Optional[float] = 600.0
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        
+        self.stats = {
+            'retries': 0,
+            'fatal': 0,
+            'deadline_exceeded': 0,
+            'fallbacks_skipped': 0,  # fallback هایی که به خاطر اتمام مهلت انجام نشدند
+            'wait_time': 0.0,
+            'errors': {}  # دسته خطا -> تعداد
+        }
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'RetryPolicy':
+        """ساخت از بخش retry_policy تنظیمات (deadline صفر یا null = بدون مهلت)"""
+        config = config or {}
+        return cls(
+            base_delay=config.get('base_delay', 1.0),
+            max_delay=config.get('max_delay', 30.0),
+            deadline=config.get('deadline', 600.0) or None
+        )
+    
+    def new_deadline(self) -> Optional[float]:
+        """زمان پایان مهلت برای یک درخواست منطقی تازه"""
+        return time.time() + self.deadline if self.deadline else None
+    
+    def time_left(self, deadline: Optional[float]) -> Optional[float]:
+        """ثانیه‌های باقی‌مانده از مهلت (None اگر مهلتی نیست)؛ DeadlineExceeded اگر تمام شده"""
+        if deadline is None:
+            return None
+        left = deadline - time.time()
+        if left <= 0:
+            raise DeadlineExceeded("مهلت کل درخواست تمام شد")
+        return left
+    
+    def expired(self, deadline: Optional[float]) -> bool:
+        """آیا مهلت تمام شده است (برای تصمیم fallback)"""
+        return deadline is not None and time.time() >= deadline
+    
+    def _backoff(self, kind: str, error: Exception, attempt: int, previous_delay: float) -> float:
+        """زمان انتظار بر اساس دسته خطا"""
+        if attempt == 0 and timeout_phase(error) in STALL_PHASES:
+            return 0.0
+        if isinstance(error, RateLimitError) and error.retry_after is not None:
+            # پخش کردن کمی بعد از Retry-After تا همه با هم برنگردند
+            return error.retry_after + random.uniform(0, self.base_delay)
+        upper = max(previous_delay, self.base_delay) * 3
+        return min(self.max_delay, random.uniform(self.base_delay, upper))
+    
+    def next_delay(
+        self,
+        error: Exception,
+        attempt: int,
+        max_attempts: int,
+        previous_delay: float,
+        deadline: Optional[float]
+    ) -> Optional[float]:
+        """زمان انتظار تا تلاش بعدی؛ None یعنی retry نباید انجام شود
+
+        Args:
+            attempt: شماره تلاش ناموفق (از صفر)
+            previous_delay: انتظار قبل از همین تلاش (صفر برای تلاش اول)
+        """
+        kind = classify_error(error)
+        self.stats['errors'][kind] = self.stats['errors'].get(kind, 0) + 1
+        
+        if kind in FATAL_ERRORS:
+            if kind == 'deadline':
+                self.stats['deadline_exceeded'] += 1
+            else:
+                self.stats['fatal'] += 1
+            return None
+        if attempt >= max_attempts - 1:
+            return None
+        
+        delay = self._backoff(kind, error, attempt, previous_delay)
+        if deadline is not None and time.time() + delay >= deadline:
+            self.stats['deadline_exceeded'] += 1
+            return None
+        
+        self.stats['retries'] += 1
+        self.stats['wait_time'] += delay
+        return delay
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار retry ها"""
+        return {
+            **self.stats,
+            'wait_time': round(self.stats['wait_time'], 2),
+            'errors': dict(self.stats['errors'])
+        }
@@ -0,0 +1,54 @@
+"""
+Single Flight - ادغام درخواست‌های یکسان هم‌زمان در یک فراخوانی
+"""
+
+import asyncio
+from typing import Dict, Any, Callable, Awaitable
+
+
+class SingleFlight:
+    """اجرای فقط یک فراخوانی برای هر کلید؛ بقیه منتظر همان نتیجه می‌مانند
+
+    فراخوانی اصلی در یک task جداگانه اجرا می‌شود تا cancel شدن یکی از
+    منتظرها بقیه را بی‌نتیجه نگذارد.
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            'calls': 0,       # فراخوانی‌های واقعی
+            'coalesced': 0    # درخواست‌هایی که به فراخوانی موجود پیوستند
+        }
+    
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """اجرای factory برای کلید یا پیوستن به اجرای در حال انجام"""
+        task = self._inflight.get(key)
+        
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            self.stats['calls'] += 1
+            
+            def _forget(done_task: asyncio.Task):
+                if self._inflight.get(key) is done_task:
+                    del self._inflight[key]
+            
+            task.add_done_callback(_forget)
+        else:
+            self.stats['coalesced'] += 1
+        
+        return await asyncio.shield(task)
+    
+    @property
+    def in_flight(self) -> int:
+        """تعداد فراخوانی‌های در حال اجرا"""
+        return len(self._inflight)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار ادغام درخواست‌ها"""
+        total = self.stats['calls'] + self.stats['coalesced']
+        return {
+            **self.stats,
+            'in_flight': self.in_flight,
+            'coalesced_rate': round(self.stats['coalesced'] / total, 3) if total else 0.0
+        }
@@ -0,0 +1,170 @@
+"""
+Streaming - خواندن پاسخ‌های stream (SSE) از API های OpenAI و Anthropic
+"""
+
+import json
+import time
+from typing import Optional, AsyncIterator, Tuple, Any, Dict
+from dataclasses import dataclass, field
+
+from llm.prompt_cache import parse_usage, total_tokens
+from llm.token_counter import default_counter
+
+
+@dataclass
+class StreamChunk:
+    """یک تکه از پاسخ stream
+
+    chunk پایانی done=True دارد و response کامل (LLMResponse) را حمل می‌کند.
+    """
+    text: str
+    done: bool = False
+    response: Optional[Any] = None
+
+
+@dataclass
+class StreamState:
+    """وضعیت یک stream در حال خواندن (usage و زمان‌ها)"""
+    start_time: float = field(default_factory=time.time)
+    first_token_time: Optional[float] = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+    finish_reason: Optional[str] = None
+    
+    def usage(self) -> Dict[str, int]:
+        """usage یکسان‌شده (input_tokens بدون token های کش)"""
+        return {
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'cache_creation_input_tokens': self.cache_creation_input_tokens,
+            'cache_read_input_tokens': self.cache_read_input_tokens
+        }
+    
+    def estimate_partial(self, request, content: str):
+        """تخمین usage یک stream قطع‌شده که usage پایانی آن نرسیده است
+
+        token های ارسال‌شده از provider هزینه دارند، پس شکست پس از اولین
+        token هم باید در هزینه و دفتر ثبت شود.
+        """
+        if not self.input_tokens and not self.cache_read_input_tokens and not self.cache_creation_input_tokens:
+            self.input_tokens = default_counter.count_request(request)
+        if not self.output_tokens:
+            self.output_tokens = default_counter.count(content)
+    
+    @property
+    def total_tokens(self) -> int:
+        """مجموع token ها"""
+        return total_tokens(self.usage())
+    
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        """زمان رسیدن اولین token (ثانیه)"""
+        if self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+
+async def iter_sse_events(response) -> AsyncIterator[Tuple[str, str]]:
+    """خواندن رویدادهای SSE از بدنه پاسخ aiohttp به صورت (event, data)"""
+    event = 'message'
+    data_lines = []
+    
+    async for raw_line in response.content:
+        line = raw_line.decode('utf-8').rstrip('\r\n')
+        
+        # خط خالی = پایان یک رویداد
+        if not line:
+            if data_lines:
+                yield event, '\n'.join(data_lines)
+            event = 'message'
+            data_lines = []
+            continue
+        
+        # کامنت SSE (مثلاً keep-alive)
+        if line.startswith(':'):
+            continue
+        
+        name, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        
+        if name == 'event':
+            event = value
+        elif name == 'data':
+            data_lines.append(value)
+    
+    if data_lines:
+        yield event, '\n'.join(data_lines)
+
+
+def parse_stream_event(data: str, state: StreamState) -> Tuple[Optional[str], bool]:
+    """استخراج متن از یک رویداد stream (هر دو فرمت OpenAI و Anthropic)
+
+    Returns:
+        (متن یا None, آیا stream تمام شده است)
+    """
+    if data.strip() == '[DONE]':
+        return None, True
+    
+    payload = json.loads(data)
+    
+    # فرمت OpenAI
+    if 'choices' in payload:
+        if payload.get('usage'):
+            usage = parse_usage(payload['usage'])
+            state.input_tokens = usage['input_tokens']
+            state.output_tokens = usage['output_tokens']
+            state.cache_read_input_tokens = usage['cache_read_input_tokens']
+            state.cache_creation_input_tokens = usage['cache_creation_input_tokens']
+        
+        choices = payload['choices']
+        if not choices:
+            return None, False
+        
+        if choices[0].get('finish_reason'):
+            state.finish_reason = choices[0]['finish_reason']
+        
+        return choices[0].get('delta', {}).get('content'), False
+    
+    # فرمت Anthropic
+    event_type = payload.get('type')
+    
+    if event_type == 'message_start':
+        usage = payload.get('message', {}).get('usage', {})
+        state.input_tokens = usage.get('input_tokens', 0)
+        state.output_tokens = usage.get('output_tokens', 0)
+        state.cache_read_input_tokens = usage.get('cache_read_input_tokens', 0)
+        state.cache_creation_input_tokens = usage.get('cache_creation_input_tokens', 0)
+    
+    elif event_type == 'content_block_delta':
+        delta = payload.get('delta', {})
+        if delta.get('type') == 'text_delta':
+            return delta.get('text'), False
+    
+    elif event_type == 'message_delta':
+        state.output_tokens = payload.get('usage', {}).get('output_tokens', state.output_tokens)
+        state.finish_reason = payload.get('delta', {}).get('stop_reason') or state.finish_reason
+    
+    elif event_type == 'message_stop':
+        return None, True
+    
+    elif event_type == 'error':
+        raise Exception(f"Stream error: {payload.get('error', {}).get('message', payload)}")
+    
+    return None, False
+
+
+async def read_text_stream(response, state: StreamState) -> AsyncIterator[str]:
+    """خواندن متن پاسخ stream و به‌روزرسانی state"""
+    async for _, data in iter_sse_events(response):
+        text, finished = parse_stream_event(data, state)
+        
+        if text:
+            if state.first_token_time is None:
+                state.first_token_time = time.time()
+            yield text
+        
+        if finished:
+            return
@@ -0,0 +1,330 @@
+"""
+Symbol Index - ایندکس AST از کلاس‌ها و توابع مخزن و نمای stub آن‌ها برای prompt
+"""
+
+import ast
+import json
+import os
+import re
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Set
+
+from llm.token_counter import TokenCounter, default_counter
+from utils.file_utils import AtomicFileWriter
+
+DEFAULT_EXCLUDE_DIRS = [
+    '.git', '__pycache__', '.llm_cache', '.llm_ledger', 'venv', '.venv',
+    'node_modules', 'build', 'dist', '.pytest_cache', '.mypy_cache'
+]
+
+_IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def _first_line(docstring: Optional[str]) -> Optional[str]:
+    """خط اول docstring (خلاصه)"""
+    if not docstring:
+        return None
+    return docstring.strip().splitlines()[0].strip()
+
+
+def _function_stub(node, indent: str = "") -> str:
+    """امضای یک تابع با decorator ها و خلاصه docstring، بدنه با ..."""
+    lines = [f"{indent}@{ast.unparse(decorator)}" for decorator in node.decorator_list]
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    lines.append(f"{indent}{prefix} {node.name}({ast.unparse(node.args)}){returns}:")
+    
+    summary = _first_line(ast.get_docstring(node))
+    if summary:
+        lines.append(f'{indent}    """{summary}"""')
+    lines.append(f"{indent}    ...")
+    return '\n'.join(lines)
+
+
+def _class_stub(node: ast.ClassDef) -> str:
+    """کلاس با فیلدهای annotate‌شده (dataclass) و امضای متدهای عمومی"""
+    lines = [f"@{ast.unparse(decorator)}" for decorator in node.decorator_list]
+    bases = [ast.unparse(base) for base in node.bases] + [ast.unparse(k) for k in node.keywords]
+    lines.append(f"class {node.name}({', '.join(bases)}):" if bases else f"class {node.name}:")
+    
+    summary = _first_line(ast.get_docstring(node))
+    if summary:
+        lines.append(f'    """{summary}"""')
+    
+    members = 0
+    for item in node.body:
+        if isinstance(item, ast.AnnAssign) and isinstance(item.target, ast.Name):
+            default = f" = {ast.unparse(item.value)}" if item.value is not None else ""
+            lines.append(f"    {item.target.id}: {ast.unparse(item.annotation)}{default}")
+            members += 1
+        elif isinstance(item, ast.Assign) and all(isinstance(t, ast.Name) for t in item.targets):
+            # ثابت‌های کلاس (مثلاً اعضای Enum)
+            names = ', '.join(t.id for t in item.targets)
+            lines.append(f"    {names} = {ast.unparse(item.value)}")
+            members += 1
+        elif isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if item.name.startswith('_') and item.name != '__init__':
+                continue
+            lines.append(_function_stub(item, indent="    "))
+            members += 1
+    
+    if not members:
+        lines.append("    ...")
+    return '\n'.join(lines)
+
+
+def parse_module(source: str) -> Dict[str, Any]:
+    """استخراج symbol ها (stub هر کدام) و import های یک فایل Python"""
+    tree = ast.parse(source)
+    symbols: Dict[str, str] = {}
+    imports: List[Dict[str, Any]] = []
+    
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            symbols[node.name] = _class_stub(node)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            symbols[node.name] = _function_stub(node)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            imports.append({'module': node.module, 'names': [alias.name for alias in node.names]})
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.append({'module': alias.name, 'names': []})
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1:
+            # ثابت‌های سطح ماژول با نام بزرگ
+            target = node.targets[0]
+            if isinstance(target, ast.Name) and target.id.isupper():
+                value = ast.unparse(node.value)
+                if len(value) <= 120:
+                    symbols[target.id] = f"{target.id} = {value}"
+    
+    return {
+        'docstring': _first_line(ast.get_docstring(tree)),
+        'symbols': symbols,
+        'imports': imports
+    }
+
+
+class SymbolIndex:
+    """ایندکس دائمی symbol های سطح بالای فایل‌های Python مخزن
+
+    هر فایل فقط وقتی mtime یا حجمش تغییر کند دوباره parse می‌شود. برای
+    وابستگی‌های یک فایل (import ها) یا نام‌هایی که در توضیح task آمده‌اند
+    نمای stub (امضا، فیلدهای dataclass و خلاصه docstring) ساخته می‌شود که
+    معمولاً یک دهم متن کامل فایل است.
+    """
+    
+    def __init__(
+        self,
+        root: str = ".",
+        index_path: str = "./.llm_cache/symbol_index.json",
+        source_roots: Optional[List[str]] = None,
+        exclude_dirs: Optional[List[str]] = None
+    ):
+        self.root = Path(root)
+        self.index_path = Path(index_path)
+        self.source_roots = source_roots or ['src', '.']
+        self.exclude_dirs = set(exclude_dirs or DEFAULT_EXCLUDE_DIRS)
+        
+        # مسیر نسبی -> {mtime, size, module, docstring, symbols, imports}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.modules: Dict[str, str] = {}  # نام ماژول -> مسیر نسبی
+        
+        self.stats = {
+            'files_parsed': 0,
+            'parse_errors': 0,
+            'stub_views': 0,
+            'stub_tokens': 0
+        }
+        
+        self._load()
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'SymbolIndex':
+        """ساخت از بخش context_retrieval تنظیمات"""
+        config = config or {}
+        return cls(
+            root=config.get('root', '.'),
+            index_path=config.get('symbol_index_path', './.llm_cache/symbol_index.json'),
+            source_roots=config.get('source_roots'),
+            exclude_dirs=config.get('exclude_dirs')
+        )
+    
+    def _load(self):
+        """بارگذاری ایندکس ذخیره‌شده"""
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f)
+            self.modules = {entry['module']: path for path, entry in self.files.items()}
+        except Exception as e:
+            print(f"⚠️  ایندکس symbol نامعتبر است و دوباره ساخته می‌شود: {e}")
+            self.files = {}
+            self.modules = {}
+    
+    def _save(self):
+        """ذخیره atomic ایندکس"""
+        with AtomicFileWriter(str(self.index_path)) as writer:
+            writer.write(json.dumps(self.files, ensure_ascii=False))
+    
+    def _module_name(self, path: str) -> str:
+        """نام ماژول یک فایل نسبت به نزدیک‌ترین source root"""
+        parts = Path(path).with_suffix('').parts
+        for source_root in self.source_roots:
+            root_parts = Path(source_root).parts
+            if root_parts and parts[:len(root_parts)] == root_parts:
+                parts = parts[len(root_parts):]
+                break
+        if parts and parts[-1] == '__init__':
+            parts = parts[:-1]
+        return '.'.join(parts)
+    
+    def refresh(self) -> int:
+        """parse دوباره فایل‌های جدید یا تغییرکرده و حذف فایل‌های پاک‌شده
+
+        Returns:
+            تعداد فایل‌های parse‌شده
+        """
+        seen = set()
+        changed = 0
+        
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if d not in self.exclude_dirs]
+            for filename in filenames:
+                if not filename.endswith('.py'):
+                    continue
+                full_path = os.path.join(dirpath, filename)
+                path = os.path.relpath(full_path, self.root)
+                seen.add(path)
+                
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                entry = self.files.get(path)
+                if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                    continue
+                
+                try:
+                    with open(full_path, 'r', encoding='utf-8') as f:
+                        parsed = parse_module(f.read())
+                except (SyntaxError, UnicodeDecodeError, OSError):
+                    # فایل نیمه‌کاره یا خراب: نسخه قبلی (اگر بود) نگه داشته می‌شود
+                    self.stats['parse_errors'] += 1
+                    continue
+                
+                self.files[path] = {
+                    'mtime': stat.st_mtime,
+                    'size': stat.st_size,
+                    'module': self._module_name(path),
+                    **parsed
+                }
+                changed += 1
+        
+        removed = [path for path in self.files if path not in seen]
+        for path in removed:
+            del self.files[path]
+        
+        if changed or removed:
+            self.modules = {entry['module']: path for path, entry in self.files.items()}
+            self.stats['files_parsed'] += changed
+            self._save()
+        return changed
+    
+    def _dependencies(self, source: str) -> Dict[str, Optional[Set[str]]]:
+        """ماژول‌های داخلی import‌شده در یک کد (نام ماژول -> نام‌ها یا None برای کل ماژول)"""
+        try:
+            imports = parse_module(source)['imports']
+        except SyntaxError:
+            return {}
+        
+        dependencies: Dict[str, Optional[Set[str]]] = {}
+        for item in imports:
+            module = item['module']
+            if module not in self.modules:
+                continue
+            if not item['names'] or '*' in item['names']:
+                dependencies[module] = None
+            elif dependencies.get(module, set()) is not None:
+                dependencies.setdefault(module, set()).update(item['names'])
+        return dependencies
+    
+    def _mentioned(self, text: str, exclude_path: Optional[str]) -> Dict[str, Set[str]]:
+        """symbol هایی که نامشان (کلاس یا تابع، حداقل 4 کاراکتر) در متن آمده"""
+        words = {word for word in _IDENTIFIER_PATTERN.findall(text) if len(word) >= 4}
+        mentioned: Dict[str, Set[str]] = {}
+        for path, entry in self.files.items():
+            if path == exclude_path:
+                continue
+            names = words & entry['symbols'].keys()
+            if names:
+                mentioned[entry['module']] = names
+        return mentioned
+    
+    def module_stub(self, module: str, names: Optional[Set[str]] = None) -> str:
+        """نمای stub یک ماژول (فقط names اگر داده شود)"""
+        entry = self.files[self.modules[module]]
+        symbols = entry['symbols']
+        selected = [symbols[name] for name in symbols if names is None or name in names]
+        header = f"# {module} ({self.modules[module]})"
+        if entry.get('docstring'):
+            header += f" - {entry['docstring']}"
+        return '\n\n'.join([header] + selected)
+    
+    def stub_view(
+        self,
+        file_path: str,
+        text: str = "",
+        token_budget: int = 1000,
+        counter: Optional[TokenCounter] = None
+    ) -> str:
+        """stub وابستگی‌های یک فایل در سقف token_budget
+
+        وابستگی‌ها از import های نسخه فعلی فایل (اگر وجود دارد) و نام
+        symbol هایی که در text (مثلاً توضیح task) آمده‌اند به دست می‌آیند.
+        ایندکس refresh نمی‌شود؛ فراخواننده یک بار در هر task آن را به‌روز می‌کند.
+        """
+        counter = counter or default_counter
+        
+        target = os.path.relpath(file_path, self.root)
+        wanted: Dict[str, Optional[Set[str]]] = {}
+        
+        source_path = self.root / target
+        if source_path.exists():
+            try:
+                wanted.update(self._dependencies(source_path.read_text(encoding='utf-8')))
+            except (OSError, UnicodeDecodeError):
+                pass
+        
+        for module, names in self._mentioned(text, target).items():
+            if module in wanted:
+                if wanted[module] is not None:
+                    wanted[module] |= names
+            else:
+                wanted[module] = names
+        
+        target_module = self.files.get(target, {}).get('module')
+        stubs = []
+        used = 0
+        for module, names in wanted.items():
+            if module == target_module:
+                continue
+            stub = self.module_stub(module, names)
+            tokens = counter.count(stub)
+            if used + tokens > token_budget:
+                continue
+            stubs.append(stub)
+            used += tokens
+        
+        if stubs:
+            self.stats['stub_views'] += 1
+            self.stats['stub_tokens'] += used
+        return '\n\n'.join(stubs)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار ایندکس"""
+        return {
+            **self.stats,
+            'files': len(self.files),
+            'symbols': sum(len(entry['symbols']) for entry in self.files.values())
+        }
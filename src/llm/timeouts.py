@@ -0,0 +1,159 @@
+"""
+Timeouts - timeout جداگانه برای اتصال، اولین بایت، اولین token و توقف stream، و ثبت زمان هر مرحله
+"""
+
+import asyncio
+import aiohttp
+from typing import Optional, Dict, Any, AsyncIterator
+
+from llm.hedging import LatencyTracker
+
+# aiohttp قبل از 3.10 فقط ServerTimeoutError را برای timeout اتصال و خواندن دارد
+_CONNECT_TIMEOUT_ERROR = getattr(aiohttp, 'ConnectionTimeoutError', None)
+_SOCKET_TIMEOUT_ERROR = getattr(aiohttp, 'SocketTimeoutError', aiohttp.ServerTimeoutError)
+
+
+class PhaseTimeout(asyncio.TimeoutError):
+    """یکی از مراحل درخواست بیش از حد مجاز طول کشید"""
+    
+    def __init__(self, phase: str, seconds: float):
+        super().__init__(f"timeout در مرحله {phase} (بیش از {seconds:g}s)")
+        self.phase = phase
+        self.seconds = seconds
+
+
+def timeout_phase(error: Exception, streaming: bool = False, first_token_seen: bool = False) -> Optional[str]:
+    """مرحله‌ای که خطا در آن رخ داده (None اگر خطا timeout نیست)
+
+    timeout خواندن socket در stream قبل از اولین token یعنی first_token و
+    بعد از آن یعنی stall است؛ در حالت عادی یعنی first_byte.
+    """
+    if isinstance(error, PhaseTimeout):
+        return error.phase
+    if _CONNECT_TIMEOUT_ERROR and isinstance(error, _CONNECT_TIMEOUT_ERROR):
+        return 'connect'
+    if isinstance(error, _SOCKET_TIMEOUT_ERROR):
+        if not streaming:
+            return 'first_byte'
+        return 'stall' if first_token_seen else 'first_token'
+    if isinstance(error, asyncio.TimeoutError):
+        return 'total'
+    return None
+
+
+class PhaseTimeouts:
+    """timeout های هر مرحله یک درخواست و آمار زمان‌بندی آن‌ها
+
+    - connect: برقراری اتصال TCP/TLS
+    - first_byte: رسیدن header پاسخ (در حالت غیر stream یعنی کل تولید)
+    - first_token: رسیدن اولین token در stream
+    - stall: حداکثر فاصله بین دو تکه متن در stream
+    - total: کل درخواست
+
+    timeout هر مرحله خطای PhaseTimeout می‌دهد تا درخواست گیرکرده یک بار
+    بدون backoff دوباره ارسال شود یا به provider بعدی برود.
+    """
+    
+    def __init__(
+        self,
+        connect: float = 10.0,
+        first_byte: Optional[float] = None,
+        first_token: float = 60.0,
+        stall: float = 30.0,
+        total: float = 300.0,
+        window: int = 100
+    ):
+        self.connect = connect
+        self.first_byte = first_byte or total
+        self.first_token = first_token
+        self.stall = stall
+        self.total = total
+        self.timings = LatencyTracker(window)  # مرحله -> زمان‌های اخیر
+        
+        self.stats = {
+            'connect': 0,
+            'first_byte': 0,
+            'first_token': 0,
+            'stall': 0,
+            'total': 0
+        }
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None, total: float = 300.0) -> 'PhaseTimeouts':
+        """ساخت از بخش timeouts تنظیمات (total پیش‌فرض همان timeout کلاینت)"""
+        config = config or {}
+        return cls(
+            connect=config.get('connect', 10.0),
+            first_byte=config.get('first_byte'),
+            first_token=config.get('first_token', 60.0),
+            stall=config.get('stall', 30.0),
+            total=config.get('total', total)
+        )
+    
+    def client_timeout(self, streaming: bool = False, time_left: Optional[float] = None) -> aiohttp.ClientTimeout:
+        """timeout aiohttp
+
+        در stream، sock_read برابر first_token است (انتظار header و اولین
+        token)؛ بعد از اولین token، watch سقف تنگ‌تر stall را اعمال می‌کند.
+        total به زمان باقی‌مانده از مهلت درخواست (time_left) محدود می‌شود.
+        """
+        return aiohttp.ClientTimeout(
+            total=min(self.total, time_left) if time_left is not None else self.total,
+            sock_connect=self.connect,
+            sock_read=self.first_token if streaming else self.first_byte
+        )
+    
+    def record(self, phase: str, seconds: Optional[float]):
+        """ثبت زمان یک مرحله"""
+        if seconds is not None:
+            self.timings.record(phase, seconds)
+    
+    def record_error(self, error: Exception, streaming: bool = False, first_token_seen: bool = False) -> Optional[str]:
+        """شمارش خطای timeout بر اساس مرحله؛ مرحله یا None"""
+        phase = timeout_phase(error, streaming, first_token_seen)
+        if phase:
+            self.stats[phase] += 1
+        return phase
+    
+    async def watch(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """اعمال timeout اولین token و توقف روی تکه‌های متن یک stream
+
+        stream گیرکرده بسته می‌شود (و اتصال آن با خروج از session.post) و
+        PhaseTimeout بالا می‌رود. بیشترین فاصله بین تکه‌ها ثبت می‌شود.
+        """
+        loop = asyncio.get_running_loop()
+        phase, limit = 'first_token', self.first_token
+        longest_gap = None
+        last = loop.time()
+        
+        try:
+            while True:
+                try:
+                    text = await asyncio.wait_for(chunks.__anext__(), limit)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    raise PhaseTimeout(phase, limit) from None
+                
+                if phase == 'stall':
+                    longest_gap = max(longest_gap or 0.0, loop.time() - last)
+                phase, limit = 'stall', self.stall
+                yield text
+                last = loop.time()  # زمان مصرف‌کننده جزو فاصله نیست
+        finally:
+            await chunks.aclose()
+            self.record('max_gap', longest_gap)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """تعداد timeout هر مرحله و p50/p95 زمان‌های ثبت‌شده"""
+        timings = {}
+        for phase in ('first_byte', 'first_token', 'max_gap'):
+            if self.timings.count(phase):
+                timings[phase] = {
+                    'p50': round(self.timings.percentile(phase, 50), 3),
+                    'p95': round(self.timings.percentile(phase, 95), 3)
+                }
+        return {
+            'timeouts': dict(self.stats),
+            'timings': timings
+        }
@@ -0,0 +1,90 @@
+"""
+Token Counter - شمارش محلی token ها برای برآورد هزینه و طول قبل از ارسال
+"""
+
+import math
+import re
+from typing import Optional, Dict, Any
+
+# کلمه، فاصله یا یک علامت تکی (تقریب BPE بدون نیاز به vocab)
+_PIECE_PATTERN = re.compile(r"\s+|\w+|[^\w\s]", re.UNICODE)
+
+# سربار قالب‌بندی هر پیام (role و جداکننده‌ها)
+MESSAGE_OVERHEAD = 4
+
+
+class TokenCounter:
+    """شمارنده token کاملاً محلی
+
+    اگر tiktoken نصب باشد و encoding آن بدون شبکه بارگذاری شود از آن استفاده
+    می‌شود؛ در غیر این صورت یک تخمین‌گر قاعده‌محور که کمی بیش‌برآورد می‌کند
+    (برای کنترل بودجه، بیش‌برآورد امن‌تر است).
+    """
+    
+    def __init__(self, encoding: Optional[str] = None):
+        self.encoding_name = encoding
+        self._encoding = None
+        
+        if encoding:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(encoding)
+            except Exception as e:
+                print(f"⚠️  tokenizer {encoding} در دسترس نیست؛ استفاده از تخمین محلی ({type(e).__name__})")
+    
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]] = None) -> 'TokenCounter':
+        """ساخت از بخش cost_control تنظیمات"""
+        config = config or {}
+        return cls(encoding=config.get('tokenizer_encoding'))
+    
+    @property
+    def backend(self) -> str:
+        """نام روش شمارش"""
+        return self.encoding_name if self._encoding else 'heuristic'
+    
+    def count(self, text: Optional[str]) -> int:
+        """تعداد token های یک متن"""
+        if not text:
+            return 0
+        if self._encoding:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return self._estimate(text)
+    
+    @staticmethod
+    def _estimate(text: str) -> int:
+        """تخمین BPE: کلمات ASCII حدود 4 کاراکتر، متن غیر ASCII (فارسی) هر کاراکتر یک token"""
+        tokens = 0
+        for piece in _PIECE_PATTERN.findall(text):
+            if piece.isspace():
+                # یک فاصله به کلمه بعدی می‌چسبد؛ تورفتگی و خطوط خالی چند token
+                if len(piece) > 1:
+                    tokens += math.ceil(len(piece) / 4)
+            elif piece.isascii():
+                tokens += math.ceil(len(piece) / 4)
+            else:
+                tokens += len(piece)
+        return tokens
+    
+    def count_request(self, request) -> int:
+        """token های ورودی یک LLMRequest (system، بلوک‌های ثابت، تاریخچه و prompt)"""
+        tokens = 0
+        messages = 1
+        
+        if request.system_prompt:
+            tokens += self.count(request.system_prompt)
+            messages += 1
+        
+        for text in request.stable_context or []:
+            tokens += self.count(text)
+        
+        for message in request.context or []:
+            tokens += self.count(message.get('content'))
+            messages += 1
+        
+        tokens += self.count(request.prompt)
+        return tokens + messages * MESSAGE_OVERHEAD
+
+
+# شمارنده پیش‌فرض برای استفاده‌های بدون تنظیمات (مثل rate limiter)
+default_counter = TokenCounter()
@@ -0,0 +1,85 @@
+"""
+File Utilities - ابزارهای کار با فایل
+"""
+
+import os
+import stat
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+class AtomicFileWriter:
+    """نوشتن تدریجی در یک فایل موقت و جایگزینی atomic فایل مقصد در پایان
+
+    تا زمان commit فایل مقصد دست نمی‌خورد، پس خواننده‌ها هرگز فایل نیمه‌کاره نمی‌بینند.
+    در صورت خطا (یا abort) فایل موقت حذف می‌شود.
+    """
+    
+    def __init__(self, path: str, encoding: str = 'utf-8'):
+        self.path = Path(path)
+        self.encoding = encoding
+        self.bytes_written = 0
+        self._file = None
+        self._tmp_path: Optional[str] = None
+        self._finished = False
+    
+    def open(self) -> 'AtomicFileWriter':
+        """ساخت فایل موقت در همان پوشه مقصد (برای rename روی همان filesystem)"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(
+            dir=self.path.parent,
+            prefix=f".{self.path.name}.",
+            suffix=".tmp"
+        )
+        self._file = os.fdopen(fd, 'w', encoding=self.encoding)
+        return self
+    
+    def write(self, text: str):
+        """نوشتن یک تکه و flush فوری"""
+        self._file.write(text)
+        self._file.flush()
+        self.bytes_written += len(text.encode(self.encoding))
+    
+    def commit(self):
+        """بستن فایل موقت و جایگزینی atomic فایل مقصد"""
+        if self._finished:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        os.chmod(self._file.fileno(), self._target_mode())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+        self._finished = True
+    
+    def _target_mode(self) -> int:
+        """دسترسی فایل مقصد (mkstemp فایل را با 0600 می‌سازد)
+
+        فایل موجود دسترسی قبلی خود را نگه می‌دارد و فایل تازه مثل open
+        عادی با 0666 منهای umask ساخته می‌شود.
+        """
+        try:
+            return stat.S_IMODE(os.stat(self.path).st_mode)
+        except FileNotFoundError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o666 & ~umask
+    
+    def abort(self):
+        """لغو نوشتن و حذف فایل موقت"""
+        if self._finished:
+            return
+        self._file.close()
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        self._finished = True
+    
+    def __enter__(self) -> 'AtomicFileWriter':
+        return self.open()
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False